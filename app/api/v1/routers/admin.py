@@ -0,0 +1,73 @@
+from logging import getLogger
+from typing import List
+
+from core.security import verify_admin_token
+from core.storage import StorageDep
+from fastapi import APIRouter, Depends, HTTPException, Response, status
+from schemas.profile import ProfileSummary
+from schemas.slow_query import SlowQuerySummary
+
+router = APIRouter(dependencies=[Depends(verify_admin_token)])
+
+
+@router.get("/admin/slow-queries", response_model=List[SlowQuerySummary])
+def get_slow_queries(storage: StorageDep, limit: int = 20):
+    """
+    Gets the slowest query shapes seen by the service, aggregated by
+    fingerprint and ordered by total time spent
+    """
+    logger = getLogger(__name__ + ".get_slow_queries")
+    try:
+        return storage.slow_query_get_summary(limit=limit)
+    except HTTPException as ex:
+        logger.error(ex)
+        raise ex
+    except Exception as ex:
+        logger.error(ex)
+        raise HTTPException(status_code=500, detail=str(ex))
+
+
+@router.get("/admin/profiles", response_model=List[ProfileSummary])
+def get_profiles(storage: StorageDep, limit: int = 50):
+    """Gets the latest request profiles without their data"""
+    logger = getLogger(__name__ + ".get_profiles")
+    try:
+        return storage.profile_get_all_records(limit=limit)
+    except HTTPException as ex:
+        logger.error(ex)
+        raise ex
+    except Exception as ex:
+        logger.error(ex)
+        raise HTTPException(status_code=500, detail=str(ex))
+
+
+@router.get("/admin/profiles/{request_id}")
+def get_profile(request_id: str, storage: StorageDep):
+    """
+    Gets the profile of a request in speedscope format, which can be
+    opened at https://www.speedscope.app
+    """
+    logger = getLogger(__name__ + ".get_profile")
+    try:
+        profile = storage.profile_get_record(request_id)
+        if profile is None:
+            raise HTTPException(
+                status_code=status.HTTP_404_NOT_FOUND,
+                detail="Profile not found",
+            )
+
+        return Response(
+            content=profile.data,
+            media_type="application/json",
+            headers={
+                "Content-Disposition": (
+                    f'attachment; filename="{request_id}.speedscope.json"'
+                )
+            },
+        )
+    except HTTPException as ex:
+        logger.error(ex)
+        raise ex
+    except Exception as ex:
+        logger.error(ex)
+        raise HTTPException(status_code=500, detail=str(ex))
@@ -1,103 +1,171 @@
+import os
+import shutil
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import ExitStack, contextmanager
+from datetime import datetime
 from logging import getLogger
-from typing import Annotated, Dict, List, Optional
+from tempfile import NamedTemporaryFile
+from typing import (
+    Annotated,
+    BinaryIO,
+    Callable,
+    ContextManager,
+    Dict,
+    List,
+    Optional,
+    Set,
+    Tuple,
+)
+from zipfile import BadZipFile, ZipFile
 
 from bson.objectid import ObjectId
-from core.storage import storage
-from fastapi import APIRouter, Depends, Form, HTTPException, UploadFile
-from fastapi.responses import JSONResponse
-from schemas.agent import Agent, AgentBase, AgentOut, AgentUpdate, Platform
-from schemas.file import FileCategory, FileMetadata
+from core.config import settings
+from core.manifests import manifest_indexer
+from core.responses import ModelJSONResponse
+from core.storage import (
+    SecondaryReads,
+    Storage,
+    StorageDep,
+    get_bucket,
+    is_versioned,
+)
+from core.zipstream import (
+    ZipMember,
+    get_zip_size,
+    safe_member_name,
+    stream_zip,
+)
+from fastapi import (
+    APIRouter,
+    BackgroundTasks,
+    Form,
+    HTTPException,
+    Query,
+    UploadFile,
+    status,
+)
+from fastapi.responses import JSONResponse, StreamingResponse
+from pydantic import ValidationError
+from pydantic_core import to_json
+from schemas.agent import (
+    Agent,
+    AgentBase,
+    AgentImportItem,
+    AgentImportReport,
+    AgentImportResult,
+    AgentOut,
+    AgentUpdate,
+    Platform,
+)
+from schemas.batch import Batch, split_ids
+from schemas.fieldset import Fieldset
+from schemas.file import File, FileCategory, FileMetadata
 from schemas.page import Page
 from schemas.review import Review, ReviewBase, ReviewIn, TargetType
 
 router = APIRouter()
 
-
-def convert_to_agent_out(agent_in: Agent) -> AgentOut:
-    """Converts an agent to AgentOut"""
-    logger = getLogger(__name__ + ".convert_to_agent_out")
+AGENT_FILE_FIELDS = FileCategory.list()
+IMPORT_MANIFEST = "manifest.ndjson"
+# files every platform gets, and the files of each platform
+COMMON_FILES = {
+    FileCategory.METADATA,
+    FileCategory.LOGO,
+    FileCategory.INSRUCTIONS,
+}
+PLATFORM_FILES = {
+    Platform.PA_WEB: {FileCategory.PA_WEB_AP, FileCategory.PA_WEB_AD},
+    Platform.PA_DESK: {FileCategory.PA_DESK_AP, FileCategory.PA_DESK_AD},
+    Platform.UIPATH: {FileCategory.UIPATH_AP, FileCategory.UIPATH_AD},
+    Platform.PYTHON: set(),
+}
+
+
+def convert_to_agents_out(
+    storage: Storage,
+    agents_in: List[Agent],
+    fieldset: Optional[Fieldset] = None,
+) -> List[AgentOut]:
+    """
+    Converts a list of agents to AgentOut, resolving the files of all
+    agents with a single query.
+    If fieldset is supplied the agents are converted to AgentOut narrowed
+    to the selected fields and only the requested files are resolved
+    """
+    logger = getLogger(__name__ + ".convert_to_agents_out")
     try:
-        agent_out = AgentOut(**agent_in.model_dump())
-        metadata = storage.file_get_record(
-            {"agent_id": agent_in.id, "category": FileCategory.METADATA}
-        )
-        if metadata:
-            agent_out.metadata = metadata
-
-        logo = storage.file_get_record(
-            {"agent_id": agent_in.id, "category": FileCategory.LOGO}
-        )
-        if logo:
-            agent_out.logo = logo
-
-        instructions = storage.file_get_record(
-            {"agent_id": agent_in.id, "category": FileCategory.INSRUCTIONS}
-        )
-        if instructions:
-            agent_out.instructions = instructions
-
-        pa_web_agent_package = storage.file_get_record(
-            {"agent_id": agent_in.id, "category": FileCategory.PA_WEB_AP}
-        )
-        if pa_web_agent_package:
-            agent_out.pa_web_agent_package = pa_web_agent_package
-
-        pa_web_agent_dependencies = storage.file_get_record(
-            {"agent_id": agent_in.id, "category": FileCategory.PA_WEB_AD}
-        )
-        if pa_web_agent_dependencies:
-            agent_out.pa_web_agent_dependencies = pa_web_agent_dependencies
-
-        pa_desk_agent_package = storage.file_get_record(
-            {"agent_id": agent_in.id, "category": FileCategory.PA_DESK_AP}
-        )
-        if pa_desk_agent_package:
-            agent_out.pa_desk_agent_package = pa_desk_agent_package
-
-        pa_desk_agent_dependencies = storage.file_get_record(
-            {"agent_id": agent_in.id, "category": FileCategory.PA_DESK_AD}
-        )
-        if pa_desk_agent_dependencies:
-            agent_out.pa_desk_agent_dependencies = pa_desk_agent_dependencies
-
-        uipath_agent_package = storage.file_get_record(
-            {"agent_id": agent_in.id, "category": FileCategory.UIPATH_AP}
-        )
-        if uipath_agent_package:
-            agent_out.uipath_agent_package = uipath_agent_package
+        output_model = AgentOut
+        expand = AGENT_FILE_FIELDS
+        if fieldset is not None:
+            output_model = fieldset.output_model(AgentOut)
+            expand = fieldset.expand
+
+        files = {}
+        if expand:
+            files = storage.file_get_records_by_agent_ids(
+                [agent_in.id for agent_in in agents_in]
+            )
+        agents_out = []
 
-        uipath_agent_dependencies = storage.file_get_record(
-            {"agent_id": agent_in.id, "category": FileCategory.UIPATH_AD}
-        )
-        if uipath_agent_dependencies:
-            agent_out.uipath_agent_dependencies = uipath_agent_dependencies
+        for agent_in in agents_in:
+            # agent_in is already validated, so its attributes are used
+            # as is instead of dumping and revalidating the whole model
+            data = dict(vars(agent_in))
+            for file in files.get(agent_in.id, []):
+                if file.category is not None and file.category.value in expand:
+                    data.setdefault(file.category.value, file)
+            agents_out.append(output_model.model_validate(data))
 
-        return agent_out
+        return agents_out
 
     except Exception as ex:
         logger.exception(ex)
         raise ex
 
 
-@router.get(path="/agents", response_model=Page[AgentOut])
+def convert_to_agent_out(storage: Storage, agent_in: Agent) -> AgentOut:
+    """Converts an agent to AgentOut"""
+    return convert_to_agents_out(storage, [agent_in])[0]
+
+
+@router.get(
+    path="/agents",
+    response_model=Page[AgentOut],
+    dependencies=[SecondaryReads],
+)
 def get_user_agents(
+    storage: StorageDep,
     cursor: Optional[str] = None,
     limit: int = 10,
+    fields: Optional[str] = Query(
+        default=None, description="Comma separated fields to return"
+    ),
+    expand: Optional[str] = Query(
+        default=None,
+        description=f"Comma separated files to resolve: {AGENT_FILE_FIELDS}",
+    ),
 ):
     """Get all current active agents of a user"""
     logger = getLogger(__name__ + ".get_user_agents")
     try:
+        fieldset = Fieldset.parse(AgentOut, AGENT_FILE_FIELDS, fields, expand)
+        record_fields = None
+        if fieldset is not None:
+            record_fields = fieldset.record_fields(Agent)
+
         filter = {}
         if cursor:
             filter["_id"] = {"$gt": ObjectId(cursor)}
 
-        agents = storage.agent_get_all_records(filter, limit=limit)
-        agents = [convert_to_agent_out(agent) for agent in agents]
+        agents = storage.agent_get_all_records(
+            filter, limit=limit, fields=record_fields
+        )
+        agents = convert_to_agents_out(storage, agents, fieldset)
         item_count = len(agents)
         count_filter = filter.copy()
         if "_id" in count_filter:
             del count_filter["_id"]
-        total_count = storage.agents_collection.count_documents(count_filter)
+        total_count = storage.agent_count_records(count_filter)
         next_cursor = None
 
         if item_count > 0:
@@ -110,7 +178,109 @@ def get_user_agents(
             next_cursor=next_cursor,
         )
 
-        return agents_page
+        return ModelJSONResponse(content=agents_page)
+    except HTTPException as ex:
+        logger.error(ex)
+        raise ex
+    except Exception as ex:
+        logger.error(ex)
+        raise HTTPException(status_code=500, detail=str(ex))
+
+
+@router.get(path="/agents/export", dependencies=[SecondaryReads])
+def export_agents(
+    storage: StorageDep,
+    since: Optional[datetime] = Query(
+        default=None,
+        description="Only export agents modified at or after this date",
+    ),
+    fields: Optional[str] = Query(
+        default=None, description="Comma separated fields to return"
+    ),
+    expand: Optional[str] = Query(
+        default=None,
+        description=f"Comma separated files to resolve: {AGENT_FILE_FIELDS}",
+    ),
+):
+    """
+    Streams all agents as newline delimited JSON, one AgentOut per line.
+    Files are resolved in bulk for every batch of agents read from the
+    cursor.
+    """
+    logger = getLogger(__name__ + ".export_agents")
+    try:
+        fieldset = Fieldset.parse(AgentOut, AGENT_FILE_FIELDS, fields, expand)
+        record_fields = None
+        if fieldset is not None:
+            record_fields = fieldset.record_fields(Agent)
+
+        filter = {}
+        if since:
+            filter["date_modified"] = {"$gte": since}
+
+        batches = storage.agent_iter_batches(
+            filter,
+            batch_size=settings.EXPORT_BATCH_SIZE,
+            fields=record_fields,
+        )
+
+        def generate():
+            count = 0
+            try:
+                for batch in batches:
+                    agents = convert_to_agents_out(storage, batch, fieldset)
+                    yield b"".join(to_json(agent) + b"\n" for agent in agents)
+                    count += len(agents)
+            except Exception as ex:
+                logger.exception(ex)
+                raise ex
+            logger.info(f"Exported {count} agents")
+
+        return StreamingResponse(generate(), media_type="application/x-ndjson")
+    except HTTPException as ex:
+        logger.error(ex)
+        raise ex
+    except Exception as ex:
+        logger.error(ex)
+        raise HTTPException(status_code=500, detail=str(ex))
+
+
+@router.get(
+    path="/agents:batch",
+    response_model=Batch[AgentOut],
+    dependencies=[SecondaryReads],
+)
+def get_agents_batch(storage: StorageDep, ids: Annotated[List[str], Query()]):
+    """
+    Get multiple agents by their ids.
+
+    ids may be repeated or comma separated. Results are returned in
+    request order with a not found marker for unknown ids.
+    """
+    logger = getLogger(__name__ + ".get_agents_batch")
+    try:
+        ids = split_ids(ids)
+        if len(ids) > settings.BATCH_MAX_IDS:
+            raise HTTPException(
+                status_code=status.HTTP_400_BAD_REQUEST,
+                detail=f"At most {settings.BATCH_MAX_IDS} ids are allowed",
+            )
+
+        object_ids = list(
+            {ObjectId(id) for id in ids if ObjectId.is_valid(id)}
+        )
+        agents = []
+        if object_ids:
+            agents = storage.agent_get_all_records(
+                {"_id": {"$in": object_ids}}
+            )
+        agents = convert_to_agents_out(storage, agents)
+
+        return ModelJSONResponse(
+            content=Batch[AgentOut].from_records(
+                ids, {agent.id: agent for agent in agents}
+            )
+        )
     except HTTPException as ex:
         logger.error(ex)
         raise ex
@@ -122,14 +292,105 @@ def get_user_agents(
 @router.get(path="/agents/{agent_id}", response_model=AgentOut)
 def get_user_agent(
     agent_id: str,
+    storage: StorageDep,
+    fields: Optional[str] = Query(
+        default=None, description="Comma separated fields to return"
+    ),
+    expand: Optional[str] = Query(
+        default=None,
+        description=f"Comma separated files to resolve: {AGENT_FILE_FIELDS}",
+    ),
 ):
     """Get agent for a user by its id"""
     logger = getLogger(__name__ + ".get_user_agent")
     try:
+        fieldset = Fieldset.parse(AgentOut, AGENT_FILE_FIELDS, fields, expand)
+        if fieldset is None:
+            agent = storage.agent_verify_record({"_id": agent_id})
+            agent = convert_to_agent_out(storage, agent)
+            return ModelJSONResponse(content=agent)
+
+        agents = storage.agent_get_all_records(
+            {"_id": agent_id},
+            limit=1,
+            fields=fieldset.record_fields(Agent),
+        )
+        if not agents:
+            raise HTTPException(
+                status_code=status.HTTP_404_NOT_FOUND,
+                detail="Agent not found",
+            )
+        agent = convert_to_agents_out(storage, agents, fieldset)[0]
+        return ModelJSONResponse(content=agent)
+    except HTTPException as ex:
+        logger.error(ex)
+        raise ex
+    except Exception as ex:
+        logger.error(ex)
+        raise HTTPException(status_code=500, detail=str(ex))
 
-        agent = storage.agent_verify_record({"_id": agent_id})
-        agent = convert_to_agent_out(agent)
-        return agent
+
+@router.get(path="/agents/{agent_id}/bundle", dependencies=[SecondaryReads])
+def download_agent_bundle(
+    agent_id: str,
+    storage: StorageDep,
+    platform: Optional[Platform] = Query(
+        default=None, description="Only bundle the files of this platform"
+    ),
+):
+    """
+    Downloads all files of an agent as a zip with a folder per file
+    category. The zip is written as the files are read, with stored
+    members so its Content-Length is known up front
+    """
+    logger = getLogger(__name__ + ".download_agent_bundle")
+    try:
+        storage.agent_verify_record({"_id": agent_id})
+        files = storage.file_get_all_records({"agent_id": agent_id})
+        if platform is not None:
+            categories = COMMON_FILES | PLATFORM_FILES[platform]
+            files = [file for file in files if file.category in categories]
+        files.sort(key=lambda file: AGENT_FILE_FIELDS.index(file.category))
+
+        # each member is opened once, when it is written, so at most
+        # one handle is open however the stream ends
+        sizes = storage.file_get_data_sizes(files)
+        members = []
+        names: Dict[str, Set[str]] = {}
+        for file in files:
+            folder = file.category.value
+            name = safe_member_name(
+                file.filename, names.setdefault(folder, set())
+            )
+            members.append(
+                ZipMember(
+                    f"{folder}/{name}",
+                    sizes[file.gridfs_id],
+                    file.date_modified,
+                    lambda file=file: storage.file_open_data(
+                        file.gridfs_id, file.bucket
+                    ),
+                )
+            )
+        try:
+            size = get_zip_size(members)
+        except ValueError as ex:
+            raise HTTPException(
+                status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE,
+                detail=str(ex),
+            )
+
+        suffix = f"_{platform.name.lower()}" if platform else ""
+        return StreamingResponse(
+            stream_zip(members, settings.BUNDLE_READ_SIZE),
+            media_type="application/zip",
+            headers={
+                "Content-Length": str(size),
+                "Content-Disposition": (
+                    f"attachment; filename=agent_{agent_id}{suffix}.zip"
+                ),
+            },
+        )
     except HTTPException as ex:
         logger.error(ex)
         raise ex
@@ -140,6 +401,7 @@ def get_user_agent(
 
 @router.post("/agents", response_model=AgentOut)
 async def new_agent(
+    storage: StorageDep,
     name: Annotated[str, Form(...)],
     description: Annotated[str, Form(...)],
     platforms: Annotated[
@@ -211,7 +473,7 @@ async def new_agent(
             logger.info(f"Added intructions file for agent({agent_id})")
 
         if pa_web_agent_package:
-            storage.file_create_record(
+            file_id = storage.file_create_record(
                 data=await pa_web_agent_package.read(),
                 file_data=FileMetadata(
                     filename=pa_web_agent_package.filename,
@@ -220,6 +482,7 @@ async def new_agent(
                     restrict_access=False,
                 ),
             )
+            manifest_indexer.submit(storage, file_id, FileCategory.PA_WEB_AP)
 
             logger.info(
                 f"Added metadata power automate web agent package for agent({agent_id})"
@@ -241,7 +504,7 @@ async def new_agent(
             )
 
         if pa_desk_agent_package:
-            storage.file_create_record(
+            file_id = storage.file_create_record(
                 data=await pa_desk_agent_package.read(),
                 file_data=FileMetadata(
                     filename=pa_desk_agent_package.filename,
@@ -250,6 +513,7 @@ async def new_agent(
                     restrict_access=False,
                 ),
             )
+            manifest_indexer.submit(storage, file_id, FileCategory.PA_DESK_AP)
 
             logger.info(
                 f"Added metadata power automate desk agent package for agent({agent_id})"
@@ -271,7 +535,7 @@ async def new_agent(
             )
 
         if uipath_agent_package:
-            storage.file_create_record(
+            file_id = storage.file_create_record(
                 data=await uipath_agent_package.read(),
                 file_data=FileMetadata(
                     filename=uipath_agent_package.filename,
@@ -280,6 +544,7 @@ async def new_agent(
                     restrict_access=False,
                 ),
             )
+            manifest_indexer.submit(storage, file_id, FileCategory.UIPATH_AP)
 
             logger.info(
                 f"Added metadata uipath agent package for agent({agent_id})"
@@ -300,7 +565,7 @@ async def new_agent(
             )
 
         agent = storage.agent_verify_record({"_id": agent_id})
-        return convert_to_agent_out(agent)
+        return convert_to_agent_out(storage, agent)
     except HTTPException as ex:
         logger.error(ex)
         raise ex
@@ -309,8 +574,193 @@ async def new_agent(
         raise HTTPException(status_code=500, detail=str(ex))
 
 
+@router.post("/agents/import", response_model=AgentImportReport)
+def import_agents(
+    storage: StorageDep,
+    manifest: Optional[UploadFile] = None,
+    artifacts: Optional[List[UploadFile]] = None,
+    archive: Optional[UploadFile] = None,
+) -> AgentImportReport:
+    """
+    Imports agents in bulk.
+
+    Upload either an NDJSON manifest with its artifact files, or a zip
+    archive holding a manifest.ndjson and the artifacts. Each manifest
+    line is an agent with a files mapping of category to artifact name,
+    e.g. {"name": ..., "files": {"logo": "logo.png"}}.
+
+    Agents are created with a single insert, artifacts are streamed into
+    GridFS by a pool of workers and file records are written in bulk.
+    Agents whose artifacts fail to store are rolled back.
+    """
+    logger = getLogger(__name__ + ".import_agents")
+    try:
+        if (manifest is None) == (archive is None):
+            raise HTTPException(
+                status_code=status.HTTP_400_BAD_REQUEST,
+                detail="Upload either a manifest or an archive",
+            )
+
+        with ExitStack() as stack:
+            if archive:
+                with NamedTemporaryFile(suffix=".zip", delete=False) as tmp:
+                    shutil.copyfileobj(archive.file, tmp)
+                stack.callback(os.remove, tmp.name)
+
+                try:
+                    with ZipFile(tmp.name) as zip_file:
+                        lines = zip_file.read(IMPORT_MANIFEST).splitlines()
+                        available = set(zip_file.namelist())
+                except (BadZipFile, KeyError) as ex:
+                    raise HTTPException(
+                        status_code=status.HTTP_400_BAD_REQUEST,
+                        detail=f"Invalid archive: {ex}",
+                    )
+
+                @contextmanager
+                def open_artifact(name: str):
+                    # each worker opens its own handle on the archive
+                    with ZipFile(tmp.name) as zip_file:
+                        with zip_file.open(name) as member:
+                            yield member
+
+            else:
+                lines = manifest.file.read().splitlines()
+                uploads = {
+                    upload.filename: upload for upload in artifacts or []
+                }
+                available = set(uploads)
+
+                @contextmanager
+                def open_artifact(name: str):
+                    upload = uploads[name].file
+                    upload.seek(0)
+                    yield upload
+
+            return run_agents_import(storage, lines, available, open_artifact)
+    except HTTPException as ex:
+        logger.error(ex)
+        raise ex
+    except Exception as ex:
+        logger.error(ex)
+        raise HTTPException(status_code=500, detail=str(ex))
+
+
+def run_agents_import(
+    storage: Storage,
+    lines: List[bytes],
+    available: Set[str],
+    open_artifact: Callable[[str], ContextManager[BinaryIO]],
+) -> AgentImportReport:
+    """
+    Creates the agents of an import manifest and stores their artifacts
+    """
+    logger = getLogger(__name__ + ".run_agents_import")
+    results: Dict[int, AgentImportResult] = {}
+    items: List[Tuple[int, AgentImportItem]] = []
+
+    for index, line in enumerate(lines):
+        if not line.strip():
+            continue
+        try:
+            item = AgentImportItem.model_validate_json(line)
+        except ValidationError as ex:
+            results[index] = AgentImportResult(
+                index=index, created=False, errors=[str(ex)]
+            )
+            continue
+
+        missing = [
+            name for name in item.files.values() if name not in available
+        ]
+        if missing:
+            results[index] = AgentImportResult(
+                index=index,
+                name=item.name,
+                created=False,
+                errors=[f"Missing artifact: {name}" for name in missing],
+            )
+            continue
+        items.append((index, item))
+
+    agent_ids = storage.agent_create_records(
+        [AgentBase(**item.model_dump(exclude={"files"})) for _, item in items]
+    )
+
+    # group by artifact so an artifact shared by several agents is only
+    # ever read by one worker at a time
+    targets: Dict[str, List[Tuple[int, FileMetadata]]] = {}
+    for (index, item), agent_id in zip(items, agent_ids):
+        results[index] = AgentImportResult(
+            index=index, name=item.name, id=agent_id, created=True
+        )
+        for category, name in item.files.items():
+            targets.setdefault(name, []).append(
+                (
+                    index,
+                    FileMetadata(
+                        filename=os.path.basename(name),
+                        agent_id=agent_id,
+                        category=FileCategory(category),
+                        restrict_access=False,
+                    ),
+                )
+            )
+
+    def store_artifact(name: str, files: List[Tuple[int, FileMetadata]]):
+        stored = []
+        for index, file_data in files:
+            try:
+                with open_artifact(name) as data:
+                    gridfs_id = storage.file_put_data(data, file_data)
+                stored.append((index, gridfs_id, file_data))
+            except Exception as ex:
+                logger.error(ex)
+                results[index].created = False
+                results[index].errors.append(f"Failed to store {name}: {ex}")
+        return stored
+
+    with ThreadPoolExecutor(max_workers=settings.IMPORT_WORKERS) as pool:
+        stored = [
+            file
+            for files in pool.map(
+                lambda target: store_artifact(*target), targets.items()
+            )
+            for file in files
+        ]
+
+    created_files = [
+        (gridfs_id, file_data)
+        for index, gridfs_id, file_data in stored
+        if results[index].created
+    ]
+    file_ids = storage.file_create_records(created_files)
+    for file_id, (_, file_data) in zip(file_ids, created_files):
+        manifest_indexer.submit(storage, file_id, file_data.category)
+
+    for index, gridfs_id, file_data in stored:
+        if not results[index].created:
+            storage.file_delete_data(gridfs_id, get_bucket(file_data.category))
+    for result in results.values():
+        if result.id and not result.created:
+            storage.agent_delete_record({"_id": result.id})
+            result.id = None
+
+    items_out = [results[index] for index in sorted(results)]
+    created_count = sum(1 for result in items_out if result.created)
+    logger.info(f"Imported {created_count} agents")
+
+    return AgentImportReport(
+        created_count=created_count,
+        failed_count=len(items_out) - created_count,
+        items=items_out,
+    )
+
+
 @router.patch("/agents/{agent_id}/details_update", response_model=AgentOut)
-async def update_agent_details(agent_id: str, data: AgentUpdate) -> AgentOut:
+async def update_agent_details(
+    agent_id: str, data: AgentUpdate, storage: StorageDep
+) -> AgentOut:
     f"""
     updates an agent's details
 
@@ -321,7 +771,7 @@ async def update_agent_details(agent_id: str, data: AgentUpdate) -> AgentOut:
         update = data.model_dump(exclude_unset=True, exclude_none=True)
         storage.agent_update_record({"_id": agent_id}, update=update)
         agent = storage.agent_verify_record({"_id": agent_id})
-        return convert_to_agent_out(agent)
+        return convert_to_agent_out(storage, agent)
     except HTTPException as ex:
         logger.error(ex)
         raise ex
@@ -330,9 +780,54 @@ async def update_agent_details(agent_id: str, data: AgentUpdate) -> AgentOut:
         raise HTTPException(status_code=500, detail=str(ex))
 
 
+def delete_replaced_data(storage: Storage, file: File):
+    """Deletes the data of a replaced file after the response is sent"""
+    logger = getLogger(__name__ + ".delete_replaced_data")
+    try:
+        storage.file_delete_data(file.gridfs_id, file.bucket)
+    except Exception as ex:
+        logger.error(f"Failed to delete data of file({file.id}): {ex}")
+
+
+def prune_file_versions(storage: Storage, file_id: str):
+    """Deletes the versions of a file past FILE_VERSIONS_KEPT"""
+    logger = getLogger(__name__ + ".prune_file_versions")
+    try:
+        pruned = storage.file_version_prune_records(
+            file_id, settings.FILE_VERSIONS_KEPT
+        )
+        for version in pruned:
+            storage.file_delete_data(version.gridfs_id, version.bucket)
+        if pruned:
+            logger.info(f"Pruned {len(pruned)} versions of file({file_id})")
+    except Exception as ex:
+        logger.error(f"Failed to prune versions of file({file_id}): {ex}")
+
+
+def retire_replaced_file(
+    storage: Storage,
+    background_tasks: BackgroundTasks,
+    file_id: str,
+    replaced: Optional[File],
+):
+    """
+    Keeps the data of a replaced file as a version of it when its
+    category is versioned and deletes it after the response otherwise
+    """
+    if replaced is None:
+        return
+    if is_versioned(replaced.category):
+        storage.file_version_create_record(replaced)
+        background_tasks.add_task(prune_file_versions, storage, file_id)
+    else:
+        background_tasks.add_task(delete_replaced_data, storage, replaced)
+
+
 @router.patch("/agents/{agent_id}", response_model=AgentOut)
 async def update_agent(
     agent_id: str,
+    storage: StorageDep,
+    background_tasks: BackgroundTasks,
     # name: Optional[str] = Form(default=None),
     # description: Optional[str] = Form(default=None),
     # platforms: Optional[List[str]] = Form(
@@ -372,192 +867,38 @@ async def update_agent(
 
         # storage.agent_update_record(filter={"_id": agent_id}, update=update)
 
-        if metadata:
-            try:
-                storage.file_delete_record(
-                    {"agent_id": agent_id, "category": FileCategory.METADATA}
-                )
-            except Exception:
-                pass
-            storage.file_create_record(
-                data=await metadata.read(),
-                file_data=FileMetadata(
-                    filename=metadata.filename,
-                    agent_id=agent_id,
-                    category=FileCategory.METADATA,
-                    restrict_access=False,
-                ),
-            )
-            logger.info(f"Updated metadata file for agent({agent_id})")
-
-        if logo:
-            try:
-                storage.file_delete_record(
-                    {"agent_id": agent_id, "category": FileCategory.LOGO}
-                )
-            except Exception:
-                pass
-            storage.file_create_record(
-                data=await logo.read(),
-                file_data=FileMetadata(
-                    filename=logo.filename,
-                    agent_id=agent_id,
-                    category=FileCategory.LOGO,
-                    restrict_access=False,
-                ),
-            )
-
-            logger.info(f"Updated logo file for agent({agent_id})")
-
-        if instructions:
-            try:
-                storage.file_delete_record(
-                    {
-                        "agent_id": agent_id,
-                        "category": FileCategory.INSRUCTIONS,
-                    }
-                )
-            except Exception:
-                pass
-            storage.file_create_record(
-                data=await instructions.read(),
-                file_data=FileMetadata(
-                    filename=instructions.filename,
-                    agent_id=agent_id,
-                    category=FileCategory.INSRUCTIONS,
-                    restrict_access=False,
-                ),
-            )
-
-            logger.info(f"Updated intructions file for agent({agent_id})")
-
-        if pa_web_agent_package:
-            try:
-                storage.file_delete_record(
-                    {"agent_id": agent_id, "category": FileCategory.PA_DESK_AP}
-                )
-            except Exception:
-                pass
-            storage.file_create_record(
-                data=await pa_web_agent_package.read(),
+        artifacts = {
+            FileCategory.METADATA: metadata,
+            FileCategory.LOGO: logo,
+            FileCategory.INSRUCTIONS: instructions,
+            FileCategory.PA_WEB_AP: pa_web_agent_package,
+            FileCategory.PA_WEB_AD: pa_web_agent_dependencies,
+            FileCategory.PA_DESK_AP: pa_desk_agent_package,
+            FileCategory.PA_DESK_AD: pa_desk_agent_dependencies,
+            FileCategory.UIPATH_AP: uipath_agent_package,
+            FileCategory.UIPATH_AD: uipath_agent_dependencies,
+        }
+        for category, artifact in artifacts.items():
+            if not artifact:
+                continue
+
+            # the new data is stored before the record is repointed, so
+            # readers see either the old or the new file, never none
+            file_id, replaced = storage.file_replace_record(
+                data=artifact.file,
                 file_data=FileMetadata(
-                    filename=pa_web_agent_package.filename,
+                    filename=artifact.filename,
                     agent_id=agent_id,
-                    category=FileCategory.PA_WEB_AP,
+                    category=category,
                     restrict_access=False,
                 ),
             )
-
-            logger.info(
-                f"Updated metadata power automate web agent package for agent({agent_id})"
-            )
-
-        if pa_web_agent_dependencies:
-            try:
-                storage.file_delete_record(
-                    {"agent_id": agent_id, "category": FileCategory.PA_WEB_AD}
-                )
-            except Exception:
-                pass
-            storage.file_create_record(
-                data=await pa_web_agent_dependencies.read(),
-                file_data=FileMetadata(
-                    filename=pa_web_agent_dependencies.filename,
-                    agent_id=agent_id,
-                    category=FileCategory.PA_WEB_AD,
-                    restrict_access=False,
-                ),
-            )
-
-            logger.info(
-                f"Updated power automate web dependencies file for agent({agent_id})"
-            )
-
-        if pa_desk_agent_package:
-            try:
-                storage.file_delete_record(
-                    {"agent_id": agent_id, "category": FileCategory.PA_DESK_AP}
-                )
-            except Exception:
-                pass
-            storage.file_create_record(
-                data=await pa_desk_agent_package.read(),
-                file_data=FileMetadata(
-                    filename=pa_desk_agent_package.filename,
-                    agent_id=agent_id,
-                    category=FileCategory.PA_DESK_AP,
-                    restrict_access=False,
-                ),
-            )
-
-            logger.info(
-                f"Updated metadata power automate desk agent package for agent({agent_id})"
-            )
-
-        if pa_desk_agent_dependencies:
-            try:
-                storage.file_delete_record(
-                    {"agent_id": agent_id, "category": FileCategory.PA_DESK_AD}
-                )
-            except Exception:
-                pass
-            storage.file_create_record(
-                data=await pa_desk_agent_dependencies.read(),
-                file_data=FileMetadata(
-                    filename=pa_desk_agent_dependencies.filename,
-                    agent_id=agent_id,
-                    category=FileCategory.PA_DESK_AD,
-                    restrict_access=False,
-                ),
-            )
-
-            logger.info(
-                f"Updated metadata power automate desk agent dependencies for agent({agent_id})"
-            )
-
-        if uipath_agent_package:
-            try:
-                storage.file_delete_record(
-                    {"agent_id": agent_id, "category": FileCategory.UIPATH_AP}
-                )
-            except Exception:
-                pass
-            storage.file_create_record(
-                data=await uipath_agent_package.read(),
-                file_data=FileMetadata(
-                    filename=uipath_agent_package.filename,
-                    agent_id=agent_id,
-                    category=FileCategory.UIPATH_AP,
-                    restrict_access=False,
-                ),
-            )
-
-            logger.info(
-                f"Updated metadata uipath agent package for agent({agent_id})"
-            )
-
-        if uipath_agent_dependencies:
-            try:
-                storage.file_delete_record(
-                    {"agent_id": agent_id, "category": FileCategory.UIPATH_AD}
-                )
-            except Exception:
-                pass
-            storage.file_create_record(
-                data=await uipath_agent_dependencies.read(),
-                file_data=FileMetadata(
-                    filename=uipath_agent_dependencies.filename,
-                    agent_id=agent_id,
-                    category=FileCategory.UIPATH_AD,
-                    restrict_access=False,
-                ),
-            )
-            logger.info(
-                f"Updated metadata uipath agent dependencies for agent({agent_id})"
-            )
+            manifest_indexer.submit(storage, file_id, category)
+            retire_replaced_file(storage, background_tasks, file_id, replaced)
+            logger.info(f"Updated {category.value} file for agent({agent_id})")
 
         agent = storage.agent_verify_record({"_id": agent_id})
-        return convert_to_agent_out(agent)
+        return convert_to_agent_out(storage, agent)
     except HTTPException as ex:
         logger.error(ex)
         raise ex
@@ -569,6 +910,7 @@ async def update_agent(
 @router.delete("/agents/{agent_id}", response_model=Dict[str, str])
 def delete_agent(
     agent_id: str,
+    storage: StorageDep,
 ) -> JSONResponse:
     """Deletes a user's agent"""
     logger = getLogger(__name__ + ".delete_agent")
@@ -585,7 +927,7 @@ def delete_agent(
 
 
 @router.post(path="/agents/{agent_id}/review", response_model=Review)
-def review_agent(agent_id: str, data: ReviewIn):
+def review_agent(agent_id: str, data: ReviewIn, storage: StorageDep):
     """Adds a review/ reaction to an agent"""
     logger = getLogger(__name__ + ".review_agent")
     try:
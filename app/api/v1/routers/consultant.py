@@ -1,53 +1,112 @@
+from datetime import datetime
 from logging import getLogger
-from typing import Annotated, Dict, Optional
-
-from core.storage import storage
-from fastapi import APIRouter, Form, HTTPException, UploadFile
-from fastapi.responses import JSONResponse
+from typing import Annotated, Dict, List, Optional
+
+from bson.objectid import ObjectId
+from core.config import settings
+from core.responses import ModelJSONResponse
+from core.storage import SecondaryReads, Storage, StorageDep
+from fastapi import APIRouter, Form, HTTPException, Query, UploadFile, status
+from fastapi.responses import JSONResponse, StreamingResponse
+from pydantic_core import to_json
+from schemas.batch import Batch, split_ids
 from schemas.consultant import (
     Consultant,
     ConsultantBase,
     ConsultantOut,
     ConsultantUpdate,
 )
-from schemas.file import FileMetadata
+from schemas.fieldset import Fieldset
+from schemas.file import ConsultantFileCategory, FileMetadata
 from schemas.page import Page
 from schemas.review import Review, ReviewBase, ReviewIn, TargetType
 
 router = APIRouter()
 
+CONSULTANT_FILE_FIELDS = {
+    "profile_picture": "profile_picture_id",
+    "resume_file": "resume_file_id",
+}
 
-def convert_to_consultant_out(input: Consultant) -> ConsultantOut:
-    """Converts form Consultant to ConsultantOut"""
-    profile_picture = storage.file_get_record(
-        {"_id": input.profile_picture_id}
-    )
-    resume_file = storage.file_get_record({"_id": input.resume_file_id})
-    data = input.model_dump()
-    data["profile_picture"] = profile_picture
-    data["resume_file"] = resume_file
 
-    return ConsultantOut(**data)
+def convert_to_consultants_out(
+    storage: Storage,
+    inputs: List[Consultant],
+    fieldset: Optional[Fieldset] = None,
+) -> List[ConsultantOut]:
+    """
+    Converts a list of Consultant to ConsultantOut, resolving all
+    referenced files with a single query.
+    If fieldset is supplied the consultants are converted to ConsultantOut
+    narrowed to the selected fields and only the requested files are
+    resolved
+    """
+    output_model = ConsultantOut
+    expand = CONSULTANT_FILE_FIELDS.keys()
+    if fieldset is not None:
+        output_model = fieldset.output_model(ConsultantOut)
+        expand = fieldset.expand
+
+    file_ids = []
+    for input in inputs:
+        for field in expand:
+            file_ids.append(getattr(input, CONSULTANT_FILE_FIELDS[field]))
+    files = storage.file_get_records_by_ids(file_ids)
+
+    output = []
+    for input in inputs:
+        data = dict(vars(input))
+        for field in expand:
+            data[field] = files.get(data[CONSULTANT_FILE_FIELDS[field]])
+        output.append(output_model.model_validate(data))
+
+    return output
+
+
+def convert_to_consultant_out(
+    storage: Storage, input: Consultant
+) -> ConsultantOut:
+    """Converts form Consultant to ConsultantOut"""
+    return convert_to_consultants_out(storage, [input])[0]
 
 
 @router.get(
     path="/consultants",
     response_model=Page[ConsultantOut],
+    dependencies=[SecondaryReads],
 )
 def get_consultants(
+    storage: StorageDep,
     cursor: Optional[str] = None,
     limit: int = 10,
+    fields: Optional[str] = Query(
+        default=None, description="Comma separated fields to return"
+    ),
+    expand: Optional[str] = Query(
+        default=None,
+        description="Comma separated files to resolve: "
+        f"{list(CONSULTANT_FILE_FIELDS)}",
+    ),
 ):
     """Gets available consultants"""
     logger = getLogger(__name__ + ".get_consultants")
     try:
+        fieldset = Fieldset.parse(
+            ConsultantOut, CONSULTANT_FILE_FIELDS, fields, expand
+        )
+        record_fields = None
+        if fieldset is not None:
+            record_fields = fieldset.record_fields(
+                Consultant, CONSULTANT_FILE_FIELDS
+            )
+
         filter = {}
         consultants_page = storage.consultant_get_page(
-            filter, limit=limit, cursor=cursor
+            filter, limit=limit, cursor=cursor, fields=record_fields
+        )
+        items = convert_to_consultants_out(
+            storage, consultants_page.items, fieldset
         )
-        items = [
-            convert_to_consultant_out(con) for con in consultants_page.items
-        ]
 
         output = Page(
             items=items,
@@ -55,7 +114,119 @@ def get_consultants(
             next_cursor=consultants_page.next_cursor,
         )
 
-        return output
+        return ModelJSONResponse(content=output)
+    except Exception as ex:
+        logger.error(ex)
+        if type(ex) is not HTTPException:
+            raise HTTPException(status_code=500, detail=str(ex))
+        raise ex
+
+
+@router.get(path="/consultants/export", dependencies=[SecondaryReads])
+def export_consultants(
+    storage: StorageDep,
+    since: Optional[datetime] = Query(
+        default=None,
+        description="Only export consultants modified at or after this date",
+    ),
+    fields: Optional[str] = Query(
+        default=None, description="Comma separated fields to return"
+    ),
+    expand: Optional[str] = Query(
+        default=None,
+        description="Comma separated files to resolve: "
+        f"{list(CONSULTANT_FILE_FIELDS)}",
+    ),
+):
+    """
+    Streams all consultants as newline delimited JSON, one ConsultantOut
+    per line. Files are resolved in bulk for every batch of consultants
+    read from the cursor.
+    """
+    logger = getLogger(__name__ + ".export_consultants")
+    try:
+        fieldset = Fieldset.parse(
+            ConsultantOut, CONSULTANT_FILE_FIELDS, fields, expand
+        )
+        record_fields = None
+        if fieldset is not None:
+            record_fields = fieldset.record_fields(
+                Consultant, CONSULTANT_FILE_FIELDS
+            )
+
+        filter = {}
+        if since:
+            filter["date_modified"] = {"$gte": since}
+
+        batches = storage.consultant_iter_batches(
+            filter,
+            batch_size=settings.EXPORT_BATCH_SIZE,
+            fields=record_fields,
+        )
+
+        def generate():
+            count = 0
+            try:
+                for batch in batches:
+                    consultants = convert_to_consultants_out(
+                        storage, batch, fieldset
+                    )
+                    yield b"".join(
+                        to_json(consultant) + b"\n"
+                        for consultant in consultants
+                    )
+                    count += len(consultants)
+            except Exception as ex:
+                logger.exception(ex)
+                raise ex
+            logger.info(f"Exported {count} consultants")
+
+        return StreamingResponse(generate(), media_type="application/x-ndjson")
+    except Exception as ex:
+        logger.error(ex)
+        if type(ex) is not HTTPException:
+            raise HTTPException(status_code=500, detail=str(ex))
+        raise ex
+
+
+@router.get(
+    path="/consultants:batch",
+    response_model=Batch[ConsultantOut],
+    dependencies=[SecondaryReads],
+)
+def get_consultants_batch(
+    storage: StorageDep, ids: Annotated[List[str], Query()]
+):
+    """
+    Gets multiple consultants by their ids.
+
+    ids may be repeated or comma separated. Results are returned in
+    request order with a not found marker for unknown ids.
+    """
+    logger = getLogger(__name__ + ".get_consultants_batch")
+    try:
+        ids = split_ids(ids)
+        if len(ids) > settings.BATCH_MAX_IDS:
+            raise HTTPException(
+                status_code=status.HTTP_400_BAD_REQUEST,
+                detail=f"At most {settings.BATCH_MAX_IDS} ids are allowed",
+            )
+
+        object_ids = list(
+            {ObjectId(id) for id in ids if ObjectId.is_valid(id)}
+        )
+        consultants = []
+        if object_ids:
+            consultants = storage.consultant_get_all_records(
+                {"_id": {"$in": object_ids}}
+            )
+        consultants = convert_to_consultants_out(storage, consultants)
+
+        return ModelJSONResponse(
+            content=Batch[ConsultantOut].from_records(
+                ids, {consultant.id: consultant for consultant in consultants}
+            )
+        )
     except Exception as ex:
         logger.error(ex)
         if type(ex) is not HTTPException:
@@ -69,14 +240,46 @@ def get_consultants(
 )
 def get_user_consultant(
     consultant_id: str,
+    storage: StorageDep,
+    fields: Optional[str] = Query(
+        default=None, description="Comma separated fields to return"
+    ),
+    expand: Optional[str] = Query(
+        default=None,
+        description="Comma separated files to resolve: "
+        f"{list(CONSULTANT_FILE_FIELDS)}",
+    ),
 ):
     """Get consultant for a user by its id"""
     logger = getLogger(__name__ + ".get_user_consultant")
     try:
+        fieldset = Fieldset.parse(
+            ConsultantOut, CONSULTANT_FILE_FIELDS, fields, expand
+        )
+        if fieldset is None:
+            consultant = storage.consultant_verify_record(
+                {"_id": consultant_id}
+            )
+
+            return ModelJSONResponse(
+                content=convert_to_consultant_out(storage, consultant)
+            )
 
-        consultant = storage.consultant_verify_record({"_id": consultant_id})
+        consultants = storage.consultant_get_all_records(
+            {"_id": consultant_id},
+            limit=1,
+            fields=fieldset.record_fields(Consultant, CONSULTANT_FILE_FIELDS),
+        )
+        if not consultants:
+            raise HTTPException(
+                status_code=status.HTTP_404_NOT_FOUND,
+                detail="Consultant not found",
+            )
+        consultant = convert_to_consultants_out(
+            storage, consultants, fieldset
+        )[0]
 
-        return convert_to_consultant_out(consultant)
+        return ModelJSONResponse(content=consultant)
     except Exception as ex:
         logger.error(ex)
         if type(ex) is not HTTPException:
@@ -86,6 +289,7 @@ def get_user_consultant(
 
 @router.post("/consultants", response_model=ConsultantOut)
 async def new_consultant(
+    storage: StorageDep,
     name: Annotated[str, Form(...)],
     description: Annotated[str, Form(...)],
     role: Annotated[str, Form(...)],
@@ -104,6 +308,7 @@ async def new_consultant(
             data=await profile_picture.read(),
             file_data=FileMetadata(
                 filename=profile_picture.filename,
+                category=ConsultantFileCategory.PROFILE_PICTURE,
                 restrict_access=False,
             ),
         )
@@ -112,6 +317,7 @@ async def new_consultant(
             data=await resume_file.read(),
             file_data=FileMetadata(
                 filename=resume_file.filename,
+                category=ConsultantFileCategory.RESUME,
                 restrict_access=False,
             ),
         )
@@ -129,7 +335,7 @@ async def new_consultant(
         id = storage.consultant_create_record(data)
 
         consultant = storage.consultant_verify_record({"_id": id})
-        return convert_to_consultant_out(consultant)
+        return convert_to_consultant_out(storage, consultant)
     except HTTPException as ex:
         logger.error(ex)
         raise ex
@@ -145,6 +351,7 @@ async def new_consultant(
 def update_consultant(
     consultant_id: str,
     data: ConsultantUpdate,
+    storage: StorageDep,
 ) -> JSONResponse:
     """Updates a consultant"""
     logger = getLogger(__name__ + ".update_consultant")
@@ -157,7 +364,7 @@ def update_consultant(
         )
 
         return convert_to_consultant_out(
-            storage.consultant_verify_record({"_id": consultant_id})
+            storage, storage.consultant_verify_record({"_id": consultant_id})
         )
     except Exception as ex:
         logger.error(ex)
@@ -172,6 +379,7 @@ def update_consultant(
 )
 async def update_consultant_files(
     consultant_id: str,
+    storage: StorageDep,
     profile_picture: Optional[UploadFile] = None,
     resume_file: Optional[UploadFile] = None,
 ) -> JSONResponse:
@@ -184,6 +392,7 @@ async def update_consultant_files(
                 data=await profile_picture.read(),
                 file_data=FileMetadata(
                     filename=profile_picture.filename,
+                    category=ConsultantFileCategory.PROFILE_PICTURE,
                     restrict_access=False,
                 ),
             )
@@ -193,6 +402,7 @@ async def update_consultant_files(
                 data=await resume_file.read(),
                 file_data=FileMetadata(
                     filename=resume_file.filename,
+                    category=ConsultantFileCategory.RESUME,
                     restrict_access=False,
                 ),
             )
@@ -204,7 +414,7 @@ async def update_consultant_files(
         )
 
         return convert_to_consultant_out(
-            storage.consultant_verify_record({"_id": consultant_id})
+            storage, storage.consultant_verify_record({"_id": consultant_id})
         )
     except Exception as ex:
         logger.error(ex)
@@ -219,6 +429,7 @@ async def update_consultant_files(
 )
 def delete_consultant(
     consultant_id: str,
+    storage: StorageDep,
 ) -> JSONResponse:
     """Deletes a user's consultant"""
     logger = getLogger(__name__ + ".delete_consultant")
@@ -235,7 +446,7 @@ def delete_consultant(
 
 
 @router.post(path="/consultants/{consultant_id}/review", response_model=Review)
-def review_consultant(consultant_id: str, data: ReviewIn):
+def review_consultant(consultant_id: str, data: ReviewIn, storage: StorageDep):
     """Adds a review/ reaction to an consultant"""
     logger = getLogger(__name__ + ".review_consultant")
     try:
@@ -1,23 +1,35 @@
 import mimetypes
 from io import BytesIO
 from logging import getLogger
+from typing import List
 
-from bson.objectid import ObjectId
-from core.storage import storage
+from core.config import settings
+from core.manifests import (
+    index_manifest,
+    is_package,
+    is_streamable,
+    manifest_indexer,
+    stream_member,
+)
+from core.storage import SecondaryReads, StorageDep
 from fastapi import APIRouter, HTTPException, Request, status
-from fastapi.responses import StreamingResponse
+from fastapi.responses import FileResponse, StreamingResponse
+from schemas.file import File, FileVersion, Manifest
 
 # from schemas.file import File, FileCategory, FileMetadata
 
 router = APIRouter()
 
 
-@router.get(path="/files/{file_id}/download")
-def download_file(file_id: str, request: Request):
+@router.get(path="/files/{file_id}/download", dependencies=[SecondaryReads])
+def download_file(file_id: str, request: Request, storage: StorageDep):
     """Downloads a file from the server"""
     logger = getLogger(__name__ + ".download_file")
     try:
         file = storage.file_verify_record({"_id": file_id})
+        path = storage.file_data_path(file.gridfs_id, file.bucket)
+        if path is not None:
+            return FileResponse(path, filename=file.filename)
         # logger.info("Checking for access")
         # if file.restrict_access:
         #     if not (
@@ -36,7 +48,7 @@ def download_file(file_id: str, request: Request):
         #             status_code=status.HTTP_404_NOT_FOUND,
         #             detail="File not found",
         #         )
-        file_obj = storage.fs.get(ObjectId(file.gridfs_id))
+        file_obj = storage.file_open_data(file.gridfs_id, file.bucket)
         file_size = file_obj.length
         mime_type, _ = mimetypes.guess_type(file.filename)
         headers = {
@@ -94,14 +106,22 @@ def download_file(file_id: str, request: Request):
         raise ex
 
 
-@router.get(path="/files/{file_id}/unrestricted/download")
-def download_unrestricted_file(file_id: str, request: Request):
+@router.get(
+    path="/files/{file_id}/unrestricted/download",
+    dependencies=[SecondaryReads],
+)
+def download_unrestricted_file(
+    file_id: str, request: Request, storage: StorageDep
+):
     """Downloads a file from the server"""
     logger = getLogger(__name__ + ".download_unrestricted_file")
     try:
         file = storage.file_verify_record({"_id": file_id})
+        path = storage.file_data_path(file.gridfs_id, file.bucket)
+        if path is not None:
+            return FileResponse(path, filename=file.filename)
 
-        file_obj = storage.fs.get(ObjectId(file.gridfs_id))
+        file_obj = storage.file_open_data(file.gridfs_id, file.bucket)
         file_size = file_obj.length
         mime_type, _ = mimetypes.guess_type(file.filename)
         headers = {
@@ -169,3 +189,170 @@ def download_unrestricted_file(file_id: str, request: Request):
         if type(ex) is not HTTPException:
             raise HTTPException(status_code=500, detail=str(ex))
         raise ex
+
+
+def verify_package(file: File):
+    """Raises an error if a file is not a package with a manifest"""
+    if not is_package(file.category):
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="File is not a package",
+        )
+
+
+@router.get(path="/files/{file_id}/manifest", response_model=Manifest)
+def get_file_manifest(file_id: str, storage: StorageDep):
+    """
+    Gets the members of a zip package without downloading it. Packages
+    are indexed when they are stored, one that was not yet is indexed
+    now
+    """
+    logger = getLogger(__name__ + ".get_file_manifest")
+    try:
+        manifest = storage.file_get_manifest(file_id)
+        if manifest is None:
+            file = storage.file_verify_record({"_id": file_id})
+            verify_package(file)
+            manifest = index_manifest(storage, file)
+
+        return manifest
+    except Exception as ex:
+        logger.exception(ex)
+        if type(ex) is not HTTPException:
+            raise HTTPException(status_code=500, detail=str(ex))
+        raise ex
+
+
+@router.get(
+    path="/files/{file_id}/members/{path:path}",
+    dependencies=[SecondaryReads],
+)
+def download_file_member(file_id: str, path: str, storage: StorageDep):
+    """
+    Downloads one member of a zip package. The member is found in the
+    package manifest and only its bytes are read from the package
+    """
+    logger = getLogger(__name__ + ".download_file_member")
+    try:
+        file = storage.file_verify_record({"_id": file_id})
+        verify_package(file)
+        manifest = storage.file_get_manifest(file_id)
+        if manifest is None:
+            manifest = index_manifest(storage, file)
+
+        member = next((m for m in manifest.members if m.path == path), None)
+        if member is None or member.path.endswith("/"):
+            raise HTTPException(
+                status_code=status.HTTP_404_NOT_FOUND,
+                detail="Member not found",
+            )
+        if not is_streamable(member):
+            raise HTTPException(
+                status_code=status.HTTP_415_UNSUPPORTED_MEDIA_TYPE,
+                detail=f"Unsupported compression {member.compress_type}",
+            )
+
+        data = storage.file_open_data(file.gridfs_id, file.bucket)
+
+        def generate():
+            try:
+                yield from stream_member(
+                    data, member, settings.MEMBER_READ_SIZE
+                )
+            except Exception as ex:
+                logger.error(f"Failed to read {path} of file({file_id}): {ex}")
+                raise ex
+            finally:
+                data.close()
+
+        mime_type, _ = mimetypes.guess_type(path)
+        filename = path.rsplit("/", 1)[-1]
+        return StreamingResponse(
+            generate(),
+            media_type=mime_type or "application/octet-stream",
+            headers={
+                "Content-Length": str(member.size),
+                "Content-Disposition": f"attachment; filename={filename}",
+            },
+        )
+    except Exception as ex:
+        logger.exception(ex)
+        if type(ex) is not HTTPException:
+            raise HTTPException(status_code=500, detail=str(ex))
+        raise ex
+
+
+@router.get(path="/files/{file_id}/versions", response_model=List[FileVersion])
+def get_file_versions(file_id: str, storage: StorageDep):
+    """Gets the kept versions of a package file, newest first"""
+    logger = getLogger(__name__ + ".get_file_versions")
+    try:
+        storage.file_verify_record({"_id": file_id})
+
+        return storage.file_version_get_all_records(file_id)
+    except Exception as ex:
+        logger.exception(ex)
+        if type(ex) is not HTTPException:
+            raise HTTPException(status_code=500, detail=str(ex))
+        raise ex
+
+
+@router.get(
+    path="/files/{file_id}/versions/{version_id}/download",
+    dependencies=[SecondaryReads],
+)
+def download_file_version(file_id: str, version_id: str, storage: StorageDep):
+    """Downloads a kept version of a package file"""
+    logger = getLogger(__name__ + ".download_file_version")
+    try:
+        version = storage.file_version_verify_record(
+            {"_id": version_id, "file_id": file_id}
+        )
+        data = storage.file_open_data(version.gridfs_id, version.bucket)
+
+        def generate():
+            try:
+                while chunk := data.read(settings.DOWNLOAD_READ_SIZE):
+                    yield chunk
+            finally:
+                data.close()
+
+        mime_type, _ = mimetypes.guess_type(version.filename)
+        return StreamingResponse(
+            generate(),
+            media_type=mime_type or "application/octet-stream",
+            headers={
+                "Content-Length": str(data.length),
+                "Content-Disposition": (
+                    f"attachment; filename={version.filename}"
+                ),
+            },
+        )
+    except Exception as ex:
+        logger.exception(ex)
+        if type(ex) is not HTTPException:
+            raise HTTPException(status_code=500, detail=str(ex))
+        raise ex
+
+
+@router.post(
+    path="/files/{file_id}/versions/{version_id}/restore",
+    response_model=File,
+)
+def restore_file_version(file_id: str, version_id: str, storage: StorageDep):
+    """
+    Points a package file back at one of its versions. The data it
+    pointed at becomes that version, so nothing is copied or lost
+    """
+    logger = getLogger(__name__ + ".restore_file_version")
+    try:
+        file = storage.file_version_restore_record(file_id, version_id)
+        manifest_indexer.submit(storage, file.id, file.category)
+        logger.info(f"Restored version({version_id}) of file({file_id})")
+
+        return file
+    except Exception as ex:
+        logger.exception(ex)
+        if type(ex) is not HTTPException:
+            raise HTTPException(status_code=500, detail=str(ex))
+        raise ex
@@ -0,0 +1,12 @@
+from core.metrics import render_metrics
+from fastapi import APIRouter, Response
+
+router = APIRouter()
+
+
+@router.get("/metrics", include_in_schema=False)
+def get_metrics() -> Response:
+    """Exposes the service metrics in the prometheus text format"""
+    content, media_type = render_metrics()
+
+    return Response(content=content, media_type=media_type)
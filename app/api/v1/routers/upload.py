@@ -0,0 +1,203 @@
+import asyncio
+from logging import getLogger
+from typing import Annotated, Dict
+
+from api.v1.routers.agent import convert_to_agent_out, retire_replaced_file
+from core.config import settings
+from core.manifests import manifest_indexer
+from core.storage import Storage, StorageDep
+from fastapi import (
+    APIRouter,
+    BackgroundTasks,
+    Header,
+    HTTPException,
+    Request,
+    Response,
+    status,
+)
+from schemas.agent import AgentOut
+from schemas.upload import UploadIn, UploadOut
+from starlette.concurrency import run_in_threadpool
+from starlette.requests import ClientDisconnect
+
+router = APIRouter()
+
+
+def offset_headers(offset: int, length: int) -> Dict[str, str]:
+    return {
+        "Upload-Offset": str(offset),
+        "Upload-Length": str(length),
+        "Cache-Control": "no-store",
+    }
+
+
+@router.post(
+    "/uploads",
+    response_model=UploadOut,
+    status_code=status.HTTP_201_CREATED,
+)
+def create_upload(data: UploadIn, storage: StorageDep, response: Response):
+    """
+    Starts a resumable upload of a file for an agent category.
+    Send the file with PATCH requests, check how much arrived with HEAD
+    and attach it to the agent with POST /uploads/{upload_id}/complete
+    """
+    logger = getLogger(__name__ + ".create_upload")
+    try:
+        storage.agent_verify_record({"_id": data.agent_id})
+        upload_id = storage.upload_create_record(data)
+        response.headers["Location"] = (
+            f"{settings.API_V1_STR}/uploads/{upload_id}"
+        )
+
+        return storage.upload_verify_record({"_id": upload_id})
+    except HTTPException as ex:
+        logger.error(ex)
+        raise ex
+    except Exception as ex:
+        logger.error(ex)
+        raise HTTPException(status_code=500, detail=str(ex))
+
+
+@router.head("/uploads/{upload_id}")
+def get_upload_offset(upload_id: str, storage: StorageDep) -> Response:
+    """Gets how many bytes of an upload were received in Upload-Offset"""
+    logger = getLogger(__name__ + ".get_upload_offset")
+    try:
+        upload = storage.upload_verify_record({"_id": upload_id})
+
+        return Response(headers=offset_headers(upload.offset, upload.length))
+    except HTTPException as ex:
+        logger.error(ex)
+        raise ex
+    except Exception as ex:
+        logger.error(ex)
+        raise HTTPException(status_code=500, detail=str(ex))
+
+
+@router.patch("/uploads/{upload_id}", status_code=status.HTTP_204_NO_CONTENT)
+async def append_upload(
+    upload_id: str,
+    request: Request,
+    storage: StorageDep,
+    upload_offset: Annotated[int, Header()],
+) -> Response:
+    """
+    Appends the request body to an upload at Upload-Offset, which must
+    be the offset the upload is at. The body is written as it arrives
+    in UPLOAD_WRITE_SIZE pieces, so what arrived before a dropped
+    connection is kept and the upload resumes from there
+    """
+    logger = getLogger(__name__ + ".append_upload")
+    try:
+        upload = await run_in_threadpool(
+            storage.upload_verify_record, {"_id": upload_id}
+        )
+        if upload_offset != upload.offset:
+            raise HTTPException(
+                status_code=status.HTTP_409_CONFLICT,
+                detail=f"Upload is at offset {upload.offset}",
+            )
+
+        offset = upload.offset
+        buffer = bytearray()
+        try:
+            async for piece in request.stream():
+                buffer += piece
+                if len(buffer) >= settings.UPLOAD_WRITE_SIZE:
+                    offset = await run_in_threadpool(
+                        storage.upload_append_data,
+                        upload,
+                        offset,
+                        bytes(buffer),
+                    )
+                    buffer.clear()
+        except ClientDisconnect:
+            logger.info(f"Upload({upload_id}) interrupted at {offset}")
+        if buffer:
+            offset = await run_in_threadpool(
+                storage.upload_append_data, upload, offset, bytes(buffer)
+            )
+
+        return Response(
+            status_code=status.HTTP_204_NO_CONTENT,
+            headers=offset_headers(offset, upload.length),
+        )
+    except HTTPException as ex:
+        logger.error(ex)
+        raise ex
+    except Exception as ex:
+        logger.error(ex)
+        raise HTTPException(status_code=500, detail=str(ex))
+
+
+@router.post("/uploads/{upload_id}/complete", response_model=AgentOut)
+def complete_upload(
+    upload_id: str, storage: StorageDep, background_tasks: BackgroundTasks
+) -> AgentOut:
+    """
+    Attaches a fully received upload to its agent, replacing the file
+    the agent had in that category
+    """
+    logger = getLogger(__name__ + ".complete_upload")
+    try:
+        upload = storage.upload_verify_record({"_id": upload_id})
+        if upload.offset != upload.length:
+            raise HTTPException(
+                status_code=status.HTTP_409_CONFLICT,
+                detail=f"Upload is at offset {upload.offset}",
+            )
+
+        agent = storage.agent_verify_record({"_id": upload.agent_id})
+        file_id, replaced = storage.upload_complete_record(upload)
+        manifest_indexer.submit(storage, file_id, upload.category)
+        retire_replaced_file(storage, background_tasks, file_id, replaced)
+        logger.info(
+            f"Uploaded {upload.category.value} file for agent({agent.id})"
+        )
+
+        return convert_to_agent_out(storage, agent)
+    except HTTPException as ex:
+        logger.error(ex)
+        raise ex
+    except Exception as ex:
+        logger.error(ex)
+        raise HTTPException(status_code=500, detail=str(ex))
+
+
+@router.delete("/uploads/{upload_id}", response_model=Dict[str, str])
+def delete_upload(upload_id: str, storage: StorageDep) -> Dict[str, str]:
+    """Cancels an upload and deletes the data received so far"""
+    logger = getLogger(__name__ + ".delete_upload")
+    try:
+        storage.upload_delete_record({"_id": upload_id})
+
+        return {"message": "Upload deleted"}
+    except HTTPException as ex:
+        logger.error(ex)
+        raise ex
+    except Exception as ex:
+        logger.error(ex)
+        raise HTTPException(status_code=500, detail=str(ex))
+
+
+async def clean_up_uploads(storage: Storage, interval: float):
+    """Deletes expired uploads with their data every interval seconds"""
+    logger = getLogger(__name__ + ".clean_up_uploads")
+    while True:
+        sweep = asyncio.ensure_future(
+            run_in_threadpool(storage.upload_delete_expired_records)
+        )
+        try:
+            try:
+                count = await asyncio.shield(sweep)
+            except asyncio.CancelledError:
+                # a cancelled loop still waits for the sweep in its
+                # thread, so the storage is not closed under it
+                await asyncio.wait([sweep])
+                raise
+            if count:
+                logger.info(f"Deleted {count} expired uploads")
+        except Exception as ex:
+            logger.error(ex)
+        await asyncio.sleep(interval)
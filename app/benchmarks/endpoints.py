@@ -0,0 +1,399 @@
+"""
+Benchmark of the hot API paths, reported as JSON.
+
+Covers GET /agents over page sizes and file counts, GET /agents/{id},
+POST /agents with multi-MB artifacts, full and ranged file downloads,
+review bursts and consultant listing. Each scenario reports throughput,
+p50/p95/p99 latency, mongo round trips per request and the peak RSS of
+the process, so runs can be compared between commits.
+
+Requests go through the ASGI app in process. The data lives either in a
+local mongod, in a throwaway database, or in the in-memory storage,
+which makes no round trips, so round trips are only reported against
+mongod.
+
+Run from the app directory:
+
+    python -m benchmarks.endpoints --backend memory
+    python -m benchmarks.endpoints --backend mongod \\
+        --mongodb-uri mongodb://localhost:27017 --output bench.json
+"""
+
+import argparse
+import json
+import os
+import platform
+import resource
+import statistics
+import subprocess
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import UTC, datetime
+from typing import Callable, Dict, List, Optional
+
+BENCH_DATABASE = "agents_service_bench"
+
+
+def use_backend(backend: str, mongodb_uri: Optional[str]):
+    """
+    Points the app at the benchmark database. Must run before the app
+    is imported since the storage connects on import.
+    """
+    os.environ["DATABSE_NAME"] = BENCH_DATABASE
+    os.environ["SERVER_TIMING_ENABLED"] = "true"
+    os.environ["SLOW_QUERY_THRESHOLD_MS"] = "0"
+    if mongodb_uri:
+        os.environ["MONGODB_URI"] = mongodb_uri
+
+    if backend == "memory":
+        os.environ["STORAGE_BACKEND"] = "memory"
+        os.environ.setdefault("MONGODB_URI", "mongodb://localhost:27017")
+
+
+def reset_storage(app):
+    """Empties the benchmark storage and returns it"""
+    from core.memory_storage import MemoryStorage
+    from core.storage import get_storage
+
+    storage = get_storage()
+    if isinstance(storage, MemoryStorage):
+        storage = MemoryStorage()
+        app.dependency_overrides[get_storage] = lambda: storage
+    else:
+        storage.client.drop_database(BENCH_DATABASE)
+
+    return storage
+
+
+def percentile(values: List[float], percent: float) -> float:
+    """Gets a percentile of values with linear interpolation"""
+    values = sorted(values)
+    index = (len(values) - 1) * percent / 100
+    lower = int(index)
+    upper = min(lower + 1, len(values) - 1)
+
+    return values[lower] + (values[upper] - values[lower]) * (index - lower)
+
+
+def get_round_trips(response) -> Optional[int]:
+    """Gets the mongo round trips from the Server-Timing header"""
+    for metric in response.headers.get("server-timing", "").split(","):
+        name, *params = metric.strip().split(";")
+        if name == "db":
+            for param in params:
+                if param.startswith("desc="):
+                    return int(param[len("desc=") :].strip('"'))
+
+    return None
+
+
+def peak_rss_bytes() -> int:
+    """Gets the peak resident set size of the process"""
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # kilobytes on linux, bytes on macOS
+    return peak if sys.platform == "darwin" else peak * 1024
+
+
+def run_scenario(
+    name: str,
+    request: Callable[[int], object],
+    count: int,
+    concurrency: int = 1,
+    round_trips: bool = True,
+    **params,
+) -> Dict:
+    """Times count calls of request and summarizes them"""
+    latencies = []
+    trips = []
+
+    def timed(i: int):
+        start = time.perf_counter()
+        response = request(i)
+        latency = time.perf_counter() - start
+        if response.status_code >= 400:
+            raise RuntimeError(
+                f"{name} failed with {response.status_code}: {response.text}"
+            )
+        return latency, get_round_trips(response)
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        for latency, trip in executor.map(timed, range(count)):
+            latencies.append(latency * 1000)
+            if trip is not None:
+                trips.append(trip)
+    duration = time.perf_counter() - start
+
+    return {
+        "name": name,
+        "params": params,
+        "requests": count,
+        "concurrency": concurrency,
+        "throughput_rps": count / duration,
+        "latency_ms": {
+            "mean": statistics.fmean(latencies),
+            "p50": percentile(latencies, 50),
+            "p95": percentile(latencies, 95),
+            "p99": percentile(latencies, 99),
+            "max": max(latencies),
+        },
+        "mongo_round_trips": (
+            statistics.fmean(trips) if round_trips and trips else None
+        ),
+        "peak_rss_bytes": peak_rss_bytes(),
+    }
+
+
+def seed(
+    storage, agent_count: int, files_per_agent: int, consultant_count: int
+):
+    """Fills the benchmark storage with agents, files and consultants"""
+    from schemas.agent import AgentBase
+    from schemas.consultant import ConsultantBase
+    from schemas.file import (
+        ConsultantFileCategory,
+        FileCategory,
+        FileMetadata,
+    )
+
+    agent_ids = storage.agent_create_records(
+        [
+            AgentBase(
+                name=f"agent {i}",
+                description="An automation agent " * 10,
+                platforms=["UiPath", "Python"],
+                api_keys_required=["OPENAI_API_KEY"],
+            )
+            for i in range(agent_count)
+        ]
+    )
+    categories = FileCategory.list()[:files_per_agent]
+    for agent_id in agent_ids:
+        for category in categories:
+            storage.file_create_record(
+                data=os.urandom(1024),
+                file_data=FileMetadata(
+                    filename=f"{category}.zip",
+                    agent_id=agent_id,
+                    category=category,
+                ),
+            )
+
+    for i in range(consultant_count):
+        storage.consultant_create_record(
+            ConsultantBase(
+                profile_picture_id=storage.file_create_record(
+                    os.urandom(1024),
+                    FileMetadata(
+                        filename="picture.png",
+                        category=ConsultantFileCategory.PROFILE_PICTURE,
+                    ),
+                ),
+                resume_file_id=storage.file_create_record(
+                    os.urandom(1024),
+                    FileMetadata(
+                        filename="resume.pdf",
+                        category=ConsultantFileCategory.RESUME,
+                    ),
+                ),
+                name=f"consultant {i}",
+                role="Automation engineer",
+                description="A consultant " * 10,
+                expertise="UiPath",
+                day_rate=500,
+            )
+        )
+
+    return agent_ids
+
+
+def get_commit() -> Optional[str]:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            capture_output=True,
+            text=True,
+            check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument(
+        "--backend", choices=["memory", "mongod"], default="memory"
+    )
+    parser.add_argument("--mongodb-uri", default=None)
+    parser.add_argument("--requests", type=int, default=200)
+    parser.add_argument("--agents", type=int, default=200)
+    parser.add_argument("--consultants", type=int, default=50)
+    parser.add_argument(
+        "--page-sizes",
+        type=lambda v: list(map(int, v.split(","))),
+        default=[10, 50, 100],
+    )
+    parser.add_argument(
+        "--file-counts",
+        type=lambda v: list(map(int, v.split(","))),
+        default=[0, 2, 9],
+    )
+    parser.add_argument("--artifact-mb", type=float, default=4)
+    parser.add_argument("--upload-requests", type=int, default=20)
+    parser.add_argument("--review-concurrency", type=int, default=8)
+    parser.add_argument("--output", default=None)
+    args = parser.parse_args()
+
+    use_backend(args.backend, args.mongodb_uri)
+
+    from fastapi.testclient import TestClient
+    from main import app
+
+    api = "/api/v1"
+    round_trips = args.backend == "mongod"
+    results = []
+    with TestClient(app) as client:
+        for file_count in args.file_counts:
+            storage = reset_storage(app)
+            agent_ids = seed(
+                storage, args.agents, file_count, args.consultants
+            )
+            for page_size in args.page_sizes:
+                results.append(
+                    run_scenario(
+                        "list_agents",
+                        lambda i: client.get(
+                            f"{api}/agents", params={"limit": page_size}
+                        ),
+                        args.requests,
+                        round_trips=round_trips,
+                        page_size=page_size,
+                        files_per_agent=file_count,
+                    )
+                )
+
+        results.append(
+            run_scenario(
+                "get_agent",
+                lambda i: client.get(
+                    f"{api}/agents/{agent_ids[i % len(agent_ids)]}"
+                ),
+                args.requests,
+                round_trips=round_trips,
+                files_per_agent=file_count,
+            )
+        )
+
+        artifact = os.urandom(int(args.artifact_mb * 1024 * 1024))
+        created = []
+
+        def create_agent(i: int):
+            response = client.post(
+                f"{api}/agents",
+                data={
+                    "name": f"uploaded agent {i}",
+                    "description": "An uploaded agent",
+                    "platforms": ["UiPath"],
+                    "api_keys_required": ["OPENAI_API_KEY"],
+                },
+                files={
+                    "uipath_agent_package": ("package.nupkg", artifact),
+                    "uipath_agent_dependencies": ("deps.zip", artifact),
+                },
+            )
+            created.append(response)
+            return response
+
+        results.append(
+            run_scenario(
+                "create_agent",
+                create_agent,
+                args.upload_requests,
+                round_trips=round_trips,
+                artifacts=2,
+                artifact_mb=args.artifact_mb,
+            )
+        )
+
+        file_id = created[0].json()["uipath_agent_package"]["id"]
+        size = len(artifact)
+        download = f"{api}/files/{file_id}/download"
+        results.append(
+            run_scenario(
+                "download_file",
+                lambda i: client.get(download),
+                args.upload_requests,
+                round_trips=round_trips,
+                size_bytes=size,
+            )
+        )
+        # ends are clamped so small artifacts stay satisfiable
+        for name, range_header in [
+            (
+                "download_file_range_start",
+                f"bytes=0-{min(size - 1, 65535)}",
+            ),
+            (
+                "download_file_range_middle",
+                f"bytes={size // 2}-"
+                f"{min(size - 1, size // 2 + 1024 * 1024 - 1)}",
+            ),
+        ]:
+            results.append(
+                run_scenario(
+                    name,
+                    lambda i: client.get(
+                        download, headers={"Range": range_header}
+                    ),
+                    args.requests,
+                    round_trips=round_trips,
+                    range=range_header,
+                )
+            )
+
+        results.append(
+            run_scenario(
+                "review_agent_burst",
+                lambda i: client.post(
+                    f"{api}/agents/{agent_ids[0]}/review",
+                    json={"reaction": "like"},
+                ),
+                args.requests,
+                concurrency=args.review_concurrency,
+                round_trips=round_trips,
+            )
+        )
+
+        for page_size in args.page_sizes:
+            results.append(
+                run_scenario(
+                    "list_consultants",
+                    lambda i: client.get(
+                        f"{api}/consultants", params={"limit": page_size}
+                    ),
+                    args.requests,
+                    round_trips=round_trips,
+                    page_size=page_size,
+                )
+            )
+
+        reset_storage(app)
+
+    report = {
+        "commit": get_commit(),
+        "backend": args.backend,
+        "python": platform.python_version(),
+        "date": datetime.now(UTC).isoformat(),
+        "scenarios": results,
+    }
+    output = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(output)
+    else:
+        print(output)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,131 @@
+"""
+Micro-benchmark of the per-item cost of serializing a Page[AgentOut].
+
+Compares the previous path (validate the db document into Agent, dump it,
+validate AgentOut, validate again against the response_model, then
+jsonable_encoder and json.dumps) with the current one (validate the db
+document into Agent, build AgentOut from its attributes and render the
+page with ModelJSONResponse).
+
+Run from the app directory:
+
+    python -m benchmarks.serialization
+"""
+
+import argparse
+import json
+import timeit
+from datetime import UTC, datetime
+
+from bson.objectid import ObjectId
+from core.responses import ModelJSONResponse
+from fastapi.encoders import jsonable_encoder
+from pydantic import TypeAdapter
+from schemas.agent import Agent, AgentOut
+from schemas.file import File, FileCategory
+from schemas.page import Page
+
+
+def make_documents(count: int):
+    """Creates agent and file documents shaped like the db records"""
+    date = datetime.now(UTC)
+    agents = []
+    files = []
+    for i in range(count):
+        agent_id = ObjectId()
+        agents.append(
+            {
+                "_id": agent_id,
+                "name": f"agent {i}",
+                "description": "An automation agent " * 10,
+                "platforms": ["UiPath", "Python"],
+                "api_keys_required": ["OPENAI_API_KEY"],
+                "review_metrics": {"like": i, "dislike": 0, "love": 1},
+                "date_created": date,
+                "date_modified": date,
+            }
+        )
+        for category in [FileCategory.LOGO, FileCategory.UIPATH_AP]:
+            file_id = ObjectId()
+            files.append(
+                File(
+                    _id=file_id,
+                    gridfs_id=str(ObjectId()),
+                    filename=f"{category.value}.zip",
+                    agent_id=str(agent_id),
+                    category=category,
+                    restrict_access=False,
+                    download_link=f"/api/v1/files/{file_id}/download",
+                    date_created=date,
+                    date_modified=date,
+                )
+            )
+
+    return agents, files
+
+
+def group_files(files):
+    files_by_agent = {}
+    for file in files:
+        files_by_agent.setdefault(file.agent_id, []).append(file)
+
+    return files_by_agent
+
+
+def before(documents, files_by_agent, adapter) -> bytes:
+    agents = [Agent(**document) for document in documents]
+    items = []
+    for agent in agents:
+        agent_out = AgentOut(**agent.model_dump())
+        for file in files_by_agent.get(agent.id, []):
+            setattr(agent_out, file.category.value, file)
+        items.append(agent_out)
+    page = Page(items=items, item_count=len(items))
+
+    value = adapter.validate_python(page, from_attributes=True)
+    return json.dumps(jsonable_encoder(value)).encode("utf-8")
+
+
+def after(documents, files_by_agent) -> bytes:
+    agents = [Agent(**document) for document in documents]
+    items = []
+    for agent in agents:
+        data = dict(vars(agent))
+        for file in files_by_agent.get(agent.id, []):
+            data.setdefault(file.category.value, file)
+        items.append(AgentOut.model_validate(data))
+    page = Page(items=items, item_count=len(items))
+
+    return ModelJSONResponse(content=page).body
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--page-size", type=int, default=100)
+    parser.add_argument("--repeat", type=int, default=200)
+    args = parser.parse_args()
+
+    documents, files = make_documents(args.page_size)
+    files_by_agent = group_files(files)
+    adapter = TypeAdapter(Page[AgentOut])
+
+    assert json.loads(before(documents, files_by_agent, adapter)) == (
+        json.loads(after(documents, files_by_agent))
+    )
+
+    results = {}
+    for name, run in [
+        ("before", lambda: before(documents, files_by_agent, adapter)),
+        ("after", lambda: after(documents, files_by_agent)),
+    ]:
+        seconds = min(timeit.repeat(run, number=args.repeat, repeat=5))
+        results[name] = seconds / args.repeat / args.page_size * 1e6
+
+    print(f"page size: {args.page_size}")
+    for name, micros in results.items():
+        print(f"{name:>7}: {micros:8.2f} us/item")
+    print(f"speedup: {results['before'] / results['after']:.1f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,514 @@
+import io
+import os
+import shutil
+from datetime import UTC, datetime
+from tempfile import NamedTemporaryFile
+from typing import (
+    BinaryIO,
+    Callable,
+    Dict,
+    List,
+    Optional,
+    Protocol,
+    Set,
+    Tuple,
+    Union,
+    runtime_checkable,
+)
+
+import gridfs
+import schemas.file as s_file
+from bson.binary import Binary
+from bson.objectid import ObjectId
+from core.config import settings
+from core.dedup import DedupBlobStore
+from pymongo.database import Database
+
+GRIDFS = "gridfs"
+FILESYSTEM = "filesystem"
+S3 = "s3"
+DEDUP = "dedup"
+# the stores that can take resumable uploads
+APPENDABLE_STORES = {GRIDFS, FILESYSTEM}
+
+
+def join_blob_id(store: str, key: str) -> str:
+    """
+    Gets the id a file record keeps its data under. GridFS data keeps
+    the bare key so records from before other stores still resolve
+    """
+    return key if store == GRIDFS else f"{store}:{key}"
+
+
+def split_blob_id(blob_id: str) -> Tuple[str, str]:
+    """Gets the store and key of a blob id"""
+    store, _, key = blob_id.rpartition(":")
+
+    return store or GRIDFS, key
+
+
+def get_data_size(data: Union[bytes, BinaryIO]) -> Optional[int]:
+    """
+    Gets the size of data without reading it, or None when it is a
+    stream of unknown size
+    """
+    if isinstance(data, (bytes, bytearray)):
+        return len(data)
+    if isinstance(data, io.BytesIO):
+        return data.getbuffer().nbytes
+    try:
+        return os.fstat(data.fileno()).st_size
+    except (AttributeError, OSError, io.UnsupportedOperation):
+        return None
+
+
+def place_blob(category: Optional[str], size: Optional[int]) -> str:
+    """
+    Picks the store for the data of a file: the store of its category
+    in BLOB_STORES, else BLOB_LARGE_STORE when it is at least
+    BLOB_LARGE_THRESHOLD bytes, else BLOB_DEFAULT_STORE
+    """
+    if category is not None and category in settings.BLOB_STORES:
+        return settings.BLOB_STORES[category]
+
+    threshold = settings.BLOB_LARGE_THRESHOLD
+    if threshold is not None and size is not None and size >= threshold:
+        return settings.BLOB_LARGE_STORE
+
+    return settings.BLOB_DEFAULT_STORE
+
+
+def place_upload(category: Optional[str], length: int) -> str:
+    """
+    Picks the store for a resumable upload. S3 objects and chunked
+    blobs cannot be appended to at an offset, so uploads placed there
+    go to GridFS
+    """
+    store = place_blob(category, length)
+
+    return store if store in APPENDABLE_STORES else GRIDFS
+
+
+class BlobStore(Protocol):
+    """Stores file data by bucket and key"""
+
+    def put(
+        self,
+        bucket: str,
+        key: str,
+        data: Union[bytes, BinaryIO],
+        file_data: s_file.FileMetadata,
+    ): ...
+
+    def open(self, bucket: str, key: str): ...
+
+    # sizes of the keys found, read without opening the data
+    def sizes(self, bucket: str, keys: List[str]) -> Dict[str, int]: ...
+
+    def delete(self, bucket: str, key: str): ...
+
+    def path(self, bucket: str, key: str) -> Optional[str]: ...
+
+
+@runtime_checkable
+class AppendableBlobStore(BlobStore, Protocol):
+    """A blob store that takes resumable uploads"""
+
+    # invisible to readers until completed
+    def append(self, bucket: str, key: str, offset: int, data: bytes): ...
+
+    def complete(
+        self,
+        bucket: str,
+        key: str,
+        length: int,
+        file_data: s_file.FileMetadata,
+    ): ...
+
+    def abort(self, bucket: str, key: str): ...
+
+
+class GridFSBlobStore:
+    """Stores file data in the GridFS bucket of its category"""
+
+    def __init__(
+        self,
+        get_fs: Callable[[str], gridfs.GridFS],
+        get_db: Callable[[], Database],
+    ):
+        self.get_fs = get_fs
+        self.get_db = get_db
+        self._indexed: Set[str] = set()
+
+    def put(
+        self,
+        bucket: str,
+        key: str,
+        data: Union[bytes, BinaryIO],
+        file_data: s_file.FileMetadata,
+    ):
+        self.get_fs(bucket).put(
+            data,
+            _id=ObjectId(key),
+            chunkSize=settings.GRIDFS_CHUNK_SIZES.get(
+                bucket, gridfs.DEFAULT_CHUNK_SIZE
+            ),
+            **file_data.model_dump(),
+        )
+
+    def open(self, bucket: str, key: str) -> gridfs.GridOut:
+        return self.get_fs(bucket).get(ObjectId(key))
+
+    def sizes(self, bucket: str, keys: List[str]) -> Dict[str, int]:
+        files = self.get_db()[f"{bucket}.files"].find(
+            {"_id": {"$in": [ObjectId(key) for key in keys]}}, {"length": 1}
+        )
+
+        return {str(file["_id"]): file["length"] for file in files}
+
+    def delete(self, bucket: str, key: str):
+        self.get_fs(bucket).delete(ObjectId(key))
+
+    def path(self, bucket: str, key: str) -> Optional[str]:
+        return None
+
+    def _get_chunks(self, bucket: str):
+        """Gets the chunks collection of a bucket with the GridFS indexes"""
+        db = self.get_db()
+        if bucket not in self._indexed:
+            # the same checks GridFS makes before its first write
+            for collection, keys, unique in (
+                (f"{bucket}.files", {"filename": 1, "uploadDate": 1}, False),
+                (f"{bucket}.chunks", {"files_id": 1, "n": 1}, True),
+            ):
+                if db[collection].find_one(projection={"_id": 1}):
+                    continue
+                indexed = [
+                    dict(index["key"])
+                    for index in db[collection].list_indexes()
+                ]
+                if keys not in indexed:
+                    db[collection].create_index(
+                        list(keys.items()), unique=unique
+                    )
+            self._indexed.add(bucket)
+
+        return db[f"{bucket}.chunks"]
+
+    def append(self, bucket: str, key: str, offset: int, data: bytes):
+        """
+        Writes data at offset as GridFS chunks. The caller holds the
+        upload at offset, so everything before it is committed: a
+        partial last chunk keeps its bytes and is completed in place,
+        and only chunks past it, left by an abandoned append, are
+        replaced
+        """
+        chunks = self._get_chunks(bucket)
+        chunk_size = settings.GRIDFS_CHUNK_SIZES.get(
+            bucket, gridfs.DEFAULT_CHUNK_SIZE
+        )
+        files_id = ObjectId(key)
+        n, partial = divmod(offset, chunk_size)
+        if partial:
+            chunk = chunks.find_one({"files_id": files_id, "n": n})
+            if chunk is None or len(chunk["data"]) < partial:
+                raise ValueError(f"No upload data before offset {offset}")
+            head = data[: chunk_size - partial]
+            chunks.update_one(
+                {"_id": chunk["_id"]},
+                {
+                    "$set": {
+                        "data": Binary(bytes(chunk["data"][:partial]) + head)
+                    }
+                },
+            )
+            data = data[len(head) :]
+            n += 1
+
+        chunks.delete_many({"files_id": files_id, "n": {"$gte": n}})
+        if data:
+            chunks.insert_many(
+                [
+                    {
+                        "files_id": files_id,
+                        "n": n + i,
+                        "data": Binary(data[start : start + chunk_size]),
+                    }
+                    for i, start in enumerate(range(0, len(data), chunk_size))
+                ]
+            )
+
+    def complete(
+        self,
+        bucket: str,
+        key: str,
+        length: int,
+        file_data: s_file.FileMetadata,
+    ):
+        """Makes the uploaded chunks a GridFS file"""
+        chunks = self._get_chunks(bucket)
+        chunk_size = settings.GRIDFS_CHUNK_SIZES.get(
+            bucket, gridfs.DEFAULT_CHUNK_SIZE
+        )
+        files_id = ObjectId(key)
+        chunks.delete_many(
+            {"files_id": files_id, "n": {"$gte": -(-length // chunk_size)}}
+        )
+        self.get_db()[f"{bucket}.files"].insert_one(
+            {
+                "_id": files_id,
+                "length": length,
+                "chunkSize": chunk_size,
+                "uploadDate": datetime.now(UTC),
+                **file_data.model_dump(),
+            }
+        )
+
+    def abort(self, bucket: str, key: str):
+        self.get_fs(bucket).delete(ObjectId(key))
+
+
+class LocalFileData(io.FileIO):
+    """File data read from the local filesystem"""
+
+    def __init__(self, path: str):
+        super().__init__(path, "rb")
+        self.length = os.fstat(self.fileno()).st_size
+
+
+class FilesystemBlobStore:
+    """
+    Stores file data as files under a local or shared directory.
+    Data is written to a temporary file and renamed into place, so
+    readers never see a partial file
+    """
+
+    def __init__(self, root: str):
+        self.root = root
+
+    def path(self, bucket: str, key: str) -> str:
+        return os.path.join(self.root, bucket, key[-2:], key)
+
+    def put(
+        self,
+        bucket: str,
+        key: str,
+        data: Union[bytes, BinaryIO],
+        file_data: s_file.FileMetadata,
+    ):
+        path = self.path(bucket, key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with NamedTemporaryFile(
+            dir=os.path.dirname(path), prefix=".upload-", delete=False
+        ) as temp:
+            try:
+                if isinstance(data, (bytes, bytearray)):
+                    temp.write(data)
+                else:
+                    shutil.copyfileobj(data, temp, 1024 * 1024)
+            except BaseException:
+                os.unlink(temp.name)
+                raise
+        os.replace(temp.name, path)
+
+    def open(self, bucket: str, key: str) -> LocalFileData:
+        return LocalFileData(self.path(bucket, key))
+
+    def sizes(self, bucket: str, keys: List[str]) -> Dict[str, int]:
+        sizes = {}
+        for key in keys:
+            try:
+                sizes[key] = os.path.getsize(self.path(bucket, key))
+            except FileNotFoundError:
+                pass
+
+        return sizes
+
+    def delete(self, bucket: str, key: str):
+        try:
+            os.unlink(self.path(bucket, key))
+        except FileNotFoundError:
+            pass
+
+    def _upload_path(self, bucket: str, key: str) -> str:
+        return os.path.join(self.root, bucket, ".uploads", key)
+
+    def append(self, bucket: str, key: str, offset: int, data: bytes):
+        """Writes data at offset of the partial upload file"""
+        path = self._upload_path(bucket, key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        fd = os.open(path, os.O_WRONLY | os.O_CREAT, 0o644)
+        try:
+            if os.fstat(fd).st_size < offset:
+                raise ValueError(f"No upload data before offset {offset}")
+            os.pwrite(fd, data, offset)
+        finally:
+            os.close(fd)
+
+    def complete(
+        self,
+        bucket: str,
+        key: str,
+        length: int,
+        file_data: s_file.FileMetadata,
+    ):
+        """Renames the partial upload file into place"""
+        upload_path = self._upload_path(bucket, key)
+        os.truncate(upload_path, length)
+        path = self.path(bucket, key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        os.replace(upload_path, path)
+
+    def abort(self, bucket: str, key: str):
+        try:
+            os.unlink(self._upload_path(bucket, key))
+        except FileNotFoundError:
+            pass
+
+
+class S3FileData(io.RawIOBase):
+    """File data read from S3 with a ranged GET per read"""
+
+    def __init__(self, client, bucket: str, key: str):
+        self.client = client
+        self.bucket = bucket
+        self.key = key
+        self.length = client.head_object(Bucket=bucket, Key=key)[
+            "ContentLength"
+        ]
+        self.position = 0
+
+    def readable(self) -> bool:
+        return True
+
+    def seekable(self) -> bool:
+        return True
+
+    def seek(self, pos: int, whence: int = 0) -> int:
+        if whence == io.SEEK_CUR:
+            pos += self.position
+        elif whence == io.SEEK_END:
+            pos += self.length
+        self.position = max(pos, 0)
+
+        return self.position
+
+    def tell(self) -> int:
+        return self.position
+
+    def read(self, size: int = -1) -> bytes:
+        end = (
+            self.length if size < 0 else min(self.position + size, self.length)
+        )
+        if end <= self.position:
+            return b""
+
+        body = self.client.get_object(
+            Bucket=self.bucket,
+            Key=self.key,
+            Range=f"bytes={self.position}-{end - 1}",
+        )["Body"]
+        data = body.read()
+        self.position += len(data)
+
+        return data
+
+    def readinto(self, buffer) -> int:
+        data = self.read(len(buffer))
+        buffer[: len(data)] = data
+
+        return len(data)
+
+
+class S3BlobStore:
+    """
+    Stores file data in an S3 compatible object store, such as MinIO or
+    a local stand-in when BLOB_S3_ENDPOINT_URL is set. Needs boto3
+    """
+
+    def __init__(
+        self,
+        bucket: str,
+        endpoint_url: Optional[str] = None,
+        prefix: str = "",
+    ):
+        try:
+            import boto3
+        except ImportError as ex:
+            raise RuntimeError(
+                "the s3 blob store needs boto3: pip install boto3"
+            ) from ex
+
+        self.client = boto3.client("s3", endpoint_url=endpoint_url)
+        self.bucket = bucket
+        self.prefix = prefix
+
+    def _get_key(self, bucket: str, key: str) -> str:
+        return f"{self.prefix}{bucket}/{key}"
+
+    def put(
+        self,
+        bucket: str,
+        key: str,
+        data: Union[bytes, BinaryIO],
+        file_data: s_file.FileMetadata,
+    ):
+        if isinstance(data, (bytes, bytearray)):
+            data = io.BytesIO(data)
+
+        # large data is uploaded in parts
+        self.client.upload_fileobj(
+            data, self.bucket, self._get_key(bucket, key)
+        )
+
+    def open(self, bucket: str, key: str) -> S3FileData:
+        return S3FileData(self.client, self.bucket, self._get_key(bucket, key))
+
+    def sizes(self, bucket: str, keys: List[str]) -> Dict[str, int]:
+        # S3 has no batched head, so each key is one request
+        sizes = {}
+        for key in keys:
+            try:
+                response = self.client.head_object(
+                    Bucket=self.bucket, Key=self._get_key(bucket, key)
+                )
+            except self.client.exceptions.ClientError as ex:
+                if ex.response["Error"]["Code"] != "404":
+                    raise
+                continue
+            sizes[key] = response["ContentLength"]
+
+        return sizes
+
+    def delete(self, bucket: str, key: str):
+        self.client.delete_object(
+            Bucket=self.bucket, Key=self._get_key(bucket, key)
+        )
+
+    def path(self, bucket: str, key: str) -> Optional[str]:
+        return None
+
+
+def create_blob_store(
+    store: str,
+    get_fs: Callable[[str], gridfs.GridFS],
+    get_db: Callable[[], Database],
+) -> BlobStore:
+    """Creates a blob store by name"""
+    if store == GRIDFS:
+        return GridFSBlobStore(get_fs, get_db)
+    if store == FILESYSTEM:
+        return FilesystemBlobStore(settings.BLOB_FILESYSTEM_ROOT)
+    if store == S3:
+        if not settings.BLOB_S3_BUCKET:
+            raise RuntimeError("BLOB_S3_BUCKET is not set")
+        return S3BlobStore(
+            settings.BLOB_S3_BUCKET,
+            endpoint_url=settings.BLOB_S3_ENDPOINT_URL,
+            prefix=settings.BLOB_S3_PREFIX,
+        )
+
+    if store == DEDUP:
+        return DedupBlobStore(get_db)
+
+    raise ValueError(f"Unknown blob store {store}")
@@ -1,15 +1,95 @@
+import atexit
+import copy
+import json
 import logging
 import logging.config
 import os
-from logging.handlers import TimedRotatingFileHandler
+import queue
+import random
+from functools import lru_cache
+from logging.handlers import (
+    QueueHandler,
+    QueueListener,
+    TimedRotatingFileHandler,
+)
+from typing import Dict, List, Literal, Optional
 
+from core.metrics import LOG_RECORDS_DROPPED
 from dotenv import load_dotenv
 from pydantic_settings import BaseSettings
 
 load_dotenv()
 
 
-def configure_logging():
+class JsonFormatter(logging.Formatter):
+    """Formats log records as single line JSON objects"""
+
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            "time": self.formatTime(record),
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+        }
+        if record.exc_info:
+            entry["exception"] = self.formatException(record.exc_info)
+
+        return json.dumps(entry, default=str)
+
+
+class DebugSampler(logging.Filter):
+    """Lets through only a fraction of DEBUG records"""
+
+    def __init__(self, rate: float):
+        super().__init__()
+        self.rate = rate
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if record.levelno > logging.DEBUG or self.rate >= 1:
+            return True
+
+        return random.random() < self.rate
+
+
+class DroppingQueueHandler(QueueHandler):
+    """
+    QueueHandler for a bounded queue that drops new records instead of
+    blocking the caller when the queue is full, counting them by level
+    """
+
+    def __init__(self, log_queue: queue.Queue):
+        super().__init__(log_queue)
+        self.dropped: Dict[str, int] = {}
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        """
+        Merges the args into the message of a copy of the record, but
+        unlike QueueHandler keeps exc_info, so the formatters of the
+        listener still see the exception. The queue never leaves the
+        process, so the record is not pickled
+        """
+        record = copy.copy(record)
+        record.msg = record.getMessage()
+        record.args = None
+
+        return record
+
+    def enqueue(self, record: logging.LogRecord):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            level = record.levelname
+            self.dropped[level] = self.dropped.get(level, 0) + 1
+            LOG_RECORDS_DROPPED.labels(level).inc()
+
+
+@lru_cache(maxsize=None)
+def configure_logging() -> DroppingQueueHandler:
+    """
+    Sends all logs through a bounded queue to a background thread that
+    writes them to the log files and console, so logging never does
+    I/O on the calling thread. Runs once, on app startup
+    """
     os.makedirs("./logs", exist_ok=True)
     # Create a TimedRotatingFileHandler
     handler = TimedRotatingFileHandler(
@@ -20,22 +100,19 @@ def configure_logging():
     )
 
     # Create a formatter
-    formatter = logging.Formatter(
-        "%(asctime)s - %(levelname)s - %(name)s  - %(message)s"
-    )
+    if settings.LOG_FORMAT == "json":
+        formatter = JsonFormatter()
+    else:
+        formatter = logging.Formatter(
+            "%(asctime)s - %(levelname)s - %(name)s  - %(message)s"
+        )
     handler.setFormatter(formatter)
     handler.setLevel(logging.INFO)
 
-    # Get the root logger
-    root_logger = logging.getLogger()
-    root_logger.setLevel(logging.DEBUG)  # Set the logging level globally
-    root_logger.addHandler(handler)
-
     # Optional: Adding console logging
     console_handler = logging.StreamHandler()
     console_handler.setFormatter(formatter)
     console_handler.setLevel(logging.INFO)
-    root_logger.addHandler(console_handler)
 
     # detailed logs
     detailed_handler = TimedRotatingFileHandler(
@@ -46,7 +123,31 @@ def configure_logging():
     )
     detailed_handler.setFormatter(formatter)
     detailed_handler.setLevel(logging.DEBUG)
-    root_logger.addHandler(detailed_handler)
+
+    # Write from a background thread fed by a bounded queue
+    queue_handler = DroppingQueueHandler(
+        queue.Queue(maxsize=settings.LOG_QUEUE_SIZE)
+    )
+    queue_handler.addFilter(DebugSampler(settings.LOG_DEBUG_SAMPLE_RATE))
+    listener = QueueListener(
+        queue_handler.queue,
+        handler,
+        console_handler,
+        detailed_handler,
+        respect_handler_level=True,
+    )
+    listener.start()
+    atexit.register(listener.stop)
+
+    # Get the root logger
+    root_logger = logging.getLogger()
+    root_logger.setLevel(logging.DEBUG)  # Set the logging level globally
+    root_logger.addHandler(queue_handler)
+
+    return queue_handler
+
+
+BlobStoreName = Literal["gridfs", "filesystem", "s3", "dedup"]
 
 
 class Settings(BaseSettings):
@@ -56,8 +157,91 @@ class Settings(BaseSettings):
     API_V1_STR: str = "/api/v1"
     MONGODB_URI: str
     DATABSE_NAME: str = "agents_service_db"
+    STORAGE_BACKEND: Literal["mongo", "memory"] = "mongo"
+    MONGO_MAX_POOL_SIZE: int = 100
+    MONGO_MIN_POOL_SIZE: int = 0
+    MONGO_WAIT_QUEUE_TIMEOUT_MS: Optional[int] = None
+    MONGO_SERVER_SELECTION_TIMEOUT_MS: int = 30000
+    MONGO_COMPRESSORS: str = ""
+    MONGO_SECONDARY_READS: bool = False
+    MONGO_MAX_STALENESS_SECONDS: int = 90
+    BLOB_DEFAULT_STORE: BlobStoreName = "gridfs"
+    BLOB_STORES: Dict[str, BlobStoreName] = {}
+    BLOB_LARGE_THRESHOLD: Optional[int] = None
+    BLOB_LARGE_STORE: BlobStoreName = "filesystem"
+    BLOB_FILESYSTEM_ROOT: str = "./blobs"
+    BLOB_S3_BUCKET: Optional[str] = None
+    BLOB_S3_ENDPOINT_URL: Optional[str] = None
+    BLOB_S3_PREFIX: str = ""
+    DEDUP_MIN_CHUNK_SIZE: int = 16 * 1024
+    DEDUP_MAX_CHUNK_SIZE: int = 256 * 1024
+    # random data, such as packages, gets chunks of about
+    # 2 ** (DEDUP_ANCHOR_RUN + 1) bytes past the min
+    DEDUP_ANCHOR_RUN: int = 15
+    DEDUP_BATCH_SIZE: int = 64
+    # replaced files of these categories are kept as versions. Each
+    # version holds on to its data, so only chunks a version changes are
+    # added when the category is placed on the dedup store, and up to
+    # FILE_VERSIONS_KEPT full copies otherwise. Resumable uploads are
+    # never deduplicated, so categories updated that way keep full copies
+    FILE_VERSIONS_KEPT: int = 10
+    FILE_VERSION_CATEGORIES: List[str] = []
+    UPLOAD_TTL_SECONDS: int = 24 * 3600
+    UPLOAD_WRITE_SIZE: int = 4 * 1024 * 1024
+    UPLOAD_APPEND_LEASE_SECONDS: int = 300
+    UPLOAD_CLEANUP_INTERVAL_SECONDS: float = 600
+    GRIDFS_DEFAULT_BUCKET: str = "fs"
+    GRIDFS_BUCKETS: Dict[str, str] = {
+        "logo": "images",
+        "profile_picture": "images",
+        "metadata": "documents",
+        "instructions": "documents",
+        "resume": "documents",
+        "pa_web_agent_package": "packages",
+        "pa_web_agent_dependencies": "packages",
+        "pa_desk_agent_package": "packages",
+        "pa_desk_agent_dependencies": "packages",
+        "uipath_agent_package": "packages",
+        "uipath_agent_dependencies": "packages",
+    }
+    GRIDFS_CHUNK_SIZES: Dict[str, int] = {
+        "images": 255 * 1024,
+        "documents": 255 * 1024,
+        "packages": 4 * 1024 * 1024,
+    }
     ALLOWED_ORIGINS: str = "*"
+    BATCH_MAX_IDS: int = 100
+    EXPORT_BATCH_SIZE: int = 500
+    BUNDLE_READ_SIZE: int = 1024 * 1024
+    MANIFEST_WORKERS: int = 2
+    MEMBER_READ_SIZE: int = 256 * 1024
+    DOWNLOAD_READ_SIZE: int = 1024 * 1024
+    MANIFEST_MAX_MEMBERS: int = 20000
+    MANIFEST_CATEGORIES: List[str] = [
+        "pa_web_agent_package",
+        "pa_desk_agent_package",
+        "uipath_agent_package",
+    ]
+    IMPORT_WORKERS: int = 8
+    METRICS_ENABLED: bool = True
+    SERVER_TIMING_ENABLED: bool = True
+    REQUEST_DB_COMMAND_BUDGET: int = 20
+    REQUEST_LATENCY_BUDGET_MS: float = 1000
+    SLOW_QUERY_THRESHOLD_MS: float = 100
+    SLOW_QUERY_COLLECTION: str = "slow_queries"
+    SLOW_QUERY_LOG_SIZE: int = 16 * 1024 * 1024
+    ADMIN_TOKEN: Optional[str] = None
+    LOG_FORMAT: Literal["text", "json"] = "text"
+    LOG_QUEUE_SIZE: int = 10000
+    LOG_DEBUG_SAMPLE_RATE: float = 1.0
+    LOOP_WATCHDOG_ENABLED: bool = False
+    LOOP_WATCHDOG_THRESHOLD_MS: float = 100
+    LOOP_WATCHDOG_INTERVAL_MS: float = 20
+    PROFILING_ENABLED: bool = True
+    PROFILE_SAMPLE_INTERVAL_MS: float = 5
+    PROFILE_MAX_SAMPLES: int = 20000
+    PROFILE_COLLECTION: str = "profiles"
+    PROFILE_LOG_SIZE: int = 64 * 1024 * 1024
 
 
 settings = Settings()
-configure_logging()
@@ -0,0 +1,279 @@
+import bisect
+import hashlib
+import io
+from itertools import accumulate
+from typing import (
+    BinaryIO,
+    Callable,
+    Dict,
+    Iterator,
+    List,
+    Optional,
+    Set,
+    Union,
+)
+
+import schemas.file as s_file
+from bson.binary import Binary
+from bson.objectid import ObjectId
+from core.config import settings
+from pymongo import UpdateOne
+from pymongo.database import Database
+
+# maps every byte value to one bit of a fixed digest, so about half the
+# byte values count towards an anchor
+ANCHOR_TABLE = bytes(
+    (hashlib.sha256(b"dedup anchors").digest()[value // 8] >> (value % 8)) & 1
+    for value in range(256)
+)
+READ_SIZE = 4 * 1024 * 1024
+
+
+def split_chunks(
+    data: Union[bytes, BinaryIO],
+    min_size: int,
+    max_size: int,
+    anchor_run: int,
+) -> Iterator[bytes]:
+    """
+    Splits data into content defined chunks. A chunk ends after the
+    first run of anchor_run bytes from the anchor half of the byte
+    values past min_size, or at max_size. Boundaries only depend on the
+    bytes around them, so an edit only changes the chunks it touches.
+    The runs are found with bytes.translate and bytes.find, which keeps
+    the split at C speed
+    """
+    if isinstance(data, (bytes, bytearray)):
+        data = io.BytesIO(data)
+
+    anchor = b"\x01" * anchor_run
+    buffer = b""
+    marks = b""
+    position = 0
+    eof = False
+    while True:
+        if not eof and len(buffer) - position < max_size:
+            piece = data.read(READ_SIZE)
+            if piece:
+                buffer = buffer[position:] + piece
+                marks = buffer.translate(ANCHOR_TABLE)
+                position = 0
+            else:
+                eof = True
+            continue
+        if position >= len(buffer):
+            return
+
+        end = min(position + max_size, len(buffer))
+        start = position + max(min_size - anchor_run, 0)
+        found = marks.find(anchor, start, end) if start < end else -1
+        cut = found + anchor_run if found >= 0 else end
+        yield buffer[position:cut]
+        position = cut
+
+
+class DedupFileData(io.RawIOBase):
+    """File data reassembled from its chunks as it is read"""
+
+    def __init__(self, chunks, chunk_ids: List[bytes], sizes: List[int]):
+        self.chunks = chunks
+        self.chunk_ids = chunk_ids
+        self.offsets = [0, *accumulate(sizes)]
+        self.length = self.offsets[-1]
+        self.position = 0
+        self._cached: Dict[bytes, bytes] = {}
+
+    def readable(self) -> bool:
+        return True
+
+    def seekable(self) -> bool:
+        return True
+
+    def seek(self, pos: int, whence: int = 0) -> int:
+        if whence == io.SEEK_CUR:
+            pos += self.position
+        elif whence == io.SEEK_END:
+            pos += self.length
+        self.position = max(pos, 0)
+
+        return self.position
+
+    def tell(self) -> int:
+        return self.position
+
+    def _get_chunks(self, first: int, last: int) -> List[bytes]:
+        """Gets chunks first to last with one query for the uncached"""
+        ids = self.chunk_ids[first : last + 1]
+        missing = [id for id in set(ids) if id not in self._cached]
+        found = dict(self._cached)
+        if missing:
+            for chunk in self.chunks.find({"_id": {"$in": missing}}):
+                found[chunk["_id"]] = chunk["data"]
+        # the last chunk is kept for reads that continue in it
+        self._cached = {ids[-1]: found[ids[-1]]}
+
+        return [found[id] for id in ids]
+
+    def read(self, size: int = -1) -> bytes:
+        end = (
+            self.length if size < 0 else min(self.position + size, self.length)
+        )
+        if end <= self.position:
+            return b""
+
+        first = bisect.bisect_right(self.offsets, self.position) - 1
+        last = bisect.bisect_left(self.offsets, end) - 1
+        data = b"".join(self._get_chunks(first, last))
+        start = self.position - self.offsets[first]
+        data = data[start : start + end - self.position]
+        self.position = end
+
+        return data
+
+    def readinto(self, buffer) -> int:
+        data = self.read(len(buffer))
+        buffer[: len(data)] = data
+
+        return len(data)
+
+
+class DedupBlobStore:
+    """
+    Stores file data as content defined chunks, each unique chunk once
+    per bucket, with a list of the chunks of every blob. Data that
+    shares most of its bytes with stored data, such as a new version of
+    a package, only writes the chunks that changed. Chunks count the
+    blobs using them and are deleted with the last one
+    """
+
+    def __init__(self, get_db: Callable[[], Database]):
+        self.get_db = get_db
+
+    def _get_chunks(self, bucket: str):
+        return self.get_db()[f"{bucket}.dedup_chunks"]
+
+    def _get_blobs(self, bucket: str):
+        return self.get_db()[f"{bucket}.dedup_blobs"]
+
+    def _store_chunks(self, bucket: str, batch: Dict[bytes, bytes]):
+        """
+        Adds a reference to each chunk of a batch with one bulk write,
+        sending the data of the chunks that are not stored yet
+        """
+        chunks = self._get_chunks(bucket)
+        stored = {
+            chunk["_id"]
+            for chunk in chunks.find({"_id": {"$in": list(batch)}}, {"_id": 1})
+        }
+        result = chunks.bulk_write(
+            [
+                UpdateOne(
+                    {"_id": id},
+                    {
+                        "$inc": {"refs": 1},
+                        "$setOnInsert": (
+                            {"size": len(batch[id])}
+                            if id in stored
+                            else {
+                                "data": Binary(batch[id]),
+                                "size": len(batch[id]),
+                            }
+                        ),
+                    },
+                    upsert=True,
+                )
+                for id in batch
+            ],
+            ordered=False,
+        )
+        # a chunk deleted since it was looked up is inserted without
+        # its data, which is written again
+        missing = [id for id in result.upserted_ids.values() if id in stored]
+        if missing:
+            chunks.bulk_write(
+                [
+                    UpdateOne(
+                        {"_id": id}, {"$set": {"data": Binary(batch[id])}}
+                    )
+                    for id in missing
+                ],
+                ordered=False,
+            )
+
+    def put(
+        self,
+        bucket: str,
+        key: str,
+        data: Union[bytes, BinaryIO],
+        file_data: s_file.FileMetadata,
+    ):
+        chunk_ids: List[bytes] = []
+        sizes: List[int] = []
+        counted: Set[bytes] = set()
+        batch: Dict[bytes, bytes] = {}
+        for chunk in split_chunks(
+            data,
+            settings.DEDUP_MIN_CHUNK_SIZE,
+            settings.DEDUP_MAX_CHUNK_SIZE,
+            settings.DEDUP_ANCHOR_RUN,
+        ):
+            id = hashlib.sha256(chunk).digest()
+            # a blob holds one reference to each of its chunks
+            if id not in counted:
+                counted.add(id)
+                batch[id] = chunk
+            chunk_ids.append(id)
+            sizes.append(len(chunk))
+            if len(batch) >= settings.DEDUP_BATCH_SIZE:
+                self._store_chunks(bucket, batch)
+                batch = {}
+        if batch:
+            self._store_chunks(bucket, batch)
+
+        self._get_blobs(bucket).insert_one(
+            {
+                "_id": ObjectId(key),
+                "chunks": chunk_ids,
+                "sizes": sizes,
+                "length": sum(sizes),
+            }
+        )
+
+    def open(self, bucket: str, key: str) -> DedupFileData:
+        blob = self._get_blobs(bucket).find_one({"_id": ObjectId(key)})
+        if blob is None:
+            raise FileNotFoundError(f"No file data with key {key}")
+
+        return DedupFileData(
+            self._get_chunks(bucket), blob["chunks"], blob["sizes"]
+        )
+
+    def sizes(self, bucket: str, keys: List[str]) -> Dict[str, int]:
+        blobs = self._get_blobs(bucket).find(
+            {"_id": {"$in": [ObjectId(key) for key in keys]}}, {"length": 1}
+        )
+
+        return {str(blob["_id"]): blob["length"] for blob in blobs}
+
+    def delete(self, bucket: str, key: str):
+        blob = self._get_blobs(bucket).find_one_and_delete(
+            {"_id": ObjectId(key)}
+        )
+        if blob is None:
+            return
+
+        ids = list(set(blob["chunks"]))
+        chunks = self._get_chunks(bucket)
+        for start in range(0, len(ids), settings.DEDUP_BATCH_SIZE):
+            batch = ids[start : start + settings.DEDUP_BATCH_SIZE]
+            chunks.bulk_write(
+                [
+                    UpdateOne({"_id": id}, {"$inc": {"refs": -1}})
+                    for id in batch
+                ],
+                ordered=False,
+            )
+            chunks.delete_many({"_id": {"$in": batch}, "refs": {"$lte": 0}})
+
+    def path(self, bucket: str, key: str) -> Optional[str]:
+        return None
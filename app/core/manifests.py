@@ -0,0 +1,210 @@
+import bz2
+import threading
+import zlib
+from concurrent.futures import Future, ThreadPoolExecutor, wait
+from datetime import UTC, datetime
+from logging import getLogger
+from typing import BinaryIO, Iterator, Optional, Set
+from zipfile import (
+    ZIP_BZIP2,
+    ZIP_DEFLATED,
+    ZIP_STORED,
+    BadZipFile,
+    ZipFile,
+)
+
+import schemas.file as s_file
+from core.config import settings
+from core.storage import Storage
+from core.zipstream import LOCAL_HEADER
+
+
+def is_package(category: Optional[str]) -> bool:
+    """Checks if files of a category are zip packages to index"""
+    return category is not None and category in settings.MANIFEST_CATEGORIES
+
+
+def read_manifest(data: BinaryIO) -> s_file.Manifest:
+    """
+    Reads the central directory of a zip package. Only the end of the
+    data is read, by seeking to the directory
+    """
+    date = datetime.now(UTC)
+    try:
+        with ZipFile(data) as package:
+            members = package.infolist()
+            if len(members) > settings.MANIFEST_MAX_MEMBERS:
+                return s_file.Manifest(
+                    error=f"Package has more than "
+                    f"{settings.MANIFEST_MAX_MEMBERS} members",
+                    date_created=date,
+                )
+            return s_file.Manifest(
+                members=[
+                    s_file.ManifestMember(
+                        path=member.filename,
+                        size=member.file_size,
+                        compressed_size=member.compress_size,
+                        crc=member.CRC,
+                        offset=member.header_offset,
+                        compress_type=member.compress_type,
+                    )
+                    for member in members
+                ],
+                date_created=date,
+            )
+    except BadZipFile as ex:
+        return s_file.Manifest(error=str(ex), date_created=date)
+
+
+def index_manifest(storage: Storage, file: s_file.File) -> s_file.Manifest:
+    """Reads the manifest of a package file and attaches it to its record"""
+    logger = getLogger(__name__ + ".index_manifest")
+    with storage.file_open_data(file.gridfs_id, file.bucket) as data:
+        manifest = read_manifest(data)
+    if storage.file_set_manifest(file.id, file.gridfs_id, manifest):
+        logger.info(
+            f"Indexed {len(manifest.members)} members of file({file.id})"
+        )
+
+    return manifest
+
+
+DECOMPRESSORS = {
+    ZIP_DEFLATED: lambda: zlib.decompressobj(-zlib.MAX_WBITS),
+    ZIP_BZIP2: bz2.BZ2Decompressor,
+}
+
+
+def is_streamable(member: s_file.ManifestMember) -> bool:
+    """Checks if a member is stored with a compression stream_member reads"""
+    return (
+        member.compress_type == ZIP_STORED
+        or member.compress_type in DECOMPRESSORS
+    )
+
+
+def decompress_chunks(
+    decompressor, data: bytes, chunk_size: int
+) -> Iterator[bytes]:
+    """
+    Decompresses data in pieces of at most chunk_size bytes, so a small
+    input that expands a lot is never held in memory at once
+    """
+    while True:
+        chunk = decompressor.decompress(data, chunk_size)
+        if chunk:
+            yield chunk
+        # zlib hands back the input it did not get to, bz2 keeps it
+        data = getattr(decompressor, "unconsumed_tail", b"")
+        if data:
+            continue
+        if hasattr(decompressor, "needs_input"):
+            if decompressor.needs_input or decompressor.eof:
+                return
+        elif len(chunk) < chunk_size:
+            return
+
+
+def stream_member(
+    data: BinaryIO, member: s_file.ManifestMember, chunk_size: int
+) -> Iterator[bytes]:
+    """
+    Reads one member of a zip package in chunk_size pieces, seeking to
+    its local header, so only that member's bytes are read. Raises
+    ValueError when the data does not match the manifest
+    """
+    if not is_streamable(member):
+        raise ValueError(f"Unsupported compression {member.compress_type}")
+
+    data.seek(member.offset)
+    header = LOCAL_HEADER.unpack(data.read(LOCAL_HEADER.size))
+    if header[0] != b"PK\x03\x04":
+        raise ValueError(f"No local header for {member.path}")
+    # the name and extra field lengths of the local header
+    data.seek(header[10] + header[11], 1)
+
+    decompressor = None
+    if member.compress_type != ZIP_STORED:
+        decompressor = DECOMPRESSORS[member.compress_type]()
+
+    crc = 0
+    size = 0
+    remaining = member.compressed_size
+    while remaining > 0:
+        chunk = data.read(min(chunk_size, remaining))
+        if not chunk:
+            raise ValueError(f"{member.path} ends early")
+        remaining -= len(chunk)
+        pieces = (
+            [chunk]
+            if decompressor is None
+            else decompress_chunks(decompressor, chunk, chunk_size)
+        )
+        for piece in pieces:
+            size += len(piece)
+            # the size is sent as the Content-Length of the member
+            if size > member.size:
+                raise ValueError(f"{member.path} is larger than listed")
+            crc = zlib.crc32(piece, crc)
+            yield piece
+
+    if size != member.size:
+        raise ValueError(f"{member.path} is smaller than listed")
+    if crc != member.crc:
+        raise ValueError(f"Bad CRC for {member.path}")
+
+
+class ManifestIndexer:
+    """
+    Indexes package manifests on a pool of MANIFEST_WORKERS threads,
+    so storing a package does not wait for its directory to be read.
+    The pool is created on first use
+    """
+
+    def __init__(self):
+        self._pool: Optional[ThreadPoolExecutor] = None
+        self._pending: Set[Future] = set()
+        self._lock = threading.Lock()
+
+    def submit(
+        self, storage: Storage, file_id: str, category: Optional[str]
+    ) -> Optional[Future]:
+        """Queues a file to be indexed when it is a package"""
+        if not is_package(category):
+            return None
+
+        with self._lock:
+            if self._pool is None:
+                self._pool = ThreadPoolExecutor(
+                    max_workers=settings.MANIFEST_WORKERS,
+                    thread_name_prefix="manifests",
+                )
+            future = self._pool.submit(self._index, storage, file_id)
+            self._pending.add(future)
+        future.add_done_callback(self._pending.discard)
+
+        return future
+
+    def _index(self, storage: Storage, file_id: str):
+        logger = getLogger(__name__ + ".ManifestIndexer")
+        try:
+            file = storage.file_get_record({"_id": file_id})
+            if file is not None:
+                index_manifest(storage, file)
+        except Exception as ex:
+            logger.error(f"Failed to index file({file_id}): {ex}")
+
+    def wait(self):
+        """Waits for the queued files to be indexed"""
+        wait(list(self._pending))
+
+    def shutdown(self):
+        """Drops the queued files and stops the pool"""
+        with self._lock:
+            if self._pool is not None:
+                self._pool.shutdown(cancel_futures=True)
+                self._pool = None
+
+
+manifest_indexer = ManifestIndexer()
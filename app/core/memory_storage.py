@@ -0,0 +1,1099 @@
+import copy
+import io
+import operator
+import threading
+from datetime import UTC, datetime, timedelta
+from typing import (
+    Any,
+    BinaryIO,
+    Callable,
+    Dict,
+    FrozenSet,
+    Iterator,
+    List,
+    Optional,
+    Tuple,
+    Type,
+    Union,
+)
+
+import schemas.file as s_file
+from bson.objectid import ObjectId
+from core.config import settings
+from core.storage import get_bucket, is_versioned
+from fastapi import HTTPException, status
+from pydantic import BaseModel
+from schemas import agent as s_agent
+from schemas import consultant as s_consultant
+from schemas import profile as s_profile
+from schemas import review as s_review
+from schemas import slow_query as s_slow_query
+from schemas import upload as s_upload
+from schemas.fieldset import narrow_model
+from schemas.page import Page
+
+_MISSING = object()
+
+
+def _now() -> datetime:
+    """Gets the current time the way mongo returns it: naive UTC in ms"""
+    now = datetime.now(UTC).replace(tzinfo=None)
+    return now.replace(microsecond=now.microsecond // 1000 * 1000)
+
+
+def _get_path(document: Dict, path: str) -> Any:
+    value = document
+    for key in path.split("."):
+        if not isinstance(value, dict) or key not in value:
+            return _MISSING
+        value = value[key]
+
+    return value
+
+
+def _set_path(document: Dict, path: str, value: Any):
+    *parents, key = path.split(".")
+    for parent in parents:
+        document = document.setdefault(parent, {})
+    document[key] = value
+
+
+def _align(value: Any, condition: Any) -> Tuple[Any, Any]:
+    """Treats naive datetimes as UTC so they compare with aware ones"""
+    if isinstance(value, datetime) and isinstance(condition, datetime):
+        if value.tzinfo is None:
+            value = value.replace(tzinfo=UTC)
+        if condition.tzinfo is None:
+            condition = condition.replace(tzinfo=UTC)
+
+    return value, condition
+
+
+def _equals(value: Any, condition: Any) -> bool:
+    if condition is None:
+        return value is _MISSING or value is None
+    if isinstance(value, list) and not isinstance(condition, list):
+        return condition in value
+
+    return value == condition
+
+
+def _compare(compare: Callable[[Any, Any], bool]):
+    def match(value: Any, condition: Any) -> bool:
+        if value is _MISSING or value is None:
+            return False
+        try:
+            return compare(*_align(value, condition))
+        except TypeError:
+            return False
+
+    return match
+
+
+_OPERATORS: Dict[str, Callable[[Any, Any], bool]] = {
+    "$eq": _equals,
+    "$ne": lambda value, condition: not _equals(value, condition),
+    "$gt": _compare(operator.gt),
+    "$gte": _compare(operator.ge),
+    "$lt": _compare(operator.lt),
+    "$lte": _compare(operator.le),
+    "$in": lambda value, condition: any(_equals(value, c) for c in condition),
+    "$nin": lambda value, condition: not any(
+        _equals(value, c) for c in condition
+    ),
+    "$exists": lambda value, condition: (value is not _MISSING)
+    == bool(condition),
+}
+
+
+def matches(document: Dict, filter: Dict) -> bool:
+    """Checks a document against a mongo filter"""
+    for key, condition in filter.items():
+        if key == "$and":
+            if not all(matches(document, f) for f in condition):
+                return False
+            continue
+        if key == "$or":
+            if not any(matches(document, f) for f in condition):
+                return False
+            continue
+
+        value = _get_path(document, key)
+        if (
+            isinstance(condition, dict)
+            and condition
+            and all(op.startswith("$") for op in condition)
+        ):
+            for op, argument in condition.items():
+                if op not in _OPERATORS:
+                    raise ValueError(f"Unsupported query operator {op}")
+                if not _OPERATORS[op](value, argument):
+                    return False
+        elif not _equals(value, condition):
+            return False
+
+    return True
+
+
+def apply_update(document: Dict, update: Dict) -> Dict:
+    """Applies a mongo update to a copy of a document"""
+    document = copy.deepcopy(document)
+    for op, fields in update.items():
+        for path, value in fields.items():
+            if op == "$set":
+                _set_path(document, path, value)
+            elif op == "$inc":
+                current = _get_path(document, path)
+                current = 0 if current is _MISSING else current
+                _set_path(document, path, current + value)
+            elif op == "$unset":
+                *parents, key = path.split(".")
+                parent = (
+                    _get_path(document, ".".join(parents))
+                    if parents
+                    else document
+                )
+                if isinstance(parent, dict):
+                    parent.pop(key, None)
+            else:
+                raise ValueError(f"Unsupported update operator {op}")
+
+    return document
+
+
+class MemoryFileData(io.BytesIO):
+    """File data held in memory"""
+
+    def __init__(self, data: bytes):
+        super().__init__(data)
+        self.length = len(data)
+
+
+class MemoryStorage:
+    """
+    Storage class keeping records in dicts and file data as bytes.
+    Records are never shared with callers and updates replace records
+    instead of changing them, so it is safe to use from many threads.
+    Nothing is persisted.
+    """
+
+    def __init__(self):
+        self.collections: Dict[str, Dict[ObjectId, Dict]] = {}
+        self.blobs: Dict[str, bytes] = {}
+        self.upload_data: Dict[str, bytearray] = {}
+        self._lock = threading.RLock()
+
+    def connect(self):
+        pass
+
+    def ensure_indexes(self):
+        pass
+
+    def warm_up(self):
+        pass
+
+    def close(self):
+        pass
+
+    def _get_collection(self, name: str) -> Dict[ObjectId, Dict]:
+        return self.collections.setdefault(name, {})
+
+    def _insert(self, name: str, document: Dict) -> str:
+        document["_id"] = ObjectId()
+        with self._lock:
+            self._get_collection(name)[document["_id"]] = document
+
+        return str(document["_id"])
+
+    def _find(self, name: str, filter: Dict, limit: int = 0) -> List[Dict]:
+        if "_id" in filter and type(filter["_id"]) is str:
+            filter = {**filter, "_id": ObjectId(filter["_id"])}
+
+        collection = self._get_collection(name)
+        if isinstance(filter.get("_id"), ObjectId):
+            # direct lookup by id
+            document = collection.get(filter["_id"])
+            if document is None or not matches(document, filter):
+                return []
+            return [document]
+
+        with self._lock:
+            documents = list(collection.values())
+
+        found = []
+        for document in documents:
+            if matches(document, filter):
+                found.append(document)
+                if limit and len(found) >= limit:
+                    break
+
+        return found
+
+    def _find_one(self, name: str, filter: Dict) -> Optional[Dict]:
+        documents = self._find(name, filter, limit=1)
+
+        return documents[0] if documents else None
+
+    def _update_one(self, name: str, filter: Dict, update: Dict):
+        with self._lock:
+            document = self._find_one(name, filter)
+            if document:
+                self._get_collection(name)[document["_id"]] = apply_update(
+                    document, update
+                )
+
+    def _delete_one(self, name: str, filter: Dict) -> Optional[Dict]:
+        with self._lock:
+            document = self._find_one(name, filter)
+            if document:
+                del self._get_collection(name)[document["_id"]]
+
+        return document
+
+    def _create(self, name: str, data: BaseModel) -> str:
+        date = _now()
+        document = data.model_dump()
+        document["date_created"] = date
+        document["date_modified"] = date
+
+        return self._insert(name, document)
+
+    def _iter_batches(
+        self,
+        name: str,
+        model: Type[BaseModel],
+        filter: Dict,
+        batch_size: int,
+    ) -> Iterator[List[BaseModel]]:
+        documents = sorted(self._find(name, filter), key=lambda d: d["_id"])
+        for start in range(0, len(documents), batch_size):
+            yield [
+                model(**document)
+                for document in documents[start : start + batch_size]
+            ]
+
+    def _get_model(
+        self, model: Type[BaseModel], fields: Optional[FrozenSet[str]]
+    ) -> Type[BaseModel]:
+        if fields is None:
+            return model
+
+        return narrow_model(model, fields | {"id"})
+
+    def _set_modified(self, update: Dict) -> Dict:
+        if "$set" in update:
+            update["$set"]["date_modified"] = _now()
+        else:
+            update["$set"] = {"date_modified": _now()}
+
+        return update
+
+    def _get_page(
+        self,
+        get_records: Callable[..., List],
+        get_record: Callable[[Dict], Optional[BaseModel]],
+        filter: Dict,
+        limit: int,
+        cursor: Optional[str],
+        **kwargs,
+    ) -> Page:
+        if cursor:
+            filter["_id"] = {"$gt": ObjectId(cursor)}
+
+        items = get_records(filter, limit=limit, **kwargs)
+
+        item_count = len(items)
+        next_cursor = None
+
+        if item_count > 0:
+            count_query = filter.copy()
+            count_query["_id"] = {"$gt": ObjectId(items[-1].id)}
+            last_item = get_record(count_query)
+            if last_item and last_item.id != items[-1].id:
+                next_cursor = items[-1].id
+
+        return Page(
+            items=items, item_count=item_count, next_cursor=next_cursor
+        )
+
+    def _check_update(self, update: Dict, keys: List[str]):
+        for key in keys:
+            if key in update:
+                raise KeyError(f"Invalid Key. KEY {key} cannot be changed")
+
+    # agents
+    def agent_create_record(self, agent_data: s_agent.AgentBase) -> str:
+        """Creates a agent record"""
+        return self._create("agents", agent_data)
+
+    def agent_create_records(
+        self, agents_data: List[s_agent.AgentBase]
+    ) -> List[str]:
+        """Creates multiple agent records"""
+        return [self._create("agents", agent) for agent in agents_data]
+
+    def agent_get_record(self, filter: Dict) -> Optional[s_agent.Agent]:
+        """Gets a agent record using the supplied filter"""
+        agent = self._find_one("agents", filter)
+
+        return s_agent.Agent(**agent) if agent else None
+
+    def agent_get_all_records(
+        self,
+        filter: Dict,
+        limit: int = 0,
+        fields: Optional[FrozenSet[str]] = None,
+    ) -> List[s_agent.Agent]:
+        """
+        Gets all agent records using the supplied filter, narrowed to
+        fields if they are supplied
+        """
+        model = self._get_model(s_agent.Agent, fields)
+
+        return [
+            model(**agent) for agent in self._find("agents", filter, limit)
+        ]
+
+    def agent_count_records(self, filter: Dict) -> int:
+        """Counts the agent records matching the supplied filter"""
+        return len(self._find("agents", filter))
+
+    def agent_iter_batches(
+        self,
+        filter: Dict,
+        batch_size: int = 500,
+        fields: Optional[FrozenSet[str]] = None,
+    ) -> Iterator[List[s_agent.Agent]]:
+        """Iterates over the matching agent records in _id order"""
+        return self._iter_batches(
+            "agents",
+            self._get_model(s_agent.Agent, fields),
+            filter,
+            batch_size,
+        )
+
+    def agent_get_page(
+        self, filter: Dict, limit: int = 0, cursor: Optional[str] = None
+    ) -> Page[s_agent.Agent]:
+        """Gets a page of agents"""
+        return self._get_page(
+            self.agent_get_all_records,
+            self.agent_get_record,
+            filter,
+            limit,
+            cursor,
+        )
+
+    def agent_verify_record(self, filter: Dict) -> s_agent.Agent:
+        """
+        Gets a agent record using the filter
+        and raises an error if a matching record is not found
+        """
+        agent = self.agent_get_record(filter)
+
+        if agent is None:
+            raise HTTPException(
+                status_code=status.HTTP_404_NOT_FOUND,
+                detail="Agent not found",
+            )
+
+        return agent
+
+    def agent_update_record(self, filter: Dict, update: Dict):
+        """Updates a agent record"""
+        self.agent_verify_record(filter)
+        self._check_update(update, ["_id", "user_id"])
+        update["date_modified"] = _now()
+
+        self._update_one("agents", filter, {"$set": update})
+
+    def agent_advanced_update_record(self, filter: Dict, update: Dict):
+        """Updates a agent record with more complex parameters"""
+        self.agent_verify_record(filter)
+
+        self._update_one("agents", filter, self._set_modified(update))
+
+    def agent_delete_record(self, filter: Dict):
+        """Deletes a agent record with its files"""
+        agent = self.agent_verify_record(filter)
+
+        self._delete_one("agents", filter)
+
+        for file in self.file_get_all_records({"agent_id": agent.id}):
+            self.file_delete_record({"_id": file.id})
+
+    # files
+    def _to_file(self, file: Dict) -> s_file.File:
+        file = s_file.File(**file)
+        if file.restrict_access:
+            file.download_link = f"/api/v1/files/{file.id}/download"
+        else:
+            file.download_link = (
+                f"/api/v1/files/{file.id}/unrestricted/download"
+            )
+
+        return file
+
+    def file_create_record(
+        self, data: bytes, file_data: s_file.FileMetadata
+    ) -> str:
+        """Creates a file record"""
+        gridfs_id = self.file_put_data(data, file_data)
+
+        return self.file_create_records([(gridfs_id, file_data)])[0]
+
+    def file_put_data(
+        self, data: Union[bytes, BinaryIO], file_data: s_file.FileMetadata
+    ) -> str:
+        """Stores the data of a file without creating its record"""
+        if not isinstance(data, bytes):
+            data = data.read()
+
+        gridfs_id = str(ObjectId())
+        self.blobs[gridfs_id] = bytes(data)
+
+        return gridfs_id
+
+    def file_open_data(self, gridfs_id: str, bucket: str) -> MemoryFileData:
+        """Opens the data of a file for reading"""
+        if gridfs_id not in self.blobs:
+            raise FileNotFoundError(f"No file data with id {gridfs_id}")
+
+        return MemoryFileData(self.blobs[gridfs_id])
+
+    def file_get_data_sizes(self, files: List[s_file.File]) -> Dict[str, int]:
+        """Gets the data size of each file by gridfs_id"""
+        sizes = {}
+        for file in files:
+            if file.gridfs_id not in self.blobs:
+                raise FileNotFoundError(
+                    f"No file data with id {file.gridfs_id}"
+                )
+            sizes[file.gridfs_id] = len(self.blobs[file.gridfs_id])
+
+        return sizes
+
+    def file_delete_data(self, gridfs_id: str, bucket: str):
+        """Deletes the data of a file without its record"""
+        self.blobs.pop(gridfs_id, None)
+
+    def file_data_path(self, gridfs_id: str, bucket: str) -> Optional[str]:
+        """File data is never on the filesystem"""
+        return None
+
+    def file_create_records(
+        self, files_data: List[Tuple[str, s_file.FileMetadata]]
+    ) -> List[str]:
+        """
+        Creates multiple file records from pairs of data id and file
+        metadata
+        """
+        ids = []
+        for gridfs_id, file_data in files_data:
+            date = _now()
+            file = file_data.model_dump()
+            file["gridfs_id"] = gridfs_id
+            file["bucket"] = get_bucket(file_data.category)
+            file["date_created"] = date
+            file["date_modified"] = date
+            ids.append(self._insert("files", file))
+
+        return ids
+
+    def file_replace_record(
+        self,
+        data: Union[bytes, BinaryIO],
+        file_data: s_file.FileMetadata,
+    ) -> Tuple[str, Optional[s_file.File]]:
+        """
+        Stores the data of a file and points the record of its agent and
+        category at it, returning the record id and the replaced record
+        """
+        gridfs_id = self.file_put_data(data, file_data)
+
+        return self.file_point_record(gridfs_id, file_data)
+
+    def file_point_record(
+        self, gridfs_id: str, file_data: s_file.FileMetadata
+    ) -> Tuple[str, Optional[s_file.File]]:
+        """
+        Points the record of an agent and category at stored data,
+        returning the record id and the replaced record
+        """
+        update = file_data.model_dump(exclude={"agent_id", "category"})
+        update["gridfs_id"] = gridfs_id
+        update["bucket"] = get_bucket(file_data.category)
+        update["date_modified"] = _now()
+
+        filter = {
+            "agent_id": file_data.agent_id,
+            "category": file_data.category,
+        }
+        with self._lock:
+            replaced = self._find_one("files", filter)
+            if replaced is None:
+                return (
+                    self.file_create_records([(gridfs_id, file_data)])[0],
+                    None,
+                )
+            self._update_one(
+                "files",
+                {"_id": replaced["_id"]},
+                {"$set": update, "$unset": {"manifest": ""}},
+            )
+        # pointing a record at the data it has replaces nothing
+        if replaced["gridfs_id"] == gridfs_id:
+            return str(replaced["_id"]), None
+
+        return str(replaced["_id"]), s_file.File(**replaced)
+
+    def file_get_record(self, filter: Dict) -> Optional[s_file.File]:
+        """Gets a file record using the supplied filter"""
+        file = self._find_one("files", filter)
+
+        return self._to_file(file) if file else None
+
+    def file_get_all_records(self, filter: Dict) -> List[s_file.File]:
+        """Gets all file records using the supplied filter"""
+        return [self._to_file(file) for file in self._find("files", filter)]
+
+    def file_get_records_by_ids(
+        self, ids: List[str]
+    ) -> Dict[str, s_file.File]:
+        """Gets the file records with the supplied ids keyed by id"""
+        files = self._get_collection("files")
+        output = {}
+        for id in set(ids):
+            file = files.get(ObjectId(id)) if id else None
+            if file:
+                output[id] = self._to_file(file)
+
+        return output
+
+    def file_get_records_by_agent_ids(
+        self, agent_ids: List[str]
+    ) -> Dict[str, List[s_file.File]]:
+        """Gets the file records of the supplied agents grouped by agent"""
+        if not agent_ids:
+            return {}
+
+        files_by_agent = {}
+        for file in self.file_get_all_records(
+            {"agent_id": {"$in": list(set(agent_ids))}}
+        ):
+            files_by_agent.setdefault(file.agent_id, []).append(file)
+
+        return files_by_agent
+
+    def file_verify_record(self, filter: Dict) -> s_file.File:
+        """
+        Gets a file record using the filter
+        and raises an error if a matching record is not found
+        """
+        file = self.file_get_record(filter)
+
+        if file is None:
+            raise HTTPException(
+                status_code=status.HTTP_404_NOT_FOUND,
+                detail="File not found",
+            )
+
+        return file
+
+    def file_get_data(self, file_id: str) -> bytes:
+        """Gets the data of a file"""
+        file = self.file_verify_record({"_id": file_id})
+
+        return self.file_open_data(file.gridfs_id, file.bucket).read()
+
+    def file_set_manifest(
+        self, file_id: str, gridfs_id: str, manifest: s_file.Manifest
+    ) -> bool:
+        """
+        Attaches a package manifest to a file record, unless the record
+        was pointed at other data since the manifest was read
+        """
+        filter = {"_id": ObjectId(file_id), "gridfs_id": gridfs_id}
+        with self._lock:
+            if self._find_one("files", filter) is None:
+                return False
+            self._update_one(
+                "files", filter, {"$set": {"manifest": manifest.model_dump()}}
+            )
+
+        return True
+
+    def file_get_manifest(self, file_id: str) -> Optional[s_file.Manifest]:
+        """
+        Gets the package manifest of a file, or None when it has not
+        been indexed
+        """
+        file = self._find_one("files", {"_id": file_id})
+        if file is None:
+            raise HTTPException(
+                status_code=status.HTTP_404_NOT_FOUND,
+                detail="File not found",
+            )
+
+        manifest = file.get("manifest")
+        return s_file.Manifest(**manifest) if manifest else None
+
+    def file_update_record(self, filter: Dict, update: Dict):
+        """Updates a file record"""
+        self.file_verify_record(filter)
+        self._check_update(
+            update, ["_id", "user_id", "project_id", "gridfs_id"]
+        )
+        update["date_modified"] = _now()
+
+        self._update_one("files", filter, {"$set": update})
+
+    def file_advanced_update_record(self, filter: Dict, update: Dict):
+        """Updates a file record with more complex parameters"""
+        self.file_verify_record(filter)
+
+        self._update_one("files", filter, self._set_modified(update))
+
+    def file_delete_record(self, filter: Dict):
+        """Deletes a file record with its data"""
+        file = self.file_verify_record(filter)
+
+        self._delete_one("files", filter)
+        self.file_delete_data(file.gridfs_id, file.bucket)
+
+        if is_versioned(file.category):
+            for version in self.file_version_get_all_records(file.id):
+                self._delete_one("file_versions", {"_id": version.id})
+                self.file_delete_data(version.gridfs_id, version.bucket)
+
+    # file versions
+    def file_version_create_record(self, file: s_file.File) -> str:
+        """Keeps the data of a replaced file record as a version of it"""
+        return self._insert(
+            "file_versions",
+            {
+                "file_id": file.id,
+                "gridfs_id": file.gridfs_id,
+                "bucket": file.bucket,
+                "filename": file.filename,
+                "date_created": file.date_modified,
+            },
+        )
+
+    def file_version_get_all_records(
+        self, file_id: str
+    ) -> List[s_file.FileVersion]:
+        """Gets the versions of a file record, newest first"""
+        versions = self._find("file_versions", {"file_id": file_id})
+        versions.sort(key=lambda version: version["date_created"])
+
+        return [s_file.FileVersion(**version) for version in versions[::-1]]
+
+    def file_version_verify_record(self, filter: Dict) -> s_file.FileVersion:
+        """
+        Gets a file version using the filter
+        and raises an error if a matching record is not found
+        """
+        version = self._find_one("file_versions", filter)
+        if version is None:
+            raise HTTPException(
+                status_code=status.HTTP_404_NOT_FOUND,
+                detail="File version not found",
+            )
+
+        return s_file.FileVersion(**version)
+
+    def file_version_prune_records(
+        self, file_id: str, keep: int
+    ) -> List[s_file.FileVersion]:
+        """
+        Deletes the versions of a file record past the newest keep and
+        returns the deleted ones. A version restored since it was read
+        points at other data and is left for the next prune
+        """
+        pruned = []
+        for version in self.file_version_get_all_records(file_id)[keep:]:
+            deleted = self._delete_one(
+                "file_versions",
+                {"_id": version.id, "gridfs_id": version.gridfs_id},
+            )
+            if deleted is not None:
+                pruned.append(s_file.FileVersion(**deleted))
+
+        return pruned
+
+    def file_version_restore_record(
+        self, file_id: str, version_id: str
+    ) -> s_file.File:
+        """
+        Points a file record back at the data of one of its versions,
+        which then keeps the data the record pointed at
+        """
+        with self._lock:
+            version = self.file_version_verify_record(
+                {"_id": version_id, "file_id": file_id}
+            )
+            file = self.file_verify_record({"_id": file_id})
+            self._update_one(
+                "file_versions",
+                {"_id": version.id},
+                {
+                    "$set": {
+                        "gridfs_id": file.gridfs_id,
+                        "bucket": file.bucket,
+                        "filename": file.filename,
+                        "date_created": file.date_modified,
+                    }
+                },
+            )
+            self._update_one(
+                "files",
+                {"_id": file_id},
+                {
+                    "$set": {
+                        "gridfs_id": version.gridfs_id,
+                        "bucket": version.bucket,
+                        "filename": version.filename,
+                        "date_modified": _now(),
+                    },
+                    "$unset": {"manifest": ""},
+                },
+            )
+
+        return self.file_verify_record({"_id": file_id})
+
+    # consultants
+    def consultant_create_record(
+        self, consultant_data: s_consultant.ConsultantBase
+    ) -> str:
+        """Creates a consultant record"""
+        return self._create("consultants", consultant_data)
+
+    def consultant_get_record(
+        self, filter: Dict
+    ) -> Optional[s_consultant.Consultant]:
+        """Gets a consultant record using the supplied filter"""
+        consultant = self._find_one("consultants", filter)
+
+        return s_consultant.Consultant(**consultant) if consultant else None
+
+    def consultant_get_all_records(
+        self,
+        filter: Dict,
+        limit: int = 0,
+        fields: Optional[FrozenSet[str]] = None,
+    ) -> List[s_consultant.Consultant]:
+        """
+        Gets all consultant records using the supplied filter, narrowed
+        to fields if they are supplied
+        """
+        model = self._get_model(s_consultant.Consultant, fields)
+
+        return [
+            model(**consultant)
+            for consultant in self._find("consultants", filter, limit)
+        ]
+
+    def consultant_iter_batches(
+        self,
+        filter: Dict,
+        batch_size: int = 500,
+        fields: Optional[FrozenSet[str]] = None,
+    ) -> Iterator[List[s_consultant.Consultant]]:
+        """Iterates over the matching consultant records in _id order"""
+        return self._iter_batches(
+            "consultants",
+            self._get_model(s_consultant.Consultant, fields),
+            filter,
+            batch_size,
+        )
+
+    def consultant_get_page(
+        self,
+        filter: Dict,
+        limit: int = 0,
+        cursor: Optional[str] = None,
+        fields: Optional[FrozenSet[str]] = None,
+    ) -> Page[s_consultant.Consultant]:
+        """Gets a page of consultants"""
+        return self._get_page(
+            self.consultant_get_all_records,
+            self.consultant_get_record,
+            filter,
+            limit,
+            cursor,
+            fields=fields,
+        )
+
+    def consultant_verify_record(
+        self, filter: Dict
+    ) -> s_consultant.Consultant:
+        """
+        Gets a consultant record using the filter
+        and raises an error if a matching record is not found
+        """
+        consultant = self.consultant_get_record(filter)
+
+        if consultant is None:
+            raise HTTPException(
+                status_code=status.HTTP_404_NOT_FOUND,
+                detail="Consultant not found",
+            )
+
+        return consultant
+
+    def consultant_update_record(self, filter: Dict, update: Dict):
+        """Updates a consultant record"""
+        self.consultant_verify_record(filter)
+        self._check_update(update, ["_id", "user_id"])
+        update["date_modified"] = _now()
+
+        self._update_one("consultants", filter, {"$set": update})
+
+    def consultant_advanced_update_record(self, filter: Dict, update: Dict):
+        """Updates a consultant record with more complex parameters"""
+        self.consultant_verify_record(filter)
+
+        self._update_one("consultants", filter, self._set_modified(update))
+
+    def consultant_delete_record(self, filter: Dict):
+        """Deletes a consultant record with its files"""
+        consultant = self.consultant_verify_record(filter)
+
+        self._delete_one("consultants", filter)
+
+        for id in [consultant.resume_file_id, consultant.profile_picture_id]:
+            self.file_delete_record({"_id": id})
+
+    # reviews
+    def _update_review_target(self, review: s_review.ReviewBase, inc: int):
+        update = {"$inc": {f"review_metrics.{review.reaction.value}": inc}}
+        if review.target_type == s_review.TargetType.AGENT:
+            self.agent_advanced_update_record(
+                filter={"_id": review.target_id}, update=update
+            )
+        elif review.target_type == s_review.TargetType.CONSULTANT:
+            self.consultant_advanced_update_record(
+                filter={"_id": review.target_id}, update=update
+            )
+
+    def review_create_record(self, review_data: s_review.ReviewBase) -> str:
+        """Creates a review record and counts it on its target"""
+        id = self._create("reviews", review_data)
+        self._update_review_target(review_data, 1)
+
+        return id
+
+    def review_get_record(self, filter: Dict) -> Optional[s_review.Review]:
+        """Gets a review record using the supplied filter"""
+        review = self._find_one("reviews", filter)
+
+        return s_review.Review(**review) if review else None
+
+    def review_get_all_records(
+        self, filter: Dict, limit: int = 0
+    ) -> List[s_review.Review]:
+        """Gets all review records using the supplied filter"""
+        return [
+            s_review.Review(**review)
+            for review in self._find("reviews", filter, limit)
+        ]
+
+    def review_get_page(
+        self, filter: Dict, limit: int = 0, cursor: Optional[str] = None
+    ) -> Page[s_review.Review]:
+        """Gets a page of reviews"""
+        return self._get_page(
+            self.review_get_all_records,
+            self.review_get_record,
+            filter,
+            limit,
+            cursor,
+        )
+
+    def review_verify_record(self, filter: Dict) -> s_review.Review:
+        """
+        Gets a review record using the filter
+        and raises an error if a matching record is not found
+        """
+        review = self.review_get_record(filter)
+
+        if review is None:
+            raise HTTPException(
+                status_code=status.HTTP_404_NOT_FOUND,
+                detail="Review not found",
+            )
+
+        return review
+
+    def review_update_record(self, filter: Dict, update: Dict):
+        """Updates a review record"""
+        self.review_verify_record(filter)
+        self._check_update(update, ["_id", "user_id"])
+        update["date_modified"] = _now()
+
+        self._update_one("reviews", filter, {"$set": update})
+
+    def review_advanced_update_record(self, filter: Dict, update: Dict):
+        """Updates a review record with more complex parameters"""
+        self.review_verify_record(filter)
+
+        self._update_one("reviews", filter, self._set_modified(update))
+
+    def review_delete_record(self, filter: Dict):
+        """Deletes a review record and removes it from its target"""
+        review = self.review_verify_record(filter)
+
+        self._delete_one("reviews", filter)
+        self._update_review_target(review, -1)
+
+    # uploads
+    def upload_create_record(self, upload_data: s_upload.UploadIn) -> str:
+        """Creates a resumable upload record"""
+        upload = upload_data.model_dump()
+        upload["store"] = "memory"
+        upload["bucket"] = get_bucket(upload_data.category)
+        upload["key"] = str(ObjectId())
+        upload["offset"] = 0
+        upload["expires_at"] = _now() + timedelta(
+            seconds=settings.UPLOAD_TTL_SECONDS
+        )
+        upload["date_created"] = upload["date_modified"] = _now()
+
+        return self._insert("uploads", upload)
+
+    def upload_get_record(self, filter: Dict) -> Optional[s_upload.Upload]:
+        """Gets an upload record that has not expired"""
+        upload = self._find_one(
+            "uploads", {**filter, "expires_at": {"$gt": _now()}}
+        )
+
+        return s_upload.Upload(**upload) if upload else None
+
+    def upload_verify_record(self, filter: Dict) -> s_upload.Upload:
+        """
+        Gets an upload record using the filter
+        and raises an error if a matching record is not found
+        """
+        upload = self.upload_get_record(filter)
+
+        if upload is None:
+            raise HTTPException(
+                status_code=status.HTTP_404_NOT_FOUND,
+                detail="Upload not found",
+            )
+
+        return upload
+
+    def upload_append_data(
+        self, upload: s_upload.Upload, offset: int, data: bytes
+    ) -> int:
+        """Appends data at offset of an upload and returns the new offset"""
+        end = offset + len(data)
+        if end > upload.length:
+            raise HTTPException(
+                status_code=status.HTTP_400_BAD_REQUEST,
+                detail="Data past the upload length",
+            )
+
+        with self._lock:
+            record = self._find_one("uploads", {"_id": upload.id})
+            if record is None or record["offset"] != offset:
+                raise HTTPException(
+                    status_code=status.HTTP_409_CONFLICT,
+                    detail="Upload offset changed",
+                )
+
+            buffer = self.upload_data.setdefault(upload.key, bytearray())
+            buffer[offset:] = data
+            self._update_one(
+                "uploads",
+                {"_id": upload.id},
+                {
+                    "$set": {
+                        "offset": end,
+                        "expires_at": _now()
+                        + timedelta(seconds=settings.UPLOAD_TTL_SECONDS),
+                        "date_modified": _now(),
+                    }
+                },
+            )
+
+        return end
+
+    def upload_complete_record(
+        self, upload: s_upload.Upload
+    ) -> Tuple[str, Optional[s_file.File]]:
+        """
+        Points the file record of the agent and category of a fully
+        received upload at its data and deletes the upload record.
+        The upload record is claimed first, so of two concurrent
+        completes only one stores the data. Returns the record id and
+        the replaced record
+        """
+        with self._lock:
+            if self._delete_one("uploads", {"_id": upload.id}) is None:
+                raise HTTPException(
+                    status_code=status.HTTP_409_CONFLICT,
+                    detail="Upload is already complete",
+                )
+            data = self.upload_data.pop(upload.key, bytearray())
+            self.blobs[upload.key] = bytes(data[: upload.length])
+
+        return self.file_point_record(
+            upload.key,
+            s_file.FileMetadata(
+                filename=upload.filename,
+                agent_id=upload.agent_id,
+                category=upload.category,
+                restrict_access=False,
+            ),
+        )
+
+    def upload_delete_record(self, filter: Dict):
+        """Deletes an upload record with the data received so far"""
+        upload = self.upload_verify_record(filter)
+
+        with self._lock:
+            self._delete_one("uploads", {"_id": upload.id})
+            self.upload_data.pop(upload.key, None)
+
+    def upload_delete_expired_records(self) -> int:
+        """Deletes the expired uploads with their data"""
+        with self._lock:
+            expired = self._find("uploads", {"expires_at": {"$lte": _now()}})
+            for upload in expired:
+                self._delete_one("uploads", {"_id": upload["_id"]})
+                self.upload_data.pop(upload["key"], None)
+
+        return len(expired)
+
+    # diagnostics
+    def slow_query_get_summary(
+        self, limit: int = 20
+    ) -> List[s_slow_query.SlowQuerySummary]:
+        """There are no slow queries without a database"""
+        return []
+
+    def profile_create_record(self, profile_data: s_profile.ProfileBase):
+        """Creates a request profile record"""
+        profile = profile_data.model_dump()
+        profile["date_created"] = _now()
+
+        return self._insert("profiles", profile)
+
+    def profile_get_record(
+        self, request_id: str
+    ) -> Optional[s_profile.ProfileBase]:
+        """Gets the latest profile recorded for a request id"""
+        profiles = self._find("profiles", {"request_id": request_id})
+
+        return s_profile.ProfileBase(**profiles[-1]) if profiles else None
+
+    def profile_get_all_records(
+        self, limit: int = 50
+    ) -> List[s_profile.ProfileSummary]:
+        """Gets the latest profiles without their data"""
+        profiles = self._find("profiles", {})[::-1][:limit]
+
+        return [s_profile.ProfileSummary(**profile) for profile in profiles]
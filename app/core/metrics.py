@@ -0,0 +1,240 @@
+import os
+import time
+from typing import Dict, Tuple
+
+from prometheus_client import (
+    CONTENT_TYPE_LATEST,
+    CollectorRegistry,
+    Counter,
+    Gauge,
+    Histogram,
+    generate_latest,
+    multiprocess,
+)
+from pymongo import monitoring
+
+REQUEST_LATENCY = Histogram(
+    "http_request_duration_seconds",
+    "HTTP request latency by route template",
+    ["method", "route", "status"],
+)
+REQUESTS_IN_FLIGHT = Gauge(
+    "http_requests_in_flight",
+    "HTTP requests currently being served",
+    ["method"],
+    multiprocess_mode="livesum",
+)
+RESPONSE_SIZE = Histogram(
+    "http_response_size_bytes",
+    "HTTP response body size by route template",
+    ["method", "route"],
+    buckets=[2**i for i in range(8, 32, 2)],
+)
+MONGO_COMMAND_LATENCY = Histogram(
+    "mongo_command_duration_seconds",
+    "Mongo command latency by collection and command",
+    ["collection", "command", "outcome"],
+    buckets=[0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1]
+    + [0.25, 0.5, 1, 2.5, 5, 10],
+)
+MONGO_POOL_CHECKOUT = Histogram(
+    "mongo_pool_checkout_wait_seconds",
+    "Time spent waiting to check a connection out of the pool",
+    ["outcome"],
+    buckets=[0.0001, 0.0005, 0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1, 5],
+)
+GRIDFS_BYTES = Counter(
+    "gridfs_bytes_total",
+    "Bytes of GridFS chunk data read and written",
+    ["direction"],
+)
+CACHE_REQUESTS = Counter(
+    "cache_requests_total",
+    "Cache lookups by cache and result",
+    ["cache", "result"],
+)
+LOG_RECORDS_DROPPED = Counter(
+    "log_records_dropped_total",
+    "Log records dropped because the log queue was full",
+    ["level"],
+)
+EVENT_LOOP_LAG = Histogram(
+    "event_loop_lag_seconds",
+    "Delay of the event loop heartbeat past its schedule",
+    buckets=[0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5],
+)
+EVENT_LOOP_BLOCKED = Counter(
+    "event_loop_blocked_total",
+    "Times the event loop was blocked past the watchdog threshold",
+    ["route"],
+)
+
+# commands whose first value is not a collection name
+_NON_COLLECTION_COMMANDS = {"getMore": "collection"}
+
+
+def chunk_bytes(command_name: str, collection: str, document: Dict) -> int:
+    """
+    Gets the GridFS chunk bytes carried by a command, or by its reply
+    if document is a reply
+    """
+    if not collection.endswith(".chunks"):
+        return 0
+
+    if command_name == "insert":
+        chunks = document.get("documents", [])
+    elif command_name in ("find", "getMore"):
+        cursor = document.get("cursor", {})
+        chunks = cursor.get("firstBatch") or cursor.get("nextBatch") or []
+    else:
+        return 0
+
+    return sum(len(chunk.get("data", b"")) for chunk in chunks)
+
+
+def command_collection(event: monitoring.CommandStartedEvent) -> str:
+    """Gets the collection a command runs against"""
+    name = event.command_name
+    collection = event.command.get(_NON_COLLECTION_COMMANDS.get(name, name))
+
+    return collection if isinstance(collection, str) else ""
+
+
+def record_cache(cache: str, hit: bool):
+    """Records a cache lookup"""
+    CACHE_REQUESTS.labels(cache, "hit" if hit else "miss").inc()
+
+
+class MongoCommandListener(monitoring.CommandListener):
+    """Records the latency of every mongo command and GridFS traffic"""
+
+    def __init__(self):
+        self._pending: Dict[Tuple, Tuple[str, str]] = {}
+
+    def started(self, event: monitoring.CommandStartedEvent):
+        name = event.command_name
+        collection = command_collection(event)
+        self._pending[(event.connection_id, event.request_id)] = (
+            collection,
+            name,
+        )
+
+        if name == "insert":
+            size = chunk_bytes(name, collection, event.command)
+            if size:
+                GRIDFS_BYTES.labels("written").inc(size)
+
+    def succeeded(self, event: monitoring.CommandSucceededEvent):
+        collection, name = self._pending.pop(
+            (event.connection_id, event.request_id), ("", event.command_name)
+        )
+        MONGO_COMMAND_LATENCY.labels(collection, name, "success").observe(
+            event.duration_micros / 1e6
+        )
+
+        if name in ("find", "getMore"):
+            size = chunk_bytes(name, collection, event.reply)
+            if size:
+                GRIDFS_BYTES.labels("read").inc(size)
+
+    def failed(self, event: monitoring.CommandFailedEvent):
+        collection, name = self._pending.pop(
+            (event.connection_id, event.request_id), ("", event.command_name)
+        )
+        MONGO_COMMAND_LATENCY.labels(collection, name, "failure").observe(
+            event.duration_micros / 1e6
+        )
+
+
+class MongoPoolListener(monitoring.ConnectionPoolListener):
+    """Records how long requests wait for a pooled connection"""
+
+    def connection_checked_out(self, event):
+        MONGO_POOL_CHECKOUT.labels("success").observe(event.duration)
+
+    def connection_check_out_failed(self, event):
+        MONGO_POOL_CHECKOUT.labels("failure").observe(event.duration)
+
+    def pool_created(self, event):
+        pass
+
+    def pool_ready(self, event):
+        pass
+
+    def pool_cleared(self, event):
+        pass
+
+    def pool_closed(self, event):
+        pass
+
+    def connection_created(self, event):
+        pass
+
+    def connection_ready(self, event):
+        pass
+
+    def connection_closed(self, event):
+        pass
+
+    def connection_check_out_started(self, event):
+        pass
+
+    def connection_checked_in(self, event):
+        pass
+
+
+class MetricsMiddleware:
+    """
+    ASGI middleware recording request latency, in flight requests and
+    response sizes labelled by the matched route template
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        method = scope["method"]
+        status_code = 500
+        size = 0
+
+        async def send_wrapper(message):
+            nonlocal status_code, size
+            if message["type"] == "http.response.start":
+                status_code = message["status"]
+            elif message["type"] == "http.response.body":
+                size += len(message.get("body", b""))
+            await send(message)
+
+        in_flight = REQUESTS_IN_FLIGHT.labels(method)
+        in_flight.inc()
+        start = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            duration = time.perf_counter() - start
+            in_flight.dec()
+
+            route = scope.get("route")
+            route = getattr(route, "path", "unmatched")
+            REQUEST_LATENCY.labels(method, route, status_code).observe(
+                duration
+            )
+            RESPONSE_SIZE.labels(method, route).observe(size)
+
+
+def render_metrics() -> Tuple[bytes, str]:
+    """
+    Renders the metrics in the prometheus text format.
+    When PROMETHEUS_MULTIPROC_DIR is set the metrics of all worker
+    processes are aggregated
+    """
+    if "PROMETHEUS_MULTIPROC_DIR" in os.environ:
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+        return generate_latest(registry), CONTENT_TYPE_LATEST
+
+    return generate_latest(), CONTENT_TYPE_LATEST
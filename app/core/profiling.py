@@ -0,0 +1,220 @@
+import json
+import sys
+import threading
+import time
+import uuid
+from logging import getLogger
+from types import FrameType
+from typing import Dict, List, Optional, Tuple
+
+from core.config import settings
+from core.security import is_admin_token
+from core.storage import resolve_storage
+from schemas.profile import ProfileBase
+from starlette.concurrency import run_in_threadpool
+
+SPEEDSCOPE_SCHEMA = "https://www.speedscope.app/file-format-schema.json"
+
+
+class SamplingProfiler:
+    """
+    Samples the stacks of a single request from a background thread.
+
+    Samples of the event loop thread are kept only while the request's
+    own coroutine is running, identified by the frame of the middleware
+    serving it. Samples of busy threadpool threads, where sync routes
+    and dependencies run, are kept as separate profiles; under
+    concurrent load they may include work of other requests.
+    """
+
+    def __init__(
+        self, root_frame: FrameType, interval_ms: float, max_samples: int
+    ):
+        self.root_frame = root_frame
+        self.interval = interval_ms / 1000
+        self.max_samples = max_samples
+        self.sample_count = 0
+        self.duration = 0.0
+        self._loop_thread_id = threading.get_ident()
+        self._frames: Dict[Tuple[str, str, int], int] = {}
+        self._samples: Dict[int, List[List[int]]] = {}
+        self._weights: Dict[int, List[float]] = {}
+        self._stop = threading.Event()
+        self._thread = threading.Thread(
+            target=self._run, name="request-profiler", daemon=True
+        )
+
+    def start(self):
+        self._start = time.perf_counter()
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+        self.duration = time.perf_counter() - self._start
+
+    def _run(self):
+        own_id = threading.get_ident()
+        last = time.perf_counter()
+        while not self._stop.wait(self.interval):
+            now = time.perf_counter()
+            weight, last = (now - last) * 1000, now
+
+            for thread_id, frame in sys._current_frames().items():
+                if thread_id == own_id:
+                    continue
+                stack = self._get_stack(thread_id, frame)
+                if not stack:
+                    continue
+                self._samples.setdefault(thread_id, []).append(stack)
+                self._weights.setdefault(thread_id, []).append(weight)
+                self.sample_count += 1
+
+            if self.sample_count >= self.max_samples:
+                break
+
+    def _get_stack(self, thread_id: int, frame: FrameType) -> List[int]:
+        """
+        Gets a stack as frame indexes from root to leaf, or nothing if
+        the thread is not working on the request
+        """
+        on_loop = thread_id == self._loop_thread_id
+        in_request = False
+        in_worker = False
+        stack = []
+        while frame is not None:
+            code = frame.f_code
+            if on_loop and frame is self.root_frame:
+                in_request = True
+                break
+            if code.co_name == "get" and code.co_filename.endswith("queue.py"):
+                # idle threadpool worker waiting for work
+                return []
+            if code.co_qualname == "WorkerThread.run":
+                in_worker = True
+            key = (code.co_name, code.co_filename, code.co_firstlineno)
+            stack.append(self._frames.setdefault(key, len(self._frames)))
+            frame = frame.f_back
+
+        if not (in_request if on_loop else in_worker):
+            return []
+
+        return stack[::-1]
+
+    def to_speedscope(self, name: str) -> Dict:
+        """Formats the samples as a speedscope profile"""
+        thread_names = {t.ident: t.name for t in threading.enumerate()}
+        profiles = []
+        for thread_id, samples in self._samples.items():
+            weights = self._weights[thread_id]
+            profiles.append(
+                {
+                    "type": "sampled",
+                    "name": (
+                        "event loop"
+                        if thread_id == self._loop_thread_id
+                        else thread_names.get(thread_id, str(thread_id))
+                    ),
+                    "unit": "milliseconds",
+                    "startValue": 0,
+                    "endValue": sum(weights),
+                    "samples": samples,
+                    "weights": weights,
+                }
+            )
+
+        return {
+            "$schema": SPEEDSCOPE_SCHEMA,
+            "name": name,
+            "exporter": settings.APP_TITLE,
+            "shared": {
+                "frames": [
+                    {"name": name, "file": file, "line": line}
+                    for name, file, line in self._frames
+                ]
+            },
+            "profiles": profiles,
+        }
+
+
+def _get_header(scope, name: bytes) -> Optional[str]:
+    for key, value in scope["headers"]:
+        if key == name:
+            return value.decode("latin-1")
+
+    return None
+
+
+class ProfilingMiddleware:
+    """
+    ASGI middleware that profiles a request when it carries an
+    X-Profile: 1 header and a valid X-Admin-Token. The profile is stored
+    in speedscope format under the request id, which is returned in the
+    X-Profile-Id header. Other requests only pay for a header lookup.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if (
+            scope["type"] != "http"
+            or _get_header(scope, b"x-profile") != "1"
+            or not is_admin_token(_get_header(scope, b"x-admin-token"))
+        ):
+            await self.app(scope, receive, send)
+            return
+
+        request_id = _get_header(scope, b"x-request-id") or uuid.uuid4().hex
+        status_code = None
+
+        async def send_wrapper(message):
+            nonlocal status_code
+            if message["type"] == "http.response.start":
+                status_code = message["status"]
+                headers = list(message.get("headers", []))
+                headers.append((b"x-profile-id", request_id.encode()))
+                message["headers"] = headers
+            await send(message)
+
+        profiler = SamplingProfiler(
+            root_frame=sys._getframe(),
+            interval_ms=settings.PROFILE_SAMPLE_INTERVAL_MS,
+            max_samples=settings.PROFILE_MAX_SAMPLES,
+        )
+        profiler.start()
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            profiler.stop()
+            await self._save(scope, request_id, status_code, profiler)
+
+    async def _save(
+        self,
+        scope,
+        request_id: str,
+        status_code: Optional[int],
+        profiler: SamplingProfiler,
+    ):
+        logger = getLogger(__name__ + ".save")
+        route = getattr(scope.get("route"), "path", "unmatched")
+        try:
+            profile = ProfileBase(
+                request_id=request_id,
+                method=scope["method"],
+                path=scope["path"],
+                route=route,
+                status_code=status_code,
+                duration_ms=profiler.duration * 1000,
+                sample_count=profiler.sample_count,
+                data=json.dumps(
+                    profiler.to_speedscope(
+                        f"{scope['method']} {scope['path']}"
+                    )
+                ),
+            )
+            # the storage the admin routes read profiles from
+            storage = resolve_storage(scope.get("app"))
+            await run_in_threadpool(storage.profile_create_record, profile)
+        except Exception as ex:
+            logger.error(f"Failed to save profile {request_id}: {ex}")
@@ -0,0 +1,27 @@
+import time
+from typing import Any
+
+from core.timing import request_stats
+from fastapi.responses import JSONResponse
+from pydantic_core import to_json
+
+
+class ModelJSONResponse(JSONResponse):
+    """
+    JSON response that serializes pydantic models directly to bytes
+    with pydantic's serializer.
+
+    Returning it from a route skips FastAPI's response_model validation
+    and jsonable_encoder pass, so content must already be built from
+    validated models.
+    """
+
+    def render(self, content: Any) -> bytes:
+        start = time.perf_counter()
+        body = to_json(content)
+
+        stats = request_stats.get()
+        if stats is not None:
+            stats.serialization_time += time.perf_counter() - start
+
+        return body
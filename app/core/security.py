@@ -0,0 +1,27 @@
+import secrets
+from typing import Annotated, Optional
+
+from core.config import settings
+from fastapi import Header, HTTPException, status
+
+
+def is_admin_token(token: Optional[str]) -> bool:
+    """
+    Checks a token against the configured admin token.
+    Always fails when no admin token is configured
+    """
+    if not settings.ADMIN_TOKEN or not token:
+        return False
+
+    return secrets.compare_digest(token, settings.ADMIN_TOKEN)
+
+
+def verify_admin_token(
+    x_admin_token: Annotated[Optional[str], Header()] = None,
+):
+    """Dependency that restricts a route to holders of the admin token"""
+    if not is_admin_token(x_admin_token):
+        raise HTTPException(
+            status_code=status.HTTP_403_FORBIDDEN,
+            detail="Not authorized",
+        )
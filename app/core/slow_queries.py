@@ -0,0 +1,176 @@
+import hashlib
+import json
+from concurrent.futures import ThreadPoolExecutor
+from logging import getLogger
+from threading import Lock
+from typing import Any, Callable, Dict, Optional, Tuple
+
+from core.metrics import command_collection
+from pymongo import monitoring
+from schemas.slow_query import SlowQueryBase
+
+# commands that can be explained, mapped to the part of the command
+# that holds the query
+EXPLAINABLE_COMMANDS = {
+    "find": "filter",
+    "aggregate": "pipeline",
+    "count": "query",
+    "distinct": "query",
+    "findAndModify": "query",
+    "update": "updates",
+    "delete": "deletes",
+}
+
+# command fields that are not allowed inside an explain
+_NON_EXPLAIN_FIELDS = {
+    "lsid",
+    "txnNumber",
+    "autocommit",
+    "startTransaction",
+    "writeConcern",
+    "readConcern",
+}
+
+
+def redact(value: Any) -> Any:
+    """
+    Replaces the literals of a query with "?" keeping its field names
+    and operators, so queries with the same shape redact the same way
+    """
+    if isinstance(value, dict):
+        return {key: redact(item) for key, item in value.items()}
+    if isinstance(value, (list, tuple)):
+        if all(not isinstance(item, (dict, list, tuple)) for item in value):
+            return ["?"]
+        return [redact(item) for item in value]
+
+    return "?"
+
+
+def get_shape(command_name: str, command: Dict) -> str:
+    """Gets the redacted query of a command as JSON"""
+    query = command.get(EXPLAINABLE_COMMANDS[command_name], {})
+    if command_name in ("update", "delete"):
+        query = [statement.get("q", {}) for statement in query]
+    shape = {"query": redact(query)}
+    if command.get("sort"):
+        shape["sort"] = redact(command["sort"])
+
+    return json.dumps(shape, sort_keys=True, default=str)
+
+
+def get_fingerprint(collection: str, command_name: str, shape: str) -> str:
+    """Gets a stable id for a query shape"""
+    key = f"{collection}:{command_name}:{shape}".encode()
+
+    return hashlib.sha1(key).hexdigest()[:16]
+
+
+def summarize_explain(explain: Dict) -> Dict:
+    """Keeps the parts of an explain output useful for diagnosis"""
+    stats = explain.get("executionStats", {})
+    planner = explain.get("queryPlanner", {})
+
+    return {
+        "n_returned": stats.get("nReturned"),
+        "total_docs_examined": stats.get("totalDocsExamined"),
+        "total_keys_examined": stats.get("totalKeysExamined"),
+        "execution_time_ms": stats.get("executionTimeMillis"),
+        "winning_plan": json.dumps(
+            planner.get("winningPlan", {}), default=str
+        ),
+    }
+
+
+class SlowQueryListener(monitoring.CommandListener):
+    """
+    Captures queries slower than a threshold and hands them to a
+    recorder on a background thread, which fetches their explain
+    output and stores them.
+
+    Commands against ignored collections (the slow query log itself)
+    and explain commands are never captured.
+    """
+
+    def __init__(
+        self,
+        threshold_ms: float,
+        ignored_collections: Tuple[str, ...] = (),
+        max_pending: int = 100,
+    ):
+        self.threshold_ms = threshold_ms
+        self.ignored_collections = ignored_collections
+        self.max_pending = max_pending
+        self.recorder: Optional[Callable[[SlowQueryBase, Dict], None]] = None
+        self._commands: Dict[Tuple, Tuple[str, Dict]] = {}
+        self._executor = ThreadPoolExecutor(
+            max_workers=1, thread_name_prefix="slow-query"
+        )
+        self._pending = 0
+        self._lock = Lock()
+
+    def started(self, event: monitoring.CommandStartedEvent):
+        if event.command_name not in EXPLAINABLE_COMMANDS:
+            return
+
+        collection = command_collection(event)
+        if collection in self.ignored_collections:
+            return
+
+        self._commands[(event.connection_id, event.request_id)] = (
+            collection,
+            event.command,
+        )
+
+    def succeeded(self, event: monitoring.CommandSucceededEvent):
+        self._finish(event)
+
+    def failed(self, event: monitoring.CommandFailedEvent):
+        self._finish(event)
+
+    def _finish(self, event):
+        started = self._commands.pop(
+            (event.connection_id, event.request_id), None
+        )
+        duration_ms = event.duration_micros / 1000
+        if (
+            started is None
+            or duration_ms < self.threshold_ms
+            or self.recorder is None
+        ):
+            return
+
+        with self._lock:
+            if self._pending >= self.max_pending:
+                return
+            self._pending += 1
+
+        collection, command = started
+        shape = get_shape(event.command_name, command)
+        query = SlowQueryBase(
+            fingerprint=get_fingerprint(collection, event.command_name, shape),
+            collection=collection,
+            command=event.command_name,
+            shape=shape,
+            duration_ms=duration_ms,
+        )
+        explain_command = {
+            key: value
+            for key, value in command.items()
+            if not key.startswith("$") and key not in _NON_EXPLAIN_FIELDS
+        }
+        self._executor.submit(self._record, query, explain_command)
+
+    def _record(self, query: SlowQueryBase, explain_command: Dict):
+        logger = getLogger(__name__ + ".record")
+        try:
+            self.recorder(query, explain_command)
+            logger.warning(
+                f"Slow {query.command} on {query.collection} "
+                f"({query.duration_ms:.1f}ms): {query.shape}"
+            )
+        except Exception as ex:
+            logger.exception(ex)
+        finally:
+            with self._lock:
+                self._pending -= 1
@@ -1,17 +1,352 @@
-from datetime import UTC, datetime
-from typing import Dict, List, Optional
+import threading
+from contextvars import ContextVar
+from datetime import UTC, datetime, timedelta
+from logging import getLogger
+from typing import (
+    Annotated,
+    BinaryIO,
+    Dict,
+    FrozenSet,
+    Iterator,
+    List,
+    Optional,
+    Protocol,
+    Set,
+    Tuple,
+    Type,
+    Union,
+)
 
 import gridfs
 import schemas.file as s_file
 from bson.objectid import ObjectId
+from core.blobs import (
+    AppendableBlobStore,
+    BlobStore,
+    create_blob_store,
+    get_data_size,
+    join_blob_id,
+    place_blob,
+    place_upload,
+    split_blob_id,
+)
 from core.config import settings
-from fastapi import HTTPException, status
-from pymongo import MongoClient
+from core.metrics import MongoCommandListener, MongoPoolListener
+from core.slow_queries import SlowQueryListener, summarize_explain
+from core.timing import RequestTimingListener
+from fastapi import Depends, HTTPException, status
+from pydantic import BaseModel
+from pymongo import (
+    ASCENDING,
+    DESCENDING,
+    IndexModel,
+    MongoClient,
+    ReturnDocument,
+)
+from pymongo.collection import Collection
+from pymongo.database import Database
+from pymongo.errors import CollectionInvalid
+from pymongo.read_preferences import SecondaryPreferred
 from schemas import agent as s_agent
 from schemas import consultant as s_consultant
+from schemas import profile as s_profile
 from schemas import review as s_review
+from schemas import slow_query as s_slow_query
+from schemas import upload as s_upload
+from schemas.fieldset import narrow_model
 from schemas.page import Page
 
+# indexes backing the filters the API runs, reconciled on startup
+INDEXES: Dict[str, List[IndexModel]] = {
+    "agents": [IndexModel([("date_modified", ASCENDING)])],
+    "consultants": [IndexModel([("date_modified", ASCENDING)])],
+    "files": [IndexModel([("agent_id", ASCENDING), ("category", ASCENDING)])],
+    "uploads": [IndexModel([("expires_at", ASCENDING)])],
+    "file_versions": [
+        IndexModel([("file_id", ASCENDING), ("date_created", DESCENDING)])
+    ],
+}
+
+
+# manifests are only read with file_get_manifest
+FILE_PROJECTION = {"manifest": 0}
+
+
+def is_versioned(category: Optional[str]) -> bool:
+    """Checks if replaced files of a category are kept as versions"""
+    return (
+        category is not None and category in settings.FILE_VERSION_CATEGORIES
+    )
+
+
+def get_bucket(category: Optional[str]) -> str:
+    """Gets the GridFS bucket the files of a category are stored in"""
+    if category is None:
+        return settings.GRIDFS_DEFAULT_BUCKET
+
+    return settings.GRIDFS_BUCKETS.get(
+        category, settings.GRIDFS_DEFAULT_BUCKET
+    )
+
+
+# whether the reads of the current request may go to secondaries
+secondary_reads: ContextVar[bool] = ContextVar(
+    "secondary_reads", default=False
+)
+
+
+async def prefer_secondary_reads():
+    """
+    Dependency for endpoints that tolerate stale reads, such as listings
+    and downloads. When MONGO_SECONDARY_READS is enabled their reads go
+    to secondaries lagging at most MONGO_MAX_STALENESS_SECONDS behind.
+    It is async so the flag is set in the request's own context.
+    """
+    secondary_reads.set(settings.MONGO_SECONDARY_READS)
+
+
+class FileData(Protocol):
+    """Readable and seekable data of a stored file"""
+
+    length: int
+
+    def read(self, size: int = -1) -> bytes: ...
+
+    def seek(self, pos: int, whence: int = 0) -> int: ...
+
+    def close(self): ...
+
+
+class Storage(Protocol):
+    """
+    Operations the API needs from a storage backend.
+    Filters and updates use the mongo query language.
+    """
+
+    # lifecycle
+    def connect(self): ...
+
+    def ensure_indexes(self): ...
+
+    def warm_up(self): ...
+
+    def close(self): ...
+
+    # agents
+    def agent_create_record(self, agent_data: s_agent.AgentBase) -> str: ...
+
+    def agent_create_records(
+        self, agents_data: List[s_agent.AgentBase]
+    ) -> List[str]: ...
+
+    def agent_get_record(self, filter: Dict) -> Optional[s_agent.Agent]: ...
+
+    def agent_get_all_records(
+        self,
+        filter: Dict,
+        limit: int = 0,
+        fields: Optional[FrozenSet[str]] = None,
+    ) -> List[s_agent.Agent]: ...
+
+    def agent_count_records(self, filter: Dict) -> int: ...
+
+    def agent_iter_batches(
+        self,
+        filter: Dict,
+        batch_size: int = 500,
+        fields: Optional[FrozenSet[str]] = None,
+    ) -> Iterator[List[s_agent.Agent]]: ...
+
+    def agent_get_page(
+        self, filter: Dict, limit: int = 0, cursor: Optional[str] = None
+    ) -> Page[s_agent.Agent]: ...
+
+    def agent_verify_record(self, filter: Dict) -> s_agent.Agent: ...
+
+    def agent_update_record(self, filter: Dict, update: Dict): ...
+
+    def agent_advanced_update_record(self, filter: Dict, update: Dict): ...
+
+    def agent_delete_record(self, filter: Dict): ...
+
+    # files
+    def file_create_record(
+        self, data: bytes, file_data: s_file.FileMetadata
+    ) -> str: ...
+
+    def file_put_data(
+        self, data: Union[bytes, BinaryIO], file_data: s_file.FileMetadata
+    ) -> str: ...
+
+    def file_open_data(self, gridfs_id: str, bucket: str) -> FileData: ...
+
+    def file_get_data_sizes(
+        self, files: List[s_file.File]
+    ) -> Dict[str, int]: ...
+
+    def file_delete_data(self, gridfs_id: str, bucket: str): ...
+
+    def file_data_path(self, gridfs_id: str, bucket: str) -> Optional[str]: ...
+
+    def file_create_records(
+        self, files_data: List[Tuple[str, s_file.FileMetadata]]
+    ) -> List[str]: ...
+
+    def file_replace_record(
+        self, data: Union[bytes, BinaryIO], file_data: s_file.FileMetadata
+    ) -> Tuple[str, Optional[s_file.File]]: ...
+
+    def file_point_record(
+        self, gridfs_id: str, file_data: s_file.FileMetadata
+    ) -> Tuple[str, Optional[s_file.File]]: ...
+
+    def file_get_record(self, filter: Dict) -> Optional[s_file.File]: ...
+
+    def file_get_all_records(self, filter: Dict) -> List[s_file.File]: ...
+
+    def file_get_records_by_ids(
+        self, ids: List[str]
+    ) -> Dict[str, s_file.File]: ...
+
+    def file_get_records_by_agent_ids(
+        self, agent_ids: List[str]
+    ) -> Dict[str, List[s_file.File]]: ...
+
+    def file_verify_record(self, filter: Dict) -> s_file.File: ...
+
+    def file_get_data(self, file_id: str) -> bytes: ...
+
+    def file_set_manifest(
+        self, file_id: str, gridfs_id: str, manifest: s_file.Manifest
+    ) -> bool: ...
+
+    def file_get_manifest(self, file_id: str) -> Optional[s_file.Manifest]: ...
+
+    def file_update_record(self, filter: Dict, update: Dict): ...
+
+    def file_advanced_update_record(self, filter: Dict, update: Dict): ...
+
+    def file_delete_record(self, filter: Dict): ...
+
+    # file versions
+    def file_version_create_record(self, file: s_file.File) -> str: ...
+
+    def file_version_get_all_records(
+        self, file_id: str
+    ) -> List[s_file.FileVersion]: ...
+
+    def file_version_verify_record(
+        self, filter: Dict
+    ) -> s_file.FileVersion: ...
+
+    def file_version_prune_records(
+        self, file_id: str, keep: int
+    ) -> List[s_file.FileVersion]: ...
+
+    def file_version_restore_record(
+        self, file_id: str, version_id: str
+    ) -> s_file.File: ...
+
+    # consultants
+    def consultant_create_record(
+        self, consultant_data: s_consultant.ConsultantBase
+    ) -> str: ...
+
+    def consultant_get_record(
+        self, filter: Dict
+    ) -> Optional[s_consultant.Consultant]: ...
+
+    def consultant_get_all_records(
+        self,
+        filter: Dict,
+        limit: int = 0,
+        fields: Optional[FrozenSet[str]] = None,
+    ) -> List[s_consultant.Consultant]: ...
+
+    def consultant_iter_batches(
+        self,
+        filter: Dict,
+        batch_size: int = 500,
+        fields: Optional[FrozenSet[str]] = None,
+    ) -> Iterator[List[s_consultant.Consultant]]: ...
+
+    def consultant_get_page(
+        self,
+        filter: Dict,
+        limit: int = 0,
+        cursor: Optional[str] = None,
+        fields: Optional[FrozenSet[str]] = None,
+    ) -> Page[s_consultant.Consultant]: ...
+
+    def consultant_verify_record(
+        self, filter: Dict
+    ) -> s_consultant.Consultant: ...
+
+    def consultant_update_record(self, filter: Dict, update: Dict): ...
+
+    def consultant_advanced_update_record(
+        self, filter: Dict, update: Dict
+    ): ...
+
+    def consultant_delete_record(self, filter: Dict): ...
+
+    # reviews
+    def review_create_record(
+        self, review_data: s_review.ReviewBase
+    ) -> str: ...
+
+    def review_get_record(self, filter: Dict) -> Optional[s_review.Review]: ...
+
+    def review_get_all_records(
+        self, filter: Dict, limit: int = 0
+    ) -> List[s_review.Review]: ...
+
+    def review_get_page(
+        self, filter: Dict, limit: int = 0, cursor: Optional[str] = None
+    ) -> Page[s_review.Review]: ...
+
+    def review_verify_record(self, filter: Dict) -> s_review.Review: ...
+
+    def review_update_record(self, filter: Dict, update: Dict): ...
+
+    def review_advanced_update_record(self, filter: Dict, update: Dict): ...
+
+    def review_delete_record(self, filter: Dict): ...
+
+    # uploads
+    def upload_create_record(self, upload_data: s_upload.UploadIn) -> str: ...
+
+    def upload_get_record(self, filter: Dict) -> Optional[s_upload.Upload]: ...
+
+    def upload_verify_record(self, filter: Dict) -> s_upload.Upload: ...
+
+    def upload_append_data(
+        self, upload: s_upload.Upload, offset: int, data: bytes
+    ) -> int: ...
+
+    def upload_complete_record(
+        self, upload: s_upload.Upload
+    ) -> Tuple[str, Optional[s_file.File]]: ...
+
+    def upload_delete_record(self, filter: Dict): ...
+
+    def upload_delete_expired_records(self) -> int: ...
+
+    # diagnostics
+    def slow_query_get_summary(
+        self, limit: int = 20
+    ) -> List[s_slow_query.SlowQuerySummary]: ...
+
+    def profile_create_record(self, profile_data: s_profile.ProfileBase): ...
+
+    def profile_get_record(
+        self, request_id: str
+    ) -> Optional[s_profile.ProfileBase]: ...
+
+    def profile_get_all_records(
+        self, limit: int = 50
+    ) -> List[s_profile.ProfileSummary]: ...
+
 
 class MongoStorage:
     """Storage class for interfacing with mongo db"""
@@ -24,11 +359,143 @@ class MongoStorage:
         """
         Storage object with methods to Create, Read, Update,
         Delete (CRUD) objects in the mongo database.
+        The client is created on first use, so creating the storage
+        does no I/O and starts no threads before the workers fork.
         """
-        self.client = MongoClient(connection_string)
-        self.db = self.client[db_name]
-        self.fs = gridfs.GridFS(self.db)
-        self.agents_collection = self.db["agents"]
+        self.connection_string = connection_string
+        self.db_name = db_name
+        self._client: Optional[MongoClient] = None
+        self._lock = threading.Lock()
+        self._capped_collections: Set[str] = set()
+        self._buckets: Dict[Tuple[str, bool], gridfs.GridFS] = {}
+        self._blob_stores: Dict[str, BlobStore] = {}
+
+    @property
+    def client(self) -> MongoClient:
+        self.connect()
+        return self._client
+
+    @property
+    def db(self) -> Database:
+        """
+        The database. Writes always go to the primary, reads go to
+        secondaries when the current request prefers secondary reads
+        """
+        self.connect()
+        return self._secondary_db if secondary_reads.get() else self._db
+
+    def _get_fs(self, bucket: str) -> gridfs.GridFS:
+        """Gets a GridFS bucket that reads like db does"""
+        key = (bucket, secondary_reads.get())
+        fs = self._buckets.get(key)
+        if fs is None:
+            fs = self._buckets[key] = gridfs.GridFS(self.db, collection=bucket)
+
+        return fs
+
+    def _get_blob_store(self, store: str) -> BlobStore:
+        """Gets a blob store by name, creating it on first use"""
+        blob_store = self._blob_stores.get(store)
+        if blob_store is None:
+            blob_store = self._blob_stores[store] = create_blob_store(
+                store, self._get_fs, lambda: self.db
+            )
+
+        return blob_store
+
+    def _get_upload_store(self, store: str) -> AppendableBlobStore:
+        """Gets a blob store by name that takes resumable uploads"""
+        blob_store = self._get_blob_store(store)
+        if not isinstance(blob_store, AppendableBlobStore):
+            raise ValueError(f"The {store} blob store cannot take uploads")
+
+        return blob_store
+
+    def connect(self):
+        """Creates the mongo client if it does not exist yet"""
+        if self._client is not None:
+            return
+
+        with self._lock:
+            if self._client is None:
+                self._create_client()
+
+    def _create_client(self):
+        event_listeners = []
+        if settings.METRICS_ENABLED:
+            event_listeners += [MongoCommandListener(), MongoPoolListener()]
+        if settings.SERVER_TIMING_ENABLED:
+            event_listeners.append(RequestTimingListener())
+        slow_query_listener = None
+        if settings.SLOW_QUERY_THRESHOLD_MS > 0:
+            slow_query_listener = SlowQueryListener(
+                threshold_ms=settings.SLOW_QUERY_THRESHOLD_MS,
+                ignored_collections=(settings.SLOW_QUERY_COLLECTION,),
+            )
+            event_listeners.append(slow_query_listener)
+
+        options = {}
+        if settings.MONGO_WAIT_QUEUE_TIMEOUT_MS is not None:
+            options["waitQueueTimeoutMS"] = (
+                settings.MONGO_WAIT_QUEUE_TIMEOUT_MS
+            )
+        if settings.MONGO_COMPRESSORS:
+            options["compressors"] = settings.MONGO_COMPRESSORS
+
+        client = MongoClient(
+            self.connection_string,
+            event_listeners=event_listeners,
+            maxPoolSize=settings.MONGO_MAX_POOL_SIZE,
+            minPoolSize=settings.MONGO_MIN_POOL_SIZE,
+            serverSelectionTimeoutMS=(
+                settings.MONGO_SERVER_SELECTION_TIMEOUT_MS
+            ),
+            **options,
+        )
+        self._db = client[self.db_name]
+        self._secondary_db = client.get_database(
+            self.db_name,
+            read_preference=SecondaryPreferred(
+                max_staleness=settings.MONGO_MAX_STALENESS_SECONDS
+            ),
+        )
+        if slow_query_listener:
+            slow_query_listener.recorder = self.slow_query_create_record
+        self._client = client
+
+    def ensure_indexes(self):
+        """Creates the indexes in INDEXES that do not exist yet"""
+        logger = getLogger(__name__ + ".ensure_indexes")
+        for collection, indexes in INDEXES.items():
+            names = self.db[collection].create_indexes(indexes)
+            logger.debug(f"{collection} indexes: {names}")
+
+    def warm_up(self):
+        """Opens a pooled connection by pinging the server"""
+        self.client.admin.command("ping")
+
+    def close(self):
+        """Closes the mongo client, a later call reconnects"""
+        with self._lock:
+            if self._client is not None:
+                self._client.close()
+                self._client = None
+                self._buckets.clear()
+
+    def _get_projection(
+        self, model: Type[BaseModel], fields: Optional[FrozenSet[str]]
+    ) -> Tuple[Type[BaseModel], Optional[Dict]]:
+        """
+        Gets the model to build records with and the projection to fetch
+        them with. If fields is None the full model is used
+        """
+        if fields is None:
+            return model, None
+
+        projection = {"_id": 1}
+        projection.update({field: 1 for field in fields if field != "id"})
+
+        return narrow_model(model, fields | {"id"}), projection
 
     # agents
     def agent_create_record(
@@ -48,6 +515,28 @@ class MongoStorage:
 
         return id
 
+    def agent_create_records(
+        self,
+        agents_data: List[s_agent.AgentBase],
+    ) -> List[str]:
+        """Creates multiple agent records with a single insert"""
+        if not agents_data:
+            return []
+
+        agents_table = self.db["agents"]
+
+        date = datetime.now(UTC)
+        agents = []
+        for agent_data in agents_data:
+            agent = agent_data.model_dump()
+            agent["date_created"] = date
+            agent["date_modified"] = date
+            agents.append(agent)
+
+        result = agents_table.insert_many(agents)
+
+        return [str(id) for id in result.inserted_ids]
+
     def agent_get_record(self, filter: Dict) -> Optional[s_agent.Agent]:
         """Gets a agent record from the db using the supplied filter"""
         agents = self.db["agents"]
@@ -63,23 +552,64 @@ class MongoStorage:
         return agent
 
     def agent_get_all_records(
-        self, filter: Dict, limit: int = 0
+        self,
+        filter: Dict,
+        limit: int = 0,
+        fields: Optional[FrozenSet[str]] = None,
     ) -> List[s_agent.Agent]:
-        """Gets all agent records from the db using the supplied filter"""
+        """
+        Gets all agent records from the db using the supplied filter.
+        If fields is supplied only those fields are fetched and the
+        records are returned as a narrowed model
+        """
         agents = self.db["agents"]
 
         if "_id" in filter and type(filter["_id"]) is str:
             filter["_id"] = ObjectId(filter["_id"])
 
-        agents_list = agents.find(filter).limit(limit=limit)
+        model, projection = self._get_projection(s_agent.Agent, fields)
+
+        agents_list = agents.find(filter, projection).limit(limit)
         agents_out = []
 
         for agent in agents_list:
-            agent = s_agent.Agent(**agent)
+            agent = model(**agent)
             agents_out.append(agent)
 
         return agents_out
 
+    def agent_count_records(self, filter: Dict) -> int:
+        """Counts the agent records matching the supplied filter"""
+        return self.db["agents"].count_documents(filter)
+
+    def agent_iter_batches(
+        self,
+        filter: Dict,
+        batch_size: int = 500,
+        fields: Optional[FrozenSet[str]] = None,
+    ) -> Iterator[List[s_agent.Agent]]:
+        """
+        Iterates over all agent records matching the filter in _id order,
+        yielding lists of at most batch_size records fetched from a single
+        server side cursor
+        """
+        agents = self.db["agents"]
+        model, projection = self._get_projection(s_agent.Agent, fields)
+
+        cursor = agents.find(filter, projection, batch_size=batch_size).sort(
+            "_id", ASCENDING
+        )
+        batch = []
+
+        for agent in cursor:
+            batch.append(model(**agent))
+            if len(batch) >= batch_size:
+                yield batch
+                batch = []
+
+        if batch:
+            yield batch
+
     def agent_get_page(
         self, filter: Dict, limit: int = 0, cursor: Optional[str] = None
     ) -> Page[s_agent.Agent]:
@@ -96,7 +626,7 @@ class MongoStorage:
         if item_count > 0:
             count_query = filter.copy()
             count_query["_id"] = {"$gt": ObjectId(agents[-1].id)}
-            last_item = storage.agent_get_record(count_query)
+            last_item = self.agent_get_record(count_query)
             if last_item and last_item.id != agents[-1].id:
                 next_cursor = agents[-1].id
 
@@ -152,7 +682,7 @@ class MongoStorage:
 
         self.db["agents"].delete_one(filter)
 
-        for file in storage.file_get_all_records({"agent_id": agent.id}):
+        for file in self.file_get_all_records({"agent_id": agent.id}):
             self.file_delete_record({"_id": file.id})
 
     # files
@@ -164,10 +694,11 @@ class MongoStorage:
         """Creates a file record"""
         files_table = self.db["files"]
 
-        gridfs_id = str(self.fs.put(data, **file_data.model_dump()))
+        gridfs_id = self.file_put_data(data, file_data)
         date = datetime.now(UTC)
         file = file_data.model_dump()
         file["gridfs_id"] = gridfs_id
+        file["bucket"] = get_bucket(file_data.category)
         file["date_created"] = date
         file["date_modified"] = date
 
@@ -175,6 +706,159 @@ class MongoStorage:
 
         return id
 
+    def file_put_data(
+        self,
+        data: Union[bytes, BinaryIO],
+        file_data: s_file.FileMetadata,
+    ) -> str:
+        """
+        Stores the data of a file without creating its record, in the
+        blob store placed by its category or size and the bucket of its
+        category. data may be bytes or a file like object which is
+        streamed
+        """
+        store = place_blob(file_data.category, get_data_size(data))
+        key = str(ObjectId())
+        self._get_blob_store(store).put(
+            get_bucket(file_data.category), key, data, file_data
+        )
+
+        return join_blob_id(store, key)
+
+    def file_open_data(self, gridfs_id: str, bucket: str) -> FileData:
+        """Opens the data of a file for reading"""
+        store, key = split_blob_id(gridfs_id)
+
+        return self._get_blob_store(store).open(bucket, key)
+
+    def file_get_data_sizes(self, files: List[s_file.File]) -> Dict[str, int]:
+        """
+        Gets the data size of each file by gridfs_id, with one lookup
+        per blob store and bucket instead of opening every file
+        """
+        keys: Dict[Tuple[str, str], List[str]] = {}
+        for file in files:
+            store, key = split_blob_id(file.gridfs_id)
+            keys.setdefault((store, file.bucket), []).append(key)
+
+        sizes = {}
+        for (store, bucket), store_keys in keys.items():
+            found = self._get_blob_store(store).sizes(bucket, store_keys)
+            for key in store_keys:
+                if key not in found:
+                    raise FileNotFoundError(f"No file data with key {key}")
+                sizes[join_blob_id(store, key)] = found[key]
+
+        return sizes
+
+    def file_delete_data(self, gridfs_id: str, bucket: str):
+        """Deletes the data of a file without its record"""
+        store, key = split_blob_id(gridfs_id)
+        self._get_blob_store(store).delete(bucket, key)
+
+    def file_data_path(self, gridfs_id: str, bucket: str) -> Optional[str]:
+        """
+        Gets the local path of the data of a file, or None when it is
+        not stored on the filesystem
+        """
+        store, key = split_blob_id(gridfs_id)
+
+        return self._get_blob_store(store).path(bucket, key)
+
+    def file_move_data(self, file: s_file.File, bucket: str):
+        """
+        Moves the data of a file into another bucket of its store and
+        points its record at it. The data keeps its id, and a copy left
+        behind by an interrupted move is replaced
+        """
+        store, key = split_blob_id(file.gridfs_id)
+        blob_store = self._get_blob_store(store)
+        blob_store.delete(bucket, key)
+
+        file_data = s_file.FileMetadata(**file.model_dump())
+        with blob_store.open(file.bucket, key) as data:
+            blob_store.put(bucket, key, data, file_data)
+        self.db["files"].update_one(
+            {"_id": ObjectId(file.id)}, {"$set": {"bucket": bucket}}
+        )
+        blob_store.delete(file.bucket, key)
+
+    def file_create_records(
+        self,
+        files_data: List[Tuple[str, s_file.FileMetadata]],
+    ) -> List[str]:
+        """
+        Creates multiple file records with a single insert from pairs of
+        GridFS id and file metadata
+        """
+        if not files_data:
+            return []
+
+        files_table = self.db["files"]
+
+        date = datetime.now(UTC)
+        files = []
+        for gridfs_id, file_data in files_data:
+            file = file_data.model_dump()
+            file["gridfs_id"] = gridfs_id
+            file["bucket"] = get_bucket(file_data.category)
+            file["date_created"] = date
+            file["date_modified"] = date
+            files.append(file)
+
+        result = files_table.insert_many(files)
+
+        return [str(id) for id in result.inserted_ids]
+
+    def file_replace_record(
+        self,
+        data: Union[bytes, BinaryIO],
+        file_data: s_file.FileMetadata,
+    ) -> Tuple[str, Optional[s_file.File]]:
+        """
+        Stores the data of a file, then points the record of its agent
+        and category at it with a single update, creating the record if
+        there is none. Returns the record id and the replaced record,
+        whose data the caller deletes once readers moved on
+        """
+        gridfs_id = self.file_put_data(data, file_data)
+
+        return self.file_point_record(gridfs_id, file_data)
+
+    def file_point_record(
+        self, gridfs_id: str, file_data: s_file.FileMetadata
+    ) -> Tuple[str, Optional[s_file.File]]:
+        """
+        Points the record of an agent and category at stored data with
+        a single update, creating the record if there is none. Returns
+        the record id and the replaced record
+        """
+        date = datetime.now(UTC)
+        update = file_data.model_dump(exclude={"agent_id", "category"})
+        update["gridfs_id"] = gridfs_id
+        update["bucket"] = get_bucket(file_data.category)
+        update["date_modified"] = date
+
+        new_id = ObjectId()
+        replaced = self.db["files"].find_one_and_update(
+            {"agent_id": file_data.agent_id, "category": file_data.category},
+            {
+                "$set": update,
+                "$unset": {"manifest": ""},
+                "$setOnInsert": {"_id": new_id, "date_created": date},
+            },
+            FILE_PROJECTION,
+            upsert=True,
+            return_document=ReturnDocument.BEFORE,
+        )
+        if replaced is None:
+            return str(new_id), None
+        # pointing a record at the data it has replaces nothing
+        if replaced["gridfs_id"] == gridfs_id:
+            return str(replaced["_id"]), None
+
+        return str(replaced["_id"]), s_file.File(**replaced)
+
     def file_get_record(self, filter: Dict) -> Optional[s_file.File]:
         """Gets a file record from the db using the supplied filter"""
         files = self.db["files"]
@@ -182,7 +866,7 @@ class MongoStorage:
         if "_id" in filter and type(filter["_id"]) is str:
             filter["_id"] = ObjectId(filter["_id"])
 
-        file = files.find_one(filter)
+        file = files.find_one(filter, FILE_PROJECTION)
 
         if file:
             file = s_file.File(**file)
@@ -202,7 +886,7 @@ class MongoStorage:
         if "_id" in filter and type(filter["_id"]) is str:
             filter["_id"] = ObjectId(filter["_id"])
 
-        files_list = files.find(filter)
+        files_list = files.find(filter, FILE_PROJECTION)
         files_output = []
 
         for file in files_list:
@@ -217,6 +901,42 @@ class MongoStorage:
 
         return files_output
 
+    def file_get_records_by_ids(
+        self, ids: List[str]
+    ) -> Dict[str, s_file.File]:
+        """
+        Gets the file records with the supplied ids in a single query
+        and returns them keyed by id
+        """
+        object_ids = list({ObjectId(id) for id in ids if id})
+
+        if not object_ids:
+            return {}
+
+        files = self.file_get_all_records({"_id": {"$in": object_ids}})
+
+        return {file.id: file for file in files}
+
+    def file_get_records_by_agent_ids(
+        self, agent_ids: List[str]
+    ) -> Dict[str, List[s_file.File]]:
+        """
+        Gets the file records of the supplied agents in a single query
+        and returns them grouped by agent id
+        """
+        if not agent_ids:
+            return {}
+
+        files = self.file_get_all_records(
+            {"agent_id": {"$in": list(set(agent_ids))}}
+        )
+        files_by_agent = {}
+
+        for file in files:
+            files_by_agent.setdefault(file.agent_id, []).append(file)
+
+        return files_by_agent
+
     def file_verify_record(self, filter: Dict) -> s_file.File:
         """
         Gets a file record using the filter
@@ -236,9 +956,40 @@ class MongoStorage:
     def file_get_data(self, file_id: str) -> bytes:
         """Gets the data of a file"""
 
-        file = storage.file_verify_record({"_id": file_id})
+        file = self.file_verify_record({"_id": file_id})
+
+        return self.file_open_data(file.gridfs_id, file.bucket).read()
+
+    def file_set_manifest(
+        self, file_id: str, gridfs_id: str, manifest: s_file.Manifest
+    ) -> bool:
+        """
+        Attaches a package manifest to a file record, unless the record
+        was pointed at other data since the manifest was read
+        """
+        result = self.db["files"].update_one(
+            {"_id": ObjectId(file_id), "gridfs_id": gridfs_id},
+            {"$set": {"manifest": manifest.model_dump()}},
+        )
 
-        return self.fs.get(file_id=ObjectId(file.gridfs_id)).read()
+        return result.matched_count > 0
+
+    def file_get_manifest(self, file_id: str) -> Optional[s_file.Manifest]:
+        """
+        Gets the package manifest of a file, or None when it has not
+        been indexed
+        """
+        file = self.db["files"].find_one(
+            {"_id": ObjectId(file_id)}, {"manifest": 1}
+        )
+        if file is None:
+            raise HTTPException(
+                status_code=status.HTTP_404_NOT_FOUND,
+                detail="File not found",
+            )
+
+        manifest = file.get("manifest")
+        return s_file.Manifest(**manifest) if manifest else None
 
     def file_update_record(self, filter: Dict, update: Dict):
         """Updates a file record"""
@@ -267,7 +1018,132 @@ class MongoStorage:
         file = self.file_verify_record(filter)
 
         self.db["files"].delete_one(filter)
-        self.fs.delete(file_id=ObjectId(file.gridfs_id))
+        self.file_delete_data(file.gridfs_id, file.bucket)
+
+        if is_versioned(file.category):
+            versions = self.file_version_get_all_records(file.id)
+            if versions:
+                self.db["file_versions"].delete_many({"file_id": file.id})
+            for version in versions:
+                self.file_delete_data(version.gridfs_id, version.bucket)
+
+    # file versions
+    def file_version_create_record(self, file: s_file.File) -> str:
+        """Keeps the data of a replaced file record as a version of it"""
+        version = {
+            "file_id": file.id,
+            "gridfs_id": file.gridfs_id,
+            "bucket": file.bucket,
+            "filename": file.filename,
+            "date_created": file.date_modified,
+        }
+
+        return str(self.db["file_versions"].insert_one(version).inserted_id)
+
+    def file_version_get_all_records(
+        self, file_id: str
+    ) -> List[s_file.FileVersion]:
+        """Gets the versions of a file record, newest first"""
+        versions = self.db["file_versions"].find(
+            {"file_id": file_id}, sort=[("date_created", DESCENDING)]
+        )
+
+        return [s_file.FileVersion(**version) for version in versions]
+
+    def file_version_verify_record(self, filter: Dict) -> s_file.FileVersion:
+        """
+        Gets a file version using the filter
+        and raises an error if a matching record is not found
+        """
+        if "_id" in filter and type(filter["_id"]) is str:
+            filter["_id"] = ObjectId(filter["_id"])
+
+        version = self.db["file_versions"].find_one(filter)
+        if version is None:
+            raise HTTPException(
+                status_code=status.HTTP_404_NOT_FOUND,
+                detail="File version not found",
+            )
+
+        return s_file.FileVersion(**version)
+
+    def file_version_prune_records(
+        self, file_id: str, keep: int
+    ) -> List[s_file.FileVersion]:
+        """
+        Deletes the versions of a file record past the newest keep and
+        returns the deleted ones, so the caller can delete their data.
+        Each version is only deleted while it points at the data it was
+        read with, so one restored in between keeps its new data
+        """
+        versions = self.db["file_versions"]
+        pruned = []
+        for version in self.file_version_get_all_records(file_id)[keep:]:
+            deleted = versions.find_one_and_delete(
+                {"_id": ObjectId(version.id), "gridfs_id": version.gridfs_id}
+            )
+            if deleted is not None:
+                pruned.append(s_file.FileVersion(**deleted))
+
+        return pruned
+
+    def file_version_restore_record(
+        self, file_id: str, version_id: str
+    ) -> s_file.File:
+        """
+        Points a file record back at the data of one of its versions,
+        which then keeps the data the record pointed at. No data is
+        copied, so a restore is two small updates
+        """
+        version = self.file_version_verify_record(
+            {"_id": version_id, "file_id": file_id}
+        )
+        file = self.file_verify_record({"_id": file_id})
+        date = datetime.now(UTC)
+
+        # the version takes the current data first, so an interrupted
+        # restore leaves data unreferenced rather than referenced twice
+        versions = self.db["file_versions"]
+        swapped = versions.update_one(
+            {"_id": ObjectId(version.id), "gridfs_id": version.gridfs_id},
+            {
+                "$set": {
+                    "gridfs_id": file.gridfs_id,
+                    "bucket": file.bucket,
+                    "filename": file.filename,
+                    "date_created": file.date_modified,
+                }
+            },
+        )
+        if not swapped.matched_count:
+            raise HTTPException(
+                status_code=status.HTTP_409_CONFLICT,
+                detail="File version changed during the restore",
+            )
+
+        restored = self.db["files"].update_one(
+            {"_id": ObjectId(file_id), "gridfs_id": file.gridfs_id},
+            {
+                "$set": {
+                    "gridfs_id": version.gridfs_id,
+                    "bucket": version.bucket,
+                    "filename": version.filename,
+                    "date_modified": date,
+                },
+                "$unset": {"manifest": ""},
+            },
+        )
+        if not restored.matched_count:
+            versions.update_one(
+                {"_id": ObjectId(version.id)},
+                {"$set": version.model_dump(exclude={"id"})},
+            )
+            raise HTTPException(
+                status_code=status.HTTP_409_CONFLICT,
+                detail="File changed during the restore",
+            )
+
+        return self.file_verify_record({"_id": file_id})
 
     # consultants
     def consultant_create_record(
@@ -304,32 +1180,79 @@ class MongoStorage:
         return consultant
 
     def consultant_get_all_records(
-        self, filter: Dict, limit: int = 0
+        self,
+        filter: Dict,
+        limit: int = 0,
+        fields: Optional[FrozenSet[str]] = None,
     ) -> List[s_consultant.Consultant]:
-        """Gets all consultant records from the db using the supplied filter"""
+        """
+        Gets all consultant records from the db using the supplied filter.
+        If fields is supplied only those fields are fetched and the
+        records are returned as a narrowed model
+        """
         consultants = self.db["consultants"]
 
         if "_id" in filter and type(filter["_id"]) is str:
             filter["_id"] = ObjectId(filter["_id"])
 
-        consultants_list = consultants.find(filter).limit(limit=limit)
+        model, projection = self._get_projection(
+            s_consultant.Consultant, fields
+        )
+
+        consultants_list = consultants.find(filter, projection).limit(limit)
         consultants_out = []
 
         for consultant in consultants_list:
-            consultant = s_consultant.Consultant(**consultant)
+            consultant = model(**consultant)
             consultants_out.append(consultant)
 
         return consultants_out
 
+    def consultant_iter_batches(
+        self,
+        filter: Dict,
+        batch_size: int = 500,
+        fields: Optional[FrozenSet[str]] = None,
+    ) -> Iterator[List[s_consultant.Consultant]]:
+        """
+        Iterates over all consultant records matching the filter in _id order,
+        yielding lists of at most batch_size records fetched from a single
+        server side cursor
+        """
+        consultants = self.db["consultants"]
+        model, projection = self._get_projection(
+            s_consultant.Consultant, fields
+        )
+
+        cursor = consultants.find(
+            filter, projection, batch_size=batch_size
+        ).sort("_id", ASCENDING)
+        batch = []
+
+        for consultant in cursor:
+            batch.append(model(**consultant))
+            if len(batch) >= batch_size:
+                yield batch
+                batch = []
+
+        if batch:
+            yield batch
+
     def consultant_get_page(
-        self, filter: Dict, limit: int = 0, cursor: Optional[str] = None
+        self,
+        filter: Dict,
+        limit: int = 0,
+        cursor: Optional[str] = None,
+        fields: Optional[FrozenSet[str]] = None,
     ) -> Page[s_consultant.Consultant]:
         """Gets a page of consultants"""
 
         if cursor:
             filter["_id"] = {"$gt": ObjectId(cursor)}
 
-        consultants = self.consultant_get_all_records(filter, limit=limit)
+        consultants = self.consultant_get_all_records(
+            filter, limit=limit, fields=fields
+        )
 
         item_count = len(consultants)
         next_cursor = None
@@ -337,7 +1260,7 @@ class MongoStorage:
         if item_count > 0:
             count_query = filter.copy()
             count_query["_id"] = {"$gt": ObjectId(consultants[-1].id)}
-            last_item = storage.consultant_get_record(count_query)
+            last_item = self.consultant_get_record(count_query)
             if last_item and last_item.id != consultants[-1].id:
                 next_cursor = consultants[-1].id
 
@@ -456,7 +1379,7 @@ class MongoStorage:
         if "_id" in filter and type(filter["_id"]) is str:
             filter["_id"] = ObjectId(filter["_id"])
 
-        reviews_list = reviews.find(filter).limit(limit=limit)
+        reviews_list = reviews.find(filter).limit(limit)
         reviews_out = []
 
         for review in reviews_list:
@@ -481,7 +1404,7 @@ class MongoStorage:
         if item_count > 0:
             count_query = filter.copy()
             count_query["_id"] = {"$gt": ObjectId(reviews[-1].id)}
-            last_item = storage.review_get_record(count_query)
+            last_item = self.review_get_record(count_query)
             if last_item and last_item.id != reviews[-1].id:
                 next_cursor = reviews[-1].id
 
@@ -554,5 +1477,321 @@ class MongoStorage:
         else:
             pass
 
+    # uploads
+    def upload_create_record(self, upload_data: s_upload.UploadIn) -> str:
+        """
+        Creates a resumable upload record, placing its data by the
+        category and length of the file
+        """
+        date = datetime.now(UTC)
+        upload = upload_data.model_dump()
+        upload["store"] = place_upload(
+            upload_data.category, upload_data.length
+        )
+        upload["bucket"] = get_bucket(upload_data.category)
+        upload["key"] = str(ObjectId())
+        upload["offset"] = 0
+        upload["expires_at"] = date + timedelta(
+            seconds=settings.UPLOAD_TTL_SECONDS
+        )
+        upload["date_created"] = date
+        upload["date_modified"] = date
+
+        return str(self.db["uploads"].insert_one(upload).inserted_id)
+
+    def upload_get_record(self, filter: Dict) -> Optional[s_upload.Upload]:
+        """Gets an upload record that has not expired"""
+        if "_id" in filter and type(filter["_id"]) is str:
+            filter["_id"] = ObjectId(filter["_id"])
+
+        upload = self.db["uploads"].find_one(
+            {**filter, "expires_at": {"$gt": datetime.now(UTC)}}
+        )
+
+        return s_upload.Upload(**upload) if upload else None
+
+    def upload_verify_record(self, filter: Dict) -> s_upload.Upload:
+        """
+        Gets an upload record using the filter
+        and raises an error if a matching record is not found
+        """
+        upload = self.upload_get_record(filter)
+
+        if upload is None:
+            raise HTTPException(
+                status_code=status.HTTP_404_NOT_FOUND,
+                detail="Upload not found",
+            )
+
+        return upload
+
+    def upload_append_data(
+        self, upload: s_upload.Upload, offset: int, data: bytes
+    ) -> int:
+        """
+        Appends data at offset of an upload and returns the new offset.
+        The upload is leased at offset before any data is written, so
+        a concurrent or stale append gets a conflict without touching
+        the data, and the upload expires later with every append
+        """
+        end = offset + len(data)
+        if end > upload.length:
+            raise HTTPException(
+                status_code=status.HTTP_400_BAD_REQUEST,
+                detail="Data past the upload length",
+            )
+
+        uploads = self.db["uploads"]
+        date = datetime.now(UTC)
+        # a lease outlives a stuck append, so the upload can resume
+        lease = date + timedelta(seconds=settings.UPLOAD_APPEND_LEASE_SECONDS)
+        claimed = uploads.find_one_and_update(
+            {
+                "_id": ObjectId(upload.id),
+                "offset": offset,
+                "$or": [
+                    {"appending": None},
+                    {"appending": {"$lte": date}},
+                ],
+            },
+            {"$set": {"appending": lease}},
+            {"_id": 1},
+        )
+        if claimed is None:
+            raise HTTPException(
+                status_code=status.HTTP_409_CONFLICT,
+                detail="Upload offset changed",
+            )
+
+        claim = {"_id": ObjectId(upload.id), "appending": lease}
+        try:
+            self._get_upload_store(upload.store).append(
+                upload.bucket, upload.key, offset, data
+            )
+        except Exception as ex:
+            uploads.update_one(claim, {"$unset": {"appending": ""}})
+            raise ex
+
+        date = datetime.now(UTC)
+        result = uploads.update_one(
+            claim,
+            {
+                "$set": {
+                    "offset": end,
+                    "expires_at": date
+                    + timedelta(seconds=settings.UPLOAD_TTL_SECONDS),
+                    "date_modified": date,
+                },
+                "$unset": {"appending": ""},
+            },
+        )
+        if result.matched_count == 0:
+            raise HTTPException(
+                status_code=status.HTTP_409_CONFLICT,
+                detail="Upload lease expired",
+            )
+
+        return end
+
+    def upload_complete_record(
+        self, upload: s_upload.Upload
+    ) -> Tuple[str, Optional[s_file.File]]:
+        """
+        Points the file record of the agent and category of a fully
+        received upload at its data and deletes the upload record.
+        The upload record is claimed first, so of two concurrent
+        completes only one stores the data. Returns the record id and
+        the replaced record
+        """
+        claimed = self.db["uploads"].find_one_and_delete(
+            {"_id": ObjectId(upload.id)}
+        )
+        if claimed is None:
+            raise HTTPException(
+                status_code=status.HTTP_409_CONFLICT,
+                detail="Upload is already complete",
+            )
+
+        file_data = s_file.FileMetadata(
+            filename=upload.filename,
+            agent_id=upload.agent_id,
+            category=upload.category,
+            restrict_access=False,
+        )
+        store = self._get_upload_store(upload.store)
+        try:
+            store.complete(upload.bucket, upload.key, upload.length, file_data)
+        except Exception as ex:
+            store.abort(upload.bucket, upload.key)
+            raise ex
+
+        return self.file_point_record(
+            join_blob_id(upload.store, upload.key), file_data
+        )
+
+    def upload_delete_record(self, filter: Dict):
+        """Deletes an upload record with the data received so far"""
+        upload = self.upload_verify_record(filter)
+
+        self.db["uploads"].delete_one({"_id": ObjectId(upload.id)})
+        self._get_upload_store(upload.store).abort(upload.bucket, upload.key)
+
+    def upload_delete_expired_records(self) -> int:
+        """Deletes the expired uploads with their data"""
+        uploads = self.db["uploads"]
+        count = 0
+        for upload in uploads.find(
+            {"expires_at": {"$lte": datetime.now(UTC)}}
+        ):
+            upload = s_upload.Upload(**upload)
+            uploads.delete_one({"_id": ObjectId(upload.id)})
+            self._get_upload_store(upload.store).abort(
+                upload.bucket, upload.key
+            )
+            count += 1
+
+        return count
+
+    def _get_capped_collection(self, name: str, size: int) -> Collection:
+        """Gets a capped collection, creating it on first use"""
+        if name not in self._capped_collections:
+            try:
+                self.db.create_collection(name, capped=True, size=size)
+            except CollectionInvalid:
+                pass
+            self._capped_collections.add(name)
+
+        return self.db[name]
+
+    # slow queries
+    def slow_query_create_record(
+        self,
+        query_data: s_slow_query.SlowQueryBase,
+        explain_command: Dict,
+    ) -> str:
+        """
+        Creates a slow query record in the capped slow query log along
+        with the explain output of the query
+        """
+        logger = getLogger(__name__ + ".slow_query_create_record")
+        slow_queries = self._get_capped_collection(
+            settings.SLOW_QUERY_COLLECTION, settings.SLOW_QUERY_LOG_SIZE
+        )
+
+        try:
+            explain = self.db.command(
+                {"explain": explain_command, "verbosity": "executionStats"}
+            )
+            query_data.explain = summarize_explain(explain)
+        except Exception as ex:
+            logger.warning(f"Failed to explain slow query: {ex}")
+
+        query = query_data.model_dump()
+        query["date_created"] = datetime.now(UTC)
+
+        return str(slow_queries.insert_one(query).inserted_id)
+
+    def slow_query_get_summary(
+        self, limit: int = 20
+    ) -> List[s_slow_query.SlowQuerySummary]:
+        """
+        Gets the slowest query shapes aggregated by fingerprint, ordered
+        by their total duration
+        """
+        slow_queries = self.db[settings.SLOW_QUERY_COLLECTION]
+
+        pipeline = [
+            {
+                "$group": {
+                    "_id": "$fingerprint",
+                    "collection": {"$last": "$collection"},
+                    "command": {"$last": "$command"},
+                    "shape": {"$last": "$shape"},
+                    "count": {"$sum": 1},
+                    "total_duration_ms": {"$sum": "$duration_ms"},
+                    "avg_duration_ms": {"$avg": "$duration_ms"},
+                    "max_duration_ms": {"$max": "$duration_ms"},
+                    "last_seen": {"$max": "$date_created"},
+                    "explain": {"$last": "$explain"},
+                }
+            },
+            {"$sort": {"total_duration_ms": -1}},
+            {"$limit": limit},
+        ]
+
+        return [
+            s_slow_query.SlowQuerySummary(
+                fingerprint=summary.pop("_id"), **summary
+            )
+            for summary in slow_queries.aggregate(pipeline)
+        ]
+
+    # profiles
+    def profile_create_record(self, profile_data: s_profile.ProfileBase):
+        """Creates a request profile record in the capped profile log"""
+        profiles = self._get_capped_collection(
+            settings.PROFILE_COLLECTION, settings.PROFILE_LOG_SIZE
+        )
+
+        profile = profile_data.model_dump()
+        profile["date_created"] = datetime.now(UTC)
+
+        return str(profiles.insert_one(profile).inserted_id)
+
+    def profile_get_record(
+        self, request_id: str
+    ) -> Optional[s_profile.ProfileBase]:
+        """Gets the latest profile recorded for a request id"""
+        profile = self.db[settings.PROFILE_COLLECTION].find_one(
+            {"request_id": request_id}, sort=[("$natural", DESCENDING)]
+        )
+
+        return s_profile.ProfileBase(**profile) if profile else None
+
+    def profile_get_all_records(
+        self, limit: int = 50
+    ) -> List[s_profile.ProfileSummary]:
+        """Gets the latest profiles without their data"""
+        profiles = self.db[settings.PROFILE_COLLECTION].find(
+            {},
+            projection={"data": 0},
+            sort=[("$natural", DESCENDING)],
+            limit=limit,
+        )
+
+        return [s_profile.ProfileSummary(**profile) for profile in profiles]
+
+
+def create_storage() -> Storage:
+    """Creates the storage backend selected by STORAGE_BACKEND"""
+    if settings.STORAGE_BACKEND == "memory":
+        from core.memory_storage import MemoryStorage
+
+        return MemoryStorage()
+
+    return MongoStorage()
+
+
+storage = create_storage()
+
+
+def get_storage() -> Storage:
+    """
+    Dependency that provides the storage backend.
+    Override it with app.dependency_overrides to swap or wrap the backend
+    """
+    return storage
+
+
+def resolve_storage(app) -> Storage:
+    """
+    Gets the storage the routes of app get, so code outside their
+    dependencies, such as middleware, honors app.dependency_overrides
+    """
+    overrides = getattr(app, "dependency_overrides", {})
+
+    return overrides.get(get_storage, get_storage)()
+
 
-storage = MongoStorage()
+StorageDep = Annotated[Storage, Depends(get_storage)]
+SecondaryReads = Depends(prefer_secondary_reads)
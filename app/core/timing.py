@@ -0,0 +1,138 @@
+import time
+from contextvars import ContextVar
+from logging import getLogger
+from typing import Dict, Optional, Tuple
+
+from core.config import settings
+from core.metrics import chunk_bytes, command_collection
+from pymongo import monitoring
+
+
+class RequestStats:
+    """Mongo and serialization costs attributed to a single request"""
+
+    def __init__(self):
+        self.db_count = 0
+        self.db_time = 0.0
+        self.serialization_time = 0.0
+        self.gridfs_bytes = 0
+        self.commands: Dict[str, int] = {}
+
+    def server_timing(self, total: float) -> str:
+        """Formats the stats as a Server-Timing header value"""
+        return ", ".join(
+            [
+                f'db;dur={self.db_time * 1000:.2f};desc="{self.db_count}"',
+                f"serialize;dur={self.serialization_time * 1000:.2f}",
+                f'gridfs;desc="{self.gridfs_bytes}"',
+                f"total;dur={total * 1000:.2f}",
+            ]
+        )
+
+
+request_stats: ContextVar[Optional[RequestStats]] = ContextVar(
+    "request_stats", default=None
+)
+
+
+class RequestTimingListener(monitoring.CommandListener):
+    """
+    Attributes every mongo command to the request being served.
+
+    pymongo publishes events on the thread running the command and
+    starlette copies the request context into its worker threads, so
+    the current request's stats are available from request_stats.
+    """
+
+    def __init__(self):
+        self._pending: Dict[Tuple, str] = {}
+
+    def started(self, event: monitoring.CommandStartedEvent):
+        stats = request_stats.get()
+        if stats is None:
+            return
+
+        collection = command_collection(event)
+        self._pending[(event.connection_id, event.request_id)] = collection
+        stats.gridfs_bytes += chunk_bytes(
+            event.command_name, collection, event.command
+        )
+
+    def succeeded(self, event: monitoring.CommandSucceededEvent):
+        stats = request_stats.get()
+        collection = self._pending.pop(
+            (event.connection_id, event.request_id), ""
+        )
+        if stats is None:
+            return
+
+        self._record(stats, event, collection)
+        stats.gridfs_bytes += chunk_bytes(
+            event.command_name, collection, event.reply
+        )
+
+    def failed(self, event: monitoring.CommandFailedEvent):
+        stats = request_stats.get()
+        collection = self._pending.pop(
+            (event.connection_id, event.request_id), ""
+        )
+        if stats is None:
+            return
+
+        self._record(stats, event, collection)
+
+    def _record(self, stats: RequestStats, event, collection: str):
+        key = f"{event.command_name} {collection}".strip()
+        stats.db_count += 1
+        stats.db_time += event.duration_micros / 1e6
+        stats.commands[key] = stats.commands.get(key, 0) + 1
+
+
+class ServerTimingMiddleware:
+    """
+    ASGI middleware that adds a Server-Timing header with the mongo
+    round trips, db time, serialization time and GridFS bytes of each
+    request, and logs requests over the configured budgets
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        stats = RequestStats()
+        token = request_stats.set(stats)
+        start = time.perf_counter()
+
+        async def send_wrapper(message):
+            if message["type"] == "http.response.start":
+                total = time.perf_counter() - start
+                headers = list(message.get("headers", []))
+                headers.append(
+                    (b"server-timing", stats.server_timing(total).encode())
+                )
+                message["headers"] = headers
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            request_stats.reset(token)
+            self._check_budget(scope, stats, time.perf_counter() - start)
+
+    def _check_budget(self, scope, stats: RequestStats, duration: float):
+        over_count = stats.db_count > settings.REQUEST_DB_COMMAND_BUDGET
+        over_time = duration * 1000 > settings.REQUEST_LATENCY_BUDGET_MS
+        if not (over_count or over_time):
+            return
+
+        logger = getLogger(__name__ + ".budget")
+        route = getattr(scope.get("route"), "path", scope["path"])
+        logger.warning(
+            f"{scope['method']} {route} over budget: "
+            f"{stats.db_count} db commands in {stats.db_time * 1000:.1f}ms, "
+            f"{duration * 1000:.1f}ms total, commands={stats.commands}"
+        )
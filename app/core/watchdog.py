@@ -0,0 +1,102 @@
+import asyncio
+import sys
+import threading
+import time
+import traceback
+from logging import getLogger
+from types import FrameType
+from typing import Optional, Tuple
+
+from core.metrics import EVENT_LOOP_BLOCKED, EVENT_LOOP_LAG
+
+
+def find_request(frame: Optional[FrameType]) -> Tuple[str, str]:
+    """
+    Finds the method and route template of the request a stack is
+    serving by looking for the ASGI scope of a middleware frame
+    """
+    while frame is not None:
+        scope = frame.f_locals.get("scope")
+        if isinstance(scope, dict) and scope.get("type") == "http":
+            route = getattr(scope.get("route"), "path", "unmatched")
+            return scope.get("method", ""), route
+        frame = frame.f_back
+
+    return "", "none"
+
+
+class LoopWatchdog:
+    """
+    Detects event loop stalls.
+
+    A heartbeat task on the loop records when it last ran and how late
+    it was. A watchdog thread checks the heartbeat and, when the loop has
+    not run for longer than the threshold, logs the stack of the loop
+    thread with the request it was serving and counts it as a metric.
+    Each stall is reported once.
+    """
+
+    def __init__(self, threshold_ms: float, interval_ms: float):
+        self.threshold = threshold_ms / 1000
+        self.interval = interval_ms / 1000
+        self._last_beat = time.monotonic()
+        self._loop_thread_id: Optional[int] = None
+        self._task: Optional[asyncio.Task] = None
+        self._thread: Optional[threading.Thread] = None
+        self._stop = threading.Event()
+
+    def start(self):
+        """Starts the watchdog on the running event loop"""
+        self._loop_thread_id = threading.get_ident()
+        self._last_beat = time.monotonic()
+        self._stop.clear()
+        self._task = asyncio.get_running_loop().create_task(self._heartbeat())
+        self._thread = threading.Thread(
+            target=self._watch, name="loop-watchdog", daemon=True
+        )
+        self._thread.start()
+
+    async def stop(self):
+        """Stops the watchdog"""
+        self._stop.set()
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+        if self._thread:
+            self._thread.join()
+
+    async def _heartbeat(self):
+        while True:
+            start = time.monotonic()
+            await asyncio.sleep(self.interval)
+            self._last_beat = time.monotonic()
+            EVENT_LOOP_LAG.observe(
+                max(self._last_beat - start - self.interval, 0)
+            )
+
+    def _watch(self):
+        reported = False
+        while not self._stop.wait(self.interval):
+            blocked = time.monotonic() - self._last_beat
+            if blocked <= self.threshold:
+                reported = False
+            elif not reported:
+                reported = True
+                self._report(blocked)
+
+    def _report(self, blocked: float):
+        logger = getLogger(__name__ + ".report")
+        try:
+            frame = sys._current_frames().get(self._loop_thread_id)
+            method, route = find_request(frame)
+            stack = "".join(traceback.format_stack(frame)) if frame else ""
+            EVENT_LOOP_BLOCKED.labels(route).inc()
+            logger.warning(
+                f"Event loop blocked for {blocked * 1000:.0f}ms "
+                f"while serving {method} {route}\n{stack}"
+            )
+        except Exception as ex:
+            logger.exception(ex)
@@ -0,0 +1,183 @@
+import struct
+import zlib
+from datetime import datetime
+from pathlib import PurePosixPath
+from typing import BinaryIO, Callable, Iterator, List, Set
+
+# the same layouts zipfile writes, without zip64 records
+LOCAL_HEADER = struct.Struct("<4s2B4HL2L2H")
+CENTRAL_HEADER = struct.Struct("<4s4B4HL2L5H2L")
+END_RECORD = struct.Struct("<4s4H2LH")
+
+VERSION = 20
+# names are utf-8. Sizes and crc are in the local header, since
+# streaming readers reject stored members with a data descriptor
+FLAGS = 0x800
+MAX_SIZE = 0xFFFFFFFF
+MAX_MEMBERS = 0xFFFF
+
+
+def safe_member_name(filename: str, taken: Set[str]) -> str:
+    """
+    Reduces a client supplied filename to a name that cannot be
+    extracted outside its folder, without path parts, and numbers it
+    when it is already taken. The name is added to taken
+    """
+    name = PurePosixPath(filename.replace("\\", "/")).name
+    if name in ("", ".", ".."):
+        name = "file"
+
+    path = PurePosixPath(name)
+    unique = name
+    count = 1
+    while unique in taken:
+        count += 1
+        unique = f"{path.stem} ({count}){path.suffix}"
+    taken.add(unique)
+
+    return unique
+
+
+class ZipMember:
+    """A member of a streamed zip, read with open when it is written"""
+
+    def __init__(
+        self,
+        name: str,
+        size: int,
+        date_time: datetime,
+        open: Callable[[], BinaryIO],
+    ):
+        self.name = name.encode("utf-8")
+        self.size = size
+        self.date_time = date_time
+        self.open = open
+
+    @property
+    def dos_date_time(self):
+        d = max(self.date_time, datetime(1980, 1, 1))
+        return (
+            d.hour << 11 | d.minute << 5 | d.second // 2,
+            (d.year - 1980) << 9 | d.month << 5 | d.day,
+        )
+
+
+def get_zip_size(members: List[ZipMember]) -> int:
+    """
+    Gets the size of the zip stream_zip writes. Members are stored, so
+    it is known before any data is read
+    """
+    size = END_RECORD.size
+    for member in members:
+        size += (
+            LOCAL_HEADER.size
+            + member.size
+            + CENTRAL_HEADER.size
+            + 2 * len(member.name)
+        )
+    if size > MAX_SIZE or len(members) > MAX_MEMBERS:
+        raise ValueError("Zip is too large without zip64 records")
+
+    return size
+
+
+def read_crc(data: BinaryIO, size: int, chunk_size: int) -> int:
+    """Reads the crc of size bytes of data, then seeks back to the start"""
+    crc = 0
+    read = 0
+    while read < size:
+        chunk = data.read(min(chunk_size, size - read))
+        if not chunk:
+            break
+        crc = zlib.crc32(chunk, crc)
+        read += len(chunk)
+    data.seek(0)
+
+    return crc
+
+
+def stream_zip(
+    members: List[ZipMember], chunk_size: int = 1024 * 1024
+) -> Iterator[bytes]:
+    """
+    Writes a zip of stored members, reading each member in chunk_size
+    pieces, so no member is held in memory whole. The local header of
+    a member carries its crc, so each member is read once for its crc
+    when it is opened and again as it is written
+    """
+    get_zip_size(members)
+    offset = 0
+    central_directory = []
+    for member in members:
+        time, date = member.dos_date_time
+        with member.open() as data:
+            crc = read_crc(data, member.size, chunk_size)
+            yield LOCAL_HEADER.pack(
+                b"PK\x03\x04",
+                VERSION,
+                0,
+                FLAGS,
+                0,
+                time,
+                date,
+                crc,
+                member.size,
+                member.size,
+                len(member.name),
+                0,
+            ) + member.name
+
+            written_crc = 0
+            written = 0
+            while written < member.size:
+                chunk = data.read(min(chunk_size, member.size - written))
+                if not chunk:
+                    break
+                written_crc = zlib.crc32(chunk, written_crc)
+                written += len(chunk)
+                yield chunk
+        if written != member.size:
+            raise ValueError(
+                f"{member.name.decode()} has {written} bytes, "
+                f"expected {member.size}"
+            )
+        if written_crc != crc:
+            raise ValueError(f"{member.name.decode()} changed while written")
+
+        central_directory.append(
+            CENTRAL_HEADER.pack(
+                b"PK\x01\x02",
+                VERSION,
+                3,
+                VERSION,
+                0,
+                FLAGS,
+                0,
+                time,
+                date,
+                crc,
+                member.size,
+                member.size,
+                len(member.name),
+                0,
+                0,
+                0,
+                0,
+                0o100644 << 16,
+                offset,
+            )
+            + member.name
+        )
+        offset += LOCAL_HEADER.size + len(member.name) + member.size
+
+    directory = b"".join(central_directory)
+    yield directory + END_RECORD.pack(
+        b"PK\x05\x06",
+        0,
+        0,
+        len(members),
+        len(members),
+        len(directory),
+        offset,
+        0,
+    )
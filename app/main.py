@@ -1,11 +1,101 @@
-from api.v1.routers import agent, consultant, file, health
+import asyncio
+import time
+from contextlib import asynccontextmanager, contextmanager
+from logging import getLogger
+from typing import Dict
+
+from api.v1.routers import (
+    admin,
+    agent,
+    consultant,
+    file,
+    health,
+    metrics,
+    upload,
+)
 from bson.errors import InvalidId
-from core.config import settings
+from core.config import configure_logging, settings
+from core.manifests import manifest_indexer
+from core.metrics import MetricsMiddleware
+from core.profiling import ProfilingMiddleware
+from core.storage import resolve_storage
+from core.timing import ServerTimingMiddleware
+from core.watchdog import LoopWatchdog
 from fastapi import FastAPI, status
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.responses import JSONResponse, RedirectResponse
+from starlette.concurrency import run_in_threadpool
+
+
+@contextmanager
+def startup_phase(name: str, timings: Dict[str, float]):
+    """
+    Times a startup phase. A failed phase is logged and startup goes
+    on, so the app still serves health checks while mongo is down
+    """
+    start = time.perf_counter()
+    try:
+        yield
+    except Exception:
+        logger = getLogger(__name__ + ".startup_phase")
+        logger.exception(f"Startup phase {name} failed")
+    finally:
+        timings[name] = (time.perf_counter() - start) * 1000
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    timings: Dict[str, float] = {}
+    start = time.perf_counter()
+    with startup_phase("logging", timings):
+        configure_logging()
 
-app = FastAPI(title=settings.APP_TITLE)
+    # the client is created here, after the workers fork
+    storage = resolve_storage(app)
+    with startup_phase("connect", timings):
+        await run_in_threadpool(storage.connect)
+    with startup_phase("indexes", timings):
+        await run_in_threadpool(storage.ensure_indexes)
+    with startup_phase("warm_up", timings):
+        await run_in_threadpool(storage.warm_up)
+
+    logger = getLogger(__name__ + ".lifespan")
+    logger.info(
+        f"Started in {(time.perf_counter() - start) * 1000:.1f}ms: "
+        + ", ".join(f"{name}={ms:.1f}ms" for name, ms in timings.items())
+    )
+
+    watchdog = None
+    if settings.LOOP_WATCHDOG_ENABLED:
+        watchdog = LoopWatchdog(
+            threshold_ms=settings.LOOP_WATCHDOG_THRESHOLD_MS,
+            interval_ms=settings.LOOP_WATCHDOG_INTERVAL_MS,
+        )
+        watchdog.start()
+
+    cleanup = asyncio.create_task(
+        upload.clean_up_uploads(
+            storage, settings.UPLOAD_CLEANUP_INTERVAL_SECONDS
+        )
+    )
+
+    yield
+
+    # the sweep may be running in a thread, so it is awaited before
+    # the storage it uses is closed
+    cleanup.cancel()
+    try:
+        await cleanup
+    except asyncio.CancelledError:
+        pass
+    manifest_indexer.shutdown()
+    if watchdog:
+        await watchdog.stop()
+
+    await run_in_threadpool(storage.close)
+
+
+app = FastAPI(title=settings.APP_TITLE, lifespan=lifespan)
 app.add_middleware(
     CORSMiddleware,
     allow_origins=settings.ALLOWED_ORIGINS.split(","),
@@ -13,11 +103,20 @@ app.add_middleware(
     allow_methods=["*"],
     allow_headers=["*"],
 )
+if settings.SERVER_TIMING_ENABLED:
+    app.add_middleware(ServerTimingMiddleware)
+if settings.METRICS_ENABLED:
+    app.add_middleware(MetricsMiddleware)
+if settings.PROFILING_ENABLED:
+    app.add_middleware(ProfilingMiddleware)
 
 app.include_router(
     router=health.router, prefix=settings.API_V1_STR, tags=["health"]
 )
 
+if settings.METRICS_ENABLED:
+    app.include_router(router=metrics.router, tags=["metrics"])
+
 app.include_router(
     router=consultant.router, prefix=settings.API_V1_STR, tags=["consultant"]
 )
@@ -28,6 +127,12 @@ app.include_router(
 app.include_router(
     router=file.router, prefix=settings.API_V1_STR, tags=["files"]
 )
+app.include_router(
+    router=upload.router, prefix=settings.API_V1_STR, tags=["uploads"]
+)
+app.include_router(
+    router=admin.router, prefix=settings.API_V1_STR, tags=["admin"]
+)
 
 
 @app.get("/", include_in_schema=False)
@@ -0,0 +1,91 @@
+"""
+Moves GridFS data into the bucket its file category is routed to.
+
+Files stored before per category buckets, or before a change to
+GRIDFS_BUCKETS, live in another bucket than get_bucket picks for them.
+Each of them is copied into its bucket with that bucket's chunk size,
+its record is pointed at the copy and the old data is deleted. The data
+keeps its id, so an interrupted run can be restarted.
+
+Run from the app directory:
+
+    python -m migrations.gridfs_buckets --dry-run
+    python -m migrations.gridfs_buckets
+"""
+
+import argparse
+from logging import getLogger
+from typing import Dict, Iterator, Tuple
+
+from core.storage import MongoStorage, get_bucket
+from pymongo import ASCENDING
+from schemas.file import File
+
+
+def find_misplaced(
+    storage: MongoStorage, batch_size: int = 500
+) -> Iterator[Tuple[File, str]]:
+    """Yields the files whose data is not in the bucket of their category"""
+    filter = {}
+    while True:
+        records = list(
+            storage.db["files"].find(
+                filter, sort=[("_id", ASCENDING)], limit=batch_size
+            )
+        )
+        if not records:
+            return
+
+        filter = {"_id": {"$gt": records[-1]["_id"]}}
+        for record in records:
+            file = File(**record)
+            bucket = get_bucket(file.category)
+            if file.bucket != bucket:
+                yield file, bucket
+
+
+def migrate(
+    storage: MongoStorage, dry_run: bool = False, batch_size: int = 500
+) -> Dict[str, int]:
+    """
+    Moves the misplaced files and counts them by source and target
+    bucket. A file that fails to move keeps its data where it was
+    """
+    logger = getLogger(__name__ + ".migrate")
+    moved = {}
+    for file, bucket in find_misplaced(storage, batch_size):
+        move = f"{file.bucket} -> {bucket}"
+        if not dry_run:
+            try:
+                storage.file_move_data(file, bucket)
+            except Exception as ex:
+                logger.error(f"Failed to move file {file.id}: {ex}")
+                move = f"{move} failed"
+        moved[move] = moved.get(move, 0) + 1
+
+    return moved
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[1])
+    parser.add_argument("--dry-run", action="store_true")
+    parser.add_argument("--batch-size", type=int, default=500)
+    args = parser.parse_args()
+
+    from core.config import configure_logging
+
+    configure_logging()
+    storage = MongoStorage()
+    try:
+        moved = migrate(storage, args.dry_run, args.batch_size)
+    finally:
+        storage.close()
+
+    for move, count in sorted(moved.items()):
+        print(f"{move}: {count}")
+    if not moved:
+        print("All files are in their buckets")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,6 +1,6 @@
 from datetime import datetime
 from enum import Enum
-from typing import List, Literal, Optional
+from typing import Dict, List, Literal, Optional
 
 from pydantic import AliasChoices, BaseModel, Field
 from schemas.base import PyObjectID
@@ -67,3 +67,21 @@ class AgentUpdate(BaseModel):
     description: Optional[str] = None
     platforms: Optional[List[Platform]] = None
     api_keys_required: Optional[List[str]] = None
+
+
+class AgentImportItem(AgentBase):
+    files: Dict[AgentstrKey, str] = {}
+
+
+class AgentImportResult(BaseModel):
+    index: int
+    name: Optional[str] = None
+    id: Optional[str] = None
+    created: bool
+    errors: List[str] = []
+
+
+class AgentImportReport(BaseModel):
+    created_count: int
+    failed_count: int
+    items: List[AgentImportResult]
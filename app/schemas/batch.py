@@ -0,0 +1,36 @@
+from typing import Dict, Generic, List, Optional, TypeVar
+
+from pydantic import BaseModel
+
+T = TypeVar("T")
+
+
+class BatchItem(BaseModel, Generic[T]):
+    id: str
+    found: bool
+    item: Optional[T] = None
+
+
+class Batch(BaseModel, Generic[T]):
+    items: List[BatchItem[T]]
+    found_count: int
+
+    @classmethod
+    def from_records(cls, ids: List[str], records: Dict[str, T]):
+        """Builds a batch in request order from records keyed by id"""
+        items = [
+            {"id": id, "found": id in records, "item": records.get(id)}
+            for id in ids
+        ]
+
+        return cls(
+            items=items,
+            found_count=sum(1 for item in items if item["found"]),
+        )
+
+
+def split_ids(ids: List[str]) -> List[str]:
+    """Splits repeated and comma separated id query values"""
+    return [
+        id.strip() for value in ids for id in value.split(",") if id.strip()
+    ]
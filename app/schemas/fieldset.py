@@ -0,0 +1,119 @@
+from typing import Dict, FrozenSet, Iterable, Optional, Tuple, Type
+
+from core.metrics import record_cache
+from fastapi import HTTPException, status
+from pydantic import BaseModel, Field, create_model
+
+
+def split_values(value: str) -> FrozenSet[str]:
+    """Splits a comma separated query value"""
+    return frozenset(v.strip() for v in value.split(",") if v.strip())
+
+
+# narrowed models by model and fields, there are only as many as the
+# field selections clients use
+_NARROWED_MODELS: Dict[Tuple[Type[BaseModel], FrozenSet[str]], Type] = {}
+
+
+def narrow_model(
+    model: Type[BaseModel], fields: FrozenSet[str]
+) -> Type[BaseModel]:
+    """
+    Gets a model with only the supplied fields of model, created once
+    per selection. Required fields become optional
+    """
+    key = (model, fields)
+    narrowed = _NARROWED_MODELS.get(key)
+    record_cache("narrow_model", narrowed is not None)
+    if narrowed is None:
+        narrowed = _NARROWED_MODELS.setdefault(
+            key, _create_narrow_model(model, fields)
+        )
+
+    return narrowed
+
+
+def _create_narrow_model(
+    model: Type[BaseModel], fields: FrozenSet[str]
+) -> Type[BaseModel]:
+    definitions = {}
+    for name, field in model.model_fields.items():
+        if name in fields:
+            default = None if field.is_required() else field.default
+            definitions[name] = (
+                Optional[field.rebuild_annotation()],
+                Field(
+                    default=default, validation_alias=field.validation_alias
+                ),
+            )
+
+    return create_model(f"{model.__name__}Partial", **definitions)
+
+
+class Fieldset(BaseModel):
+    """Fields selected for output and file fields to expand"""
+
+    fields: FrozenSet[str]
+    expand: FrozenSet[str]
+
+    @classmethod
+    def parse(
+        cls,
+        model: Type[BaseModel],
+        expandable: Iterable[str],
+        fields: Optional[str] = None,
+        expand: Optional[str] = None,
+    ) -> Optional["Fieldset"]:
+        """
+        Parses the fields and expand query values for model.
+        Returns None when neither is supplied
+        """
+        if fields is None and expand is None:
+            return None
+
+        available = set(model.model_fields)
+        expandable = set(expandable)
+
+        selected = available if fields is None else split_values(fields)
+        unknown = selected - available
+        if unknown:
+            raise HTTPException(
+                status_code=status.HTTP_400_BAD_REQUEST,
+                detail=f"Unknown fields: {sorted(unknown)}",
+            )
+
+        if expand is None:
+            expanded = selected & expandable
+        else:
+            expanded = split_values(expand)
+            unknown = expanded - expandable
+            if unknown:
+                raise HTTPException(
+                    status_code=status.HTTP_400_BAD_REQUEST,
+                    detail=f"Fields cannot be expanded: {sorted(unknown)}",
+                )
+
+        return cls(
+            fields=frozenset(selected | expanded | {"id"}),
+            expand=frozenset(expanded),
+        )
+
+    def record_fields(
+        self,
+        model: Type[BaseModel],
+        sources: Optional[Dict[str, str]] = None,
+    ) -> FrozenSet[str]:
+        """
+        Gets the fields of the stored model needed to build the output.
+        sources maps expandable fields to the stored fields they are
+        resolved from
+        """
+        sources = sources or {}
+        fields = self.fields & set(model.model_fields)
+        fields |= {sources[field] for field in self.expand if field in sources}
+
+        return frozenset(fields)
+
+    def output_model(self, model: Type[BaseModel]) -> Type[BaseModel]:
+        """Gets model narrowed to the selected fields"""
+        return narrow_model(model, self.fields)
@@ -1,6 +1,6 @@
 from datetime import datetime
 from enum import Enum
-from typing import Optional
+from typing import List, Optional, Union
 
 from pydantic import BaseModel, Field
 from schemas.base import PyObjectID
@@ -17,11 +17,20 @@ class FileCategory(str, Enum):
     UIPATH_AP = "uipath_agent_package"
     UIPATH_AD = "uipath_agent_dependencies"
 
+    @classmethod
+    def list(cls):
+        return list(map(lambda c: c.value, cls))
+
+
+class ConsultantFileCategory(str, Enum):
+    PROFILE_PICTURE = "profile_picture"
+    RESUME = "resume"
+
 
 class FileMetadata(BaseModel):
     filename: str
     agent_id: Optional[str] = None
-    category: Optional[FileCategory] = None
+    category: Optional[Union[FileCategory, ConsultantFileCategory]] = None
 
     # user_id: str
     # group: Optional[str] = None
@@ -38,12 +47,41 @@ class FileUpdate(BaseModel):
 class File(BaseModel):
     id: PyObjectID = Field(validation_alias="_id")
     gridfs_id: str
+    # records created before per category buckets are in the default one
+    bucket: str = "fs"
     filename: str
     agent_id: Optional[str] = None
-    category: Optional[FileCategory] = None
+    category: Optional[Union[FileCategory, ConsultantFileCategory]] = None
     # user_id: str
     # group: Optional[str] = None
     restrict_access: bool
     download_link: Optional[str] = None
     date_created: datetime
     date_modified: datetime
+
+
+class ManifestMember(BaseModel):
+    path: str
+    size: int
+    compressed_size: int
+    crc: int
+    # offset of the member's local header in the package
+    offset: int
+    compress_type: int
+
+
+class Manifest(BaseModel):
+    members: List[ManifestMember] = []
+    # why the package could not be indexed
+    error: Optional[str] = None
+    date_created: datetime
+
+
+class FileVersion(BaseModel):
+    id: PyObjectID = Field(validation_alias="_id")
+    file_id: str
+    gridfs_id: str
+    bucket: str = "fs"
+    filename: str
+    # when this version was stored
+    date_created: datetime
@@ -0,0 +1,19 @@
+from datetime import datetime
+from typing import Optional
+
+from pydantic import BaseModel
+
+
+class ProfileSummary(BaseModel):
+    request_id: str
+    method: str
+    path: str
+    route: str
+    status_code: Optional[int] = None
+    duration_ms: float
+    sample_count: int
+    date_created: Optional[datetime] = None
+
+
+class ProfileBase(ProfileSummary):
+    data: str
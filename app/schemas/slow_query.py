@@ -0,0 +1,26 @@
+from datetime import datetime
+from typing import Dict, Optional
+
+from pydantic import BaseModel
+
+
+class SlowQueryBase(BaseModel):
+    fingerprint: str
+    collection: str
+    command: str
+    shape: str
+    duration_ms: float
+    explain: Optional[Dict] = None
+
+
+class SlowQuerySummary(BaseModel):
+    fingerprint: str
+    collection: str
+    command: str
+    shape: str
+    count: int
+    total_duration_ms: float
+    avg_duration_ms: float
+    max_duration_ms: float
+    last_seen: datetime
+    explain: Optional[Dict] = None
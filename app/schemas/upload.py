@@ -0,0 +1,26 @@
+from datetime import datetime
+
+from pydantic import AliasChoices, BaseModel, Field
+from schemas.base import PyObjectID
+from schemas.file import FileCategory
+
+
+class UploadIn(BaseModel):
+    agent_id: str
+    category: FileCategory
+    filename: str
+    length: int = Field(gt=0)
+
+
+class UploadOut(UploadIn):
+    id: PyObjectID = Field(validation_alias=AliasChoices("_id", "id"))
+    offset: int = 0
+    expires_at: datetime
+
+
+class Upload(UploadOut):
+    store: str
+    bucket: str
+    key: str
+    date_created: datetime
+    date_modified: datetime
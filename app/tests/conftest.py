@@ -0,0 +1,306 @@
+"""
+Runs the app against mongomock and records the mongo commands each
+request issues, so tests can hold endpoints to a round trip budget.
+Tests using the backend fixture also run against MemoryStorage.
+"""
+
+import difflib
+import functools
+import os
+import threading
+from contextlib import contextmanager
+from typing import Dict, Iterator, List
+
+import mongomock
+import mongomock.gridfs
+import pymongo
+import pytest
+
+os.environ.setdefault("MONGODB_URI", "mongodb://localhost:27017")
+os.environ["DATABSE_NAME"] = "agents_service_test"
+os.environ["SLOW_QUERY_THRESHOLD_MS"] = "0"
+os.environ["PROFILING_ENABLED"] = "false"
+
+mongomock.gridfs.enable_gridfs_integration()
+pymongo.MongoClient = mongomock.MongoClient
+
+
+def _drop_sort(add):
+    """
+    pymongo passes the sort of bulk updates, which mongomock does not
+    take. The app never sorts them, so it is dropped when unset
+    """
+
+    @functools.wraps(add)
+    def wrapper(*args, sort=None, **kwargs):
+        if sort is not None:
+            raise NotImplementedError("mongomock cannot sort bulk updates")
+        return add(*args, **kwargs)
+
+    return wrapper
+
+
+for _method in ("add_update", "add_replace"):
+    setattr(
+        mongomock.collection.BulkOperationBuilder,
+        _method,
+        _drop_sort(
+            getattr(mongomock.collection.BulkOperationBuilder, _method)
+        ),
+    )
+
+# collection methods mapped to the server command each one sends
+COMMANDS = {
+    "aggregate": "aggregate",
+    "bulk_write": "bulkWrite",
+    "count_documents": "aggregate",
+    "create_index": "createIndexes",
+    "create_indexes": "createIndexes",
+    "delete_many": "delete",
+    "delete_one": "delete",
+    "distinct": "distinct",
+    "estimated_document_count": "count",
+    "find": "find",
+    "find_one": "find",
+    "find_one_and_delete": "findAndModify",
+    "find_one_and_replace": "findAndModify",
+    "find_one_and_update": "findAndModify",
+    "insert_many": "insert",
+    "insert_one": "insert",
+    "replace_one": "update",
+    "update_many": "update",
+    "update_one": "update",
+}
+
+# commands pymongo sends to store a single chunk file in GridFS: a
+# lookup on each bucket collection, the chunk and the file document
+GRIDFS_PUT = 4
+# commands pymongo sends to delete a GridFS file
+GRIDFS_DELETE = 2
+# index builds on the first write into an empty bucket
+GRIDFS_INDEXES = 2
+
+
+class CommandLog:
+    """
+    Records the commands sent through mongomock collections.
+    mongomock does not publish command events, so its collection methods
+    are wrapped instead. Calls nested inside another wrapped call, such
+    as find_one calling find, are part of the outer command. Commands
+    of the manifest indexing pool run outside requests and are left out.
+    """
+
+    def __init__(self):
+        self.commands: List[str] = []
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self._recording = False
+
+    def install(self):
+        for method, command in COMMANDS.items():
+            original = getattr(mongomock.collection.Collection, method)
+            setattr(
+                mongomock.collection.Collection,
+                method,
+                self._wrap(original, command),
+            )
+
+    def _wrap(self, original, command: str):
+        log = self
+
+        @functools.wraps(original)
+        def wrapper(collection, *args, **kwargs):
+            depth = getattr(log._local, "depth", 0)
+            if (
+                depth == 0
+                and log._recording
+                and not threading.current_thread().name.startswith("manifests")
+            ):
+                with log._lock:
+                    log.commands.append(f"{command} {collection.name}")
+            log._local.depth = depth + 1
+            try:
+                return original(collection, *args, **kwargs)
+            finally:
+                log._local.depth = depth
+
+        return wrapper
+
+    @contextmanager
+    def capture(self) -> Iterator[List[str]]:
+        """Records the commands sent inside the block"""
+        commands: List[str] = []
+        self.commands = commands
+        self._recording = True
+        try:
+            yield commands
+        finally:
+            self._recording = False
+
+
+def assert_within_budget(name: str, runs: Dict[str, List[str]], budget: int):
+    """
+    Fails when any run of an endpoint issued more than budget commands,
+    showing how its command log differs from the first run, or from the
+    budget when the first run is already over it
+    """
+    labels = list(runs)
+    baseline_label = labels[0]
+    baseline = runs[baseline_label]
+    if len(baseline) > budget:
+        baseline_label = f"budget of {budget}"
+        baseline = runs[labels[0]][:budget]
+
+    for label, commands in runs.items():
+        if len(commands) <= budget:
+            continue
+
+        diff = difflib.unified_diff(
+            baseline,
+            commands,
+            fromfile=baseline_label,
+            tofile=label,
+            lineterm="",
+        )
+        pytest.fail(
+            f"{name} issued {len(commands)} commands with {label}, "
+            f"budget is {budget}\n" + "\n".join(diff),
+            pytrace=False,
+        )
+
+
+command_log = CommandLog()
+command_log.install()
+
+
+@pytest.fixture(scope="session")
+def client():
+    from fastapi.testclient import TestClient
+    from main import app
+
+    with TestClient(app) as client:
+        yield client
+
+
+@pytest.fixture(autouse=True)
+def clean_database():
+    from core.config import settings
+    from core.manifests import manifest_indexer
+    from core.storage import storage
+
+    manifest_indexer.wait()
+    storage.client.drop_database(settings.DATABSE_NAME)
+    yield
+
+
+@pytest.fixture
+def commands() -> CommandLog:
+    return command_log
+
+
+@pytest.fixture(params=["mongo", "memory"])
+def backend(request, client):
+    """
+    The storage the app runs against. Tests using it run once against
+    mongo and once against a fresh MemoryStorage, so both backends are
+    held to the same route behavior
+    """
+    from core.memory_storage import MemoryStorage
+    from core.storage import get_storage, storage
+    from main import app
+
+    if request.param == "mongo":
+        yield storage
+        return
+
+    memory = MemoryStorage()
+    app.dependency_overrides[get_storage] = lambda: memory
+    try:
+        yield memory
+    finally:
+        app.dependency_overrides.pop(get_storage, None)
+
+
+def get_backend(request):
+    """Gets the backend of a test, mongo when it does not use one"""
+    from core.storage import storage
+
+    if "backend" in request.fixturenames:
+        return request.getfixturevalue("backend")
+
+    return storage
+
+
+@pytest.fixture
+def make_agents(request):
+    """Creates agents, each with a small file in every given category"""
+    from schemas.agent import AgentBase
+    from schemas.file import FileMetadata
+
+    storage = get_backend(request)
+
+    def make(count: int, categories: List[str] = ()) -> List[str]:
+        agent_ids = storage.agent_create_records(
+            [
+                AgentBase(
+                    name=f"agent {i}",
+                    description="An automation agent",
+                    platforms=["UiPath"],
+                    api_keys_required=[],
+                )
+                for i in range(count)
+            ]
+        )
+        for agent_id in agent_ids:
+            for category in categories:
+                storage.file_create_record(
+                    data=b"data",
+                    file_data=FileMetadata(
+                        filename=f"{category}.zip",
+                        agent_id=agent_id,
+                        category=category,
+                    ),
+                )
+
+        return agent_ids
+
+    return make
+
+
+@pytest.fixture
+def make_consultants(request):
+    """Creates consultants with a profile picture and resume"""
+    from schemas.consultant import ConsultantBase
+    from schemas.file import ConsultantFileCategory, FileMetadata
+
+    storage = get_backend(request)
+
+    def make(count: int) -> List[str]:
+        return [
+            storage.consultant_create_record(
+                ConsultantBase(
+                    profile_picture_id=storage.file_create_record(
+                        b"picture",
+                        FileMetadata(
+                            filename="picture.png",
+                            category=ConsultantFileCategory.PROFILE_PICTURE,
+                        ),
+                    ),
+                    resume_file_id=storage.file_create_record(
+                        b"resume",
+                        FileMetadata(
+                            filename="resume.pdf",
+                            category=ConsultantFileCategory.RESUME,
+                        ),
+                    ),
+                    name=f"consultant {i}",
+                    role="Engineer",
+                    description="A consultant",
+                    expertise="UiPath",
+                    day_rate=500,
+                )
+            )
+            for i in range(count)
+        ]
+
+    return make
@@ -0,0 +1,171 @@
+import io
+import os
+import zlib
+from datetime import datetime
+from zipfile import ZIP_STORED, ZipFile
+
+import pytest
+from core import zipstream
+from core.config import settings
+from core.storage import storage
+from core.zipstream import ZipMember
+from schemas.file import FileCategory, FileMetadata
+
+API = "/api/v1"
+
+
+def test_bundle(client, backend, make_agents, monkeypatch):
+    monkeypatch.setattr(settings, "BUNDLE_READ_SIZE", 1000)
+    (agent_id,) = make_agents(1, ["logo", "metadata"])
+    package = os.urandom(300 * 1024)
+    backend.file_create_record(
+        package,
+        FileMetadata(
+            filename="agent.nupkg",
+            agent_id=agent_id,
+            category=FileCategory.UIPATH_AP,
+        ),
+    )
+
+    response = client.get(f"{API}/agents/{agent_id}/bundle")
+    assert response.status_code == 200
+    assert int(response.headers["Content-Length"]) == len(response.content)
+
+    with ZipFile(io.BytesIO(response.content)) as bundle:
+        assert bundle.testzip() is None
+        assert bundle.namelist() == [
+            "logo/logo.zip",
+            "metadata/metadata.zip",
+            "uipath_agent_package/agent.nupkg",
+        ]
+        member = bundle.getinfo("uipath_agent_package/agent.nupkg")
+        assert member.compress_type == ZIP_STORED
+        assert bundle.read(member) == package
+
+
+def test_bundle_platform(client, backend, make_agents):
+    (agent_id,) = make_agents(
+        1,
+        [
+            FileCategory.METADATA,
+            FileCategory.UIPATH_AP,
+            FileCategory.PA_DESK_AP,
+        ],
+    )
+
+    response = client.get(
+        f"{API}/agents/{agent_id}/bundle", params={"platform": "UiPath"}
+    )
+    assert response.status_code == 200
+    with ZipFile(io.BytesIO(response.content)) as bundle:
+        assert [name.split("/")[0] for name in bundle.namelist()] == [
+            "metadata",
+            "uipath_agent_package",
+        ]
+
+    response = client.get(
+        f"{API}/agents/{agent_id}/bundle", params={"platform": "Python"}
+    )
+    assert response.status_code == 200
+    with ZipFile(io.BytesIO(response.content)) as bundle:
+        assert [name.split("/")[0] for name in bundle.namelist()] == [
+            "metadata"
+        ]
+
+
+def test_bundle_closes_member_data(client, make_agents, monkeypatch):
+    (agent_id,) = make_agents(1, ["logo", "metadata", "instructions"])
+    opened = []
+    file_open_data = storage.file_open_data
+
+    def open_data(gridfs_id: str, bucket: str):
+        data = file_open_data(gridfs_id, bucket)
+        opened.append(data)
+        return data
+
+    monkeypatch.setattr(storage, "file_open_data", open_data)
+
+    response = client.get(f"{API}/agents/{agent_id}/bundle")
+    assert response.status_code == 200
+    # sizes come from the file records, so each member is opened once
+    assert len(opened) == 3
+    assert all(data.closed for data in opened)
+
+    opened.clear()
+    monkeypatch.setattr(zipstream, "MAX_SIZE", 100)
+    response = client.get(f"{API}/agents/{agent_id}/bundle")
+    assert response.status_code == 413
+    assert opened == []
+
+
+def test_stream_zip_opens_members_lazily():
+    opened = []
+
+    def open_data():
+        opened.append(io.BytesIO(b"x" * 100))
+        return opened[-1]
+
+    members = [
+        ZipMember(f"{i}.txt", 100, datetime(2024, 1, 1), open_data)
+        for i in range(3)
+    ]
+    stream = zipstream.stream_zip(members, chunk_size=10)
+    for _ in range(5):
+        next(stream)
+    assert len(opened) == 1
+
+    # a client that goes away closes the stream
+    stream.close()
+    assert all(data.closed for data in opened)
+
+
+def test_bundle_member_names_stay_in_their_folder(client, make_agents):
+    (agent_id,) = make_agents(1)
+    for filename in ("../../agent.nupkg", "C:\\agent.nupkg", "/"):
+        storage.file_create_record(
+            b"package",
+            FileMetadata(
+                filename=filename,
+                agent_id=agent_id,
+                category=FileCategory.UIPATH_AP,
+            ),
+        )
+
+    response = client.get(f"{API}/agents/{agent_id}/bundle")
+    assert response.status_code == 200
+    with ZipFile(io.BytesIO(response.content)) as bundle:
+        assert bundle.namelist() == [
+            "uipath_agent_package/agent.nupkg",
+            "uipath_agent_package/agent (2).nupkg",
+            "uipath_agent_package/file",
+        ]
+
+
+def test_stream_zip_local_headers_carry_sizes():
+    data = [os.urandom(1000), b""]
+    members = [
+        ZipMember(
+            f"{i}.bin", len(d), datetime(2024, 1, 1), lambda d=d: io.BytesIO(d)
+        )
+        for i, d in enumerate(data)
+    ]
+    content = b"".join(zipstream.stream_zip(members, chunk_size=100))
+
+    offset = 0
+    for d in data:
+        header = zipstream.LOCAL_HEADER.unpack_from(content, offset)
+        flags, crc, compressed, size, name_length = header[3], *header[7:11]
+        assert flags & 0x08 == 0
+        assert (crc, compressed, size) == (zlib.crc32(d), len(d), len(d))
+        offset += zipstream.LOCAL_HEADER.size + name_length
+        assert content[offset : offset + len(d)] == d
+        offset += len(d)
+    assert content[offset : offset + 4] == b"PK\x01\x02"
+
+    with ZipFile(io.BytesIO(content)) as bundle:
+        assert bundle.testzip() is None
+
+    # a member that is shorter than its record stops the stream
+    members = [ZipMember("short.bin", 10, datetime(2024, 1, 1), io.BytesIO)]
+    with pytest.raises(ValueError):
+        b"".join(zipstream.stream_zip(members))
@@ -0,0 +1,287 @@
+import json
+import time
+from datetime import UTC, datetime
+
+import pytest
+from conftest import (
+    GRIDFS_DELETE,
+    GRIDFS_INDEXES,
+    GRIDFS_PUT,
+    assert_within_budget,
+)
+from core.metrics import CACHE_REQUESTS
+from core.storage import get_bucket, is_versioned
+from schemas.file import FileCategory
+
+API = "/api/v1"
+ALL_FILES = FileCategory.list()
+ALL_BUCKETS = {get_bucket(category) for category in ALL_FILES}
+
+
+def test_get_agents(client, commands, make_agents):
+    make_agents(30, ALL_FILES)
+
+    runs = {}
+    for limit in (1, 10, 30):
+        with commands.capture() as log:
+            response = client.get(f"{API}/agents", params={"limit": limit})
+        assert response.status_code == 200
+        assert response.json()["item_count"] == limit
+        runs[f"limit={limit}"] = log
+
+    assert_within_budget("GET /agents", runs, budget=3)
+
+
+def test_get_agents_fields(client, commands, make_agents):
+    make_agents(30, ALL_FILES)
+
+    runs = {}
+    for limit in (1, 30):
+        with commands.capture() as log:
+            response = client.get(
+                f"{API}/agents",
+                params={"limit": limit, "fields": "name", "expand": "logo"},
+            )
+        assert response.status_code == 200
+        runs[f"limit={limit}"] = log
+
+    assert_within_budget("GET /agents?fields", runs, budget=3)
+
+    # the narrowed models of a field selection are reused
+    hits = CACHE_REQUESTS.labels("narrow_model", "hit")
+    before = hits._value.get()
+    client.get(f"{API}/agents", params={"fields": "name", "expand": "logo"})
+    assert hits._value.get() > before
+
+
+def test_export_agents(client, commands, make_agents):
+    make_agents(30, ALL_FILES)
+
+    runs = {}
+    for since in ("2000-01-01T00:00:00", None):
+        with commands.capture() as log:
+            response = client.get(
+                f"{API}/agents/export",
+                params={"since": since} if since else {},
+            )
+        assert response.status_code == 200
+        assert len(response.text.splitlines()) == 30
+        runs[f"since={since}"] = log
+
+    # one find and one file query per export batch
+    assert_within_budget("GET /agents/export", runs, budget=2)
+
+
+def test_export_agents_since(client, make_agents):
+    agent_ids = make_agents(3)
+    # mongo keeps dates to the millisecond
+    time.sleep(0.01)
+    since = datetime.now(UTC)
+    time.sleep(0.01)
+
+    response = client.get(
+        f"{API}/agents/export", params={"since": since.isoformat()}
+    )
+    assert response.status_code == 200
+    assert response.text == ""
+
+    response = client.patch(
+        f"{API}/agents/{agent_ids[1]}/details_update", json={"name": "new"}
+    )
+    assert response.status_code == 200
+    response = client.get(
+        f"{API}/agents/export", params={"since": since.isoformat()}
+    )
+    assert response.status_code == 200
+    assert [json.loads(line)["id"] for line in response.text.splitlines()] == [
+        agent_ids[1]
+    ]
+
+
+def test_get_agents_batch(client, commands, make_agents):
+    agent_ids = make_agents(30, ALL_FILES)
+
+    runs = {}
+    for count in (1, 10, 30):
+        with commands.capture() as log:
+            response = client.get(
+                f"{API}/agents:batch",
+                params={"ids": ",".join(agent_ids[:count])},
+            )
+        assert response.status_code == 200
+        runs[f"ids={count}"] = log
+
+    assert_within_budget("GET /agents:batch", runs, budget=2)
+
+
+def test_get_agent(client, commands, make_agents):
+    runs = {}
+    for categories in ([], ALL_FILES):
+        (agent_id,) = make_agents(1, categories)
+        with commands.capture() as log:
+            response = client.get(f"{API}/agents/{agent_id}")
+        assert response.status_code == 200
+        runs[f"files={len(categories)}"] = log
+
+    assert_within_budget("GET /agents/{agent_id}", runs, budget=2)
+
+
+def test_new_agent(client, commands):
+    runs = {}
+    for categories in (["logo"], ALL_FILES):
+        with commands.capture() as log:
+            response = client.post(
+                f"{API}/agents",
+                data={
+                    "name": "agent",
+                    "description": "An automation agent",
+                    "platforms": ["UiPath"],
+                    "api_keys_required": ["KEY"],
+                },
+                files={
+                    category: (f"{category}.zip", b"data")
+                    for category in categories
+                },
+            )
+        assert response.status_code == 200
+        runs[f"files={len(categories)}"] = log
+
+    # the agent, then GridFS and a file record for each artifact
+    assert_within_budget(
+        "POST /agents",
+        runs,
+        budget=1
+        + GRIDFS_INDEXES * len(ALL_BUCKETS)
+        + (GRIDFS_PUT + 1) * len(ALL_FILES),
+    )
+
+
+def test_import_agents(client, commands):
+    runs = {}
+    for count in (1, 10):
+        manifest = "\n".join(
+            json.dumps(
+                {
+                    "name": f"agent {i}",
+                    "description": "An automation agent",
+                    "platforms": ["UiPath"],
+                    "api_keys_required": [],
+                    "files": {"logo": "logo.png"},
+                }
+            )
+            for i in range(count)
+        )
+        with commands.capture() as log:
+            response = client.post(
+                f"{API}/agents/import",
+                files=[
+                    ("manifest", ("manifest.ndjson", manifest.encode())),
+                    ("artifacts", ("logo.png", b"logo")),
+                ],
+            )
+        assert response.status_code == 200
+        assert response.json()["created_count"] == count
+        runs[f"agents={count}"] = log
+
+    # agents and file records are bulk inserted, only GridFS writes
+    # grow with the number of artifacts
+    assert_within_budget(
+        "POST /agents/import",
+        runs,
+        budget=2 + GRIDFS_INDEXES + GRIDFS_PUT * 10,
+    )
+
+
+def test_update_agent_details(client, commands, make_agents):
+    runs = {}
+    for categories in ([], ALL_FILES):
+        (agent_id,) = make_agents(1, categories)
+        with commands.capture() as log:
+            response = client.patch(
+                f"{API}/agents/{agent_id}/details_update",
+                json={"name": "renamed"},
+            )
+        assert response.status_code == 200
+        runs[f"files={len(categories)}"] = log
+
+    assert_within_budget(
+        "PATCH /agents/{agent_id}/details_update", runs, budget=4
+    )
+
+
+def test_update_agent(client, commands, make_agents):
+    runs = {}
+    for categories in (["logo"], ALL_FILES):
+        (agent_id,) = make_agents(1, ALL_FILES)
+        with commands.capture() as log:
+            response = client.patch(
+                f"{API}/agents/{agent_id}",
+                files={
+                    category: (f"{category}.zip", b"new data")
+                    for category in categories
+                },
+            )
+        assert response.status_code == 200
+        # file records are repointed, never deleted and recreated
+        assert "delete files" not in log
+        runs[f"files={len(categories)}"] = log
+
+    # each artifact is stored and its record repointed with one update,
+    # the replaced data is deleted after the response
+    per_file = (GRIDFS_PUT + 1) + GRIDFS_DELETE
+    assert_within_budget(
+        "PATCH /agents/{agent_id}", runs, budget=3 + per_file * len(ALL_FILES)
+    )
+
+
+def test_delete_agent(client, commands, make_agents):
+    runs = {}
+    for categories in ([], ALL_FILES):
+        (agent_id,) = make_agents(1, categories)
+        with commands.capture() as log:
+            response = client.delete(f"{API}/agents/{agent_id}")
+        assert response.status_code == 200
+        runs[f"files={len(categories)}"] = log
+
+    # each file is looked up and deleted with its GridFS data, versioned
+    # files also look up their versions
+    per_file = 2 + GRIDFS_DELETE
+    versioned = sum(is_versioned(category) for category in ALL_FILES)
+    assert_within_budget(
+        "DELETE /agents/{agent_id}",
+        runs,
+        budget=3 + per_file * len(ALL_FILES) + versioned,
+    )
+
+
+def test_review_agent(client, commands, make_agents):
+    (agent_id,) = make_agents(1, ALL_FILES)
+
+    runs = {}
+    for i in range(2):
+        with commands.capture() as log:
+            response = client.post(
+                f"{API}/agents/{agent_id}/review", json={"reaction": "like"}
+            )
+        assert response.status_code == 200
+        runs[f"review {i + 1}"] = log
+
+    assert_within_budget("POST /agents/{agent_id}/review", runs, budget=5)
+
+
+def test_update_agent_keeps_file_ids(client, backend, make_agents):
+    (agent_id,) = make_agents(1, ["logo"])
+    old = backend.file_verify_record(
+        {"agent_id": agent_id, "category": FileCategory.LOGO}
+    )
+
+    response = client.patch(
+        f"{API}/agents/{agent_id}", files={"logo": ("logo.png", b"new")}
+    )
+    assert response.status_code == 200
+    assert response.json()["logo"]["id"] == old.id
+    assert backend.file_get_data(old.id) == b"new"
+
+    # the replaced data was deleted after the response
+    with pytest.raises(Exception):
+        backend.file_open_data(old.gridfs_id, old.bucket)
@@ -0,0 +1,113 @@
+import os
+
+import pytest
+from core.blobs import place_upload
+from core.config import settings
+from core.storage import storage
+from schemas.file import FileCategory, FileMetadata
+
+API = "/api/v1"
+
+
+@pytest.fixture
+def blob_settings(monkeypatch, tmp_path):
+    """Places packages on the filesystem under a temporary root"""
+    monkeypatch.setattr(settings, "BLOB_FILESYSTEM_ROOT", str(tmp_path))
+    monkeypatch.setattr(
+        settings, "BLOB_STORES", {FileCategory.UIPATH_AP.value: "filesystem"}
+    )
+    monkeypatch.setattr(storage, "_blob_stores", {})
+    return settings
+
+
+def make_file(data: bytes, category: FileCategory) -> str:
+    return storage.file_create_record(
+        data, FileMetadata(filename=f"{category.value}.zip", category=category)
+    )
+
+
+def test_filesystem_downloads(client, commands, blob_settings, tmp_path):
+    data = os.urandom(1024 * 1024)
+    file_id = make_file(data, FileCategory.UIPATH_AP)
+    file = storage.file_get_record({"_id": file_id})
+    assert file.gridfs_id.startswith("filesystem:")
+    assert storage.file_data_path(file.gridfs_id, file.bucket).startswith(
+        str(tmp_path)
+    )
+
+    # only the file record is read from mongo
+    with commands.capture() as log:
+        response = client.get(f"{API}/files/{file_id}/unrestricted/download")
+    assert response.status_code == 200
+    assert response.content == data
+    assert log == ["find files"]
+
+    response = client.get(
+        f"{API}/files/{file_id}/download", headers={"Range": "bytes=10-99"}
+    )
+    assert response.status_code == 206
+    assert response.content == data[10:100]
+
+    assert storage.file_get_data_sizes([file]) == {file.gridfs_id: len(data)}
+
+    path = storage.file_data_path(file.gridfs_id, file.bucket)
+    storage.file_delete_record({"_id": file_id})
+    assert not os.path.exists(path)
+    with pytest.raises(FileNotFoundError):
+        storage.file_get_data_sizes([file])
+
+
+def test_size_threshold(blob_settings, monkeypatch):
+    monkeypatch.setattr(settings, "BLOB_LARGE_THRESHOLD", 1024)
+
+    small = storage.file_get_record(
+        {"_id": make_file(b"x" * 1023, FileCategory.LOGO)}
+    )
+    large = storage.file_get_record(
+        {"_id": make_file(b"x" * 1024, FileCategory.LOGO)}
+    )
+    assert ":" not in small.gridfs_id
+    assert large.gridfs_id.startswith("filesystem:")
+    assert storage.file_get_data(large.id) == b"x" * 1024
+
+
+def test_s3_store(blob_settings, monkeypatch):
+    moto = pytest.importorskip("moto")
+    import boto3
+
+    monkeypatch.setenv("AWS_ACCESS_KEY_ID", "test")
+    monkeypatch.setenv("AWS_SECRET_ACCESS_KEY", "test")
+    monkeypatch.setenv("AWS_DEFAULT_REGION", "us-east-1")
+    monkeypatch.setattr(settings, "BLOB_S3_BUCKET", "blobs")
+    monkeypatch.setattr(
+        settings, "BLOB_STORES", {FileCategory.UIPATH_AP.value: "s3"}
+    )
+
+    with moto.mock_aws():
+        boto3.client("s3").create_bucket(Bucket="blobs")
+        data = os.urandom(300 * 1024)
+        file = storage.file_get_record(
+            {"_id": make_file(data, FileCategory.UIPATH_AP)}
+        )
+        assert file.gridfs_id.startswith("s3:")
+
+        file_data = storage.file_open_data(file.gridfs_id, file.bucket)
+        assert file_data.length == len(data)
+        file_data.seek(1000)
+        assert file_data.read(24) == data[1000:1024]
+        assert storage.file_get_data_sizes([file]) == {
+            file.gridfs_id: len(data)
+        }
+
+        storage.file_delete_record({"_id": file.id})
+        with pytest.raises(Exception):
+            storage.file_open_data(file.gridfs_id, file.bucket)
+        with pytest.raises(FileNotFoundError):
+            storage.file_get_data_sizes([file])
+
+        # S3 objects cannot be appended to, so uploads go to GridFS
+        assert place_upload(FileCategory.UIPATH_AP.value, len(data)) == (
+            "gridfs"
+        )
+        with pytest.raises(ValueError):
+            storage._get_upload_store("s3")
@@ -0,0 +1,177 @@
+from conftest import (
+    GRIDFS_DELETE,
+    GRIDFS_INDEXES,
+    GRIDFS_PUT,
+    assert_within_budget,
+)
+
+API = "/api/v1"
+
+
+def test_get_consultants(client, commands, make_consultants):
+    make_consultants(30)
+
+    runs = {}
+    for limit in (1, 10, 30):
+        with commands.capture() as log:
+            response = client.get(
+                f"{API}/consultants", params={"limit": limit}
+            )
+        assert response.status_code == 200
+        assert response.json()["item_count"] == limit
+        runs[f"limit={limit}"] = log
+
+    assert_within_budget("GET /consultants", runs, budget=3)
+
+
+def test_get_consultants_fields(client, commands, make_consultants):
+    make_consultants(30)
+
+    runs = {}
+    for limit in (1, 30):
+        with commands.capture() as log:
+            response = client.get(
+                f"{API}/consultants",
+                params={"limit": limit, "fields": "name"},
+            )
+        assert response.status_code == 200
+        runs[f"limit={limit}"] = log
+
+    assert_within_budget("GET /consultants?fields", runs, budget=2)
+
+
+def test_export_consultants(client, commands, make_consultants):
+    runs = {}
+    for count in (1, 30):
+        make_consultants(count)
+        with commands.capture() as log:
+            response = client.get(f"{API}/consultants/export")
+        assert response.status_code == 200
+        runs[f"consultants={count}"] = log
+
+    # one find and one file query per export batch
+    assert_within_budget("GET /consultants/export", runs, budget=2)
+
+
+def test_get_consultants_batch(client, commands, make_consultants):
+    consultant_ids = make_consultants(30)
+
+    runs = {}
+    for count in (1, 10, 30):
+        with commands.capture() as log:
+            response = client.get(
+                f"{API}/consultants:batch",
+                params={"ids": ",".join(consultant_ids[:count])},
+            )
+        assert response.status_code == 200
+        runs[f"ids={count}"] = log
+
+    assert_within_budget("GET /consultants:batch", runs, budget=2)
+
+
+def test_get_consultant(client, commands, make_consultants):
+    (consultant_id,) = make_consultants(1)
+
+    with commands.capture() as log:
+        response = client.get(f"{API}/consultants/{consultant_id}")
+    assert response.status_code == 200
+
+    assert_within_budget(
+        "GET /consultants/{consultant_id}", {"consultant": log}, budget=2
+    )
+
+
+def test_new_consultant(client, commands):
+    with commands.capture() as log:
+        response = client.post(
+            f"{API}/consultants",
+            data={
+                "name": "consultant",
+                "description": "A consultant",
+                "role": "Engineer",
+                "expertise": "UiPath",
+                "day_rate": 500,
+            },
+            files={
+                "profile_picture": ("picture.png", b"picture"),
+                "resume_file": ("resume.pdf", b"resume"),
+            },
+        )
+    assert response.status_code == 200
+
+    # both files into their own buckets, the consultant and reading it back
+    assert_within_budget(
+        "POST /consultants",
+        {"consultant": log},
+        budget=2 * (GRIDFS_INDEXES + GRIDFS_PUT + 1) + 3,
+    )
+
+
+def test_update_consultant(client, commands, make_consultants):
+    (consultant_id,) = make_consultants(1)
+
+    with commands.capture() as log:
+        response = client.patch(
+            f"{API}/consultants/{consultant_id}/details",
+            json={"name": "renamed"},
+        )
+    assert response.status_code == 200
+
+    assert_within_budget(
+        "PATCH /consultants/{consultant_id}/details",
+        {"consultant": log},
+        budget=4,
+    )
+
+
+def test_update_consultant_files(client, commands, make_consultants):
+    (consultant_id,) = make_consultants(1)
+
+    with commands.capture() as log:
+        response = client.patch(
+            f"{API}/consultants/{consultant_id}/files",
+            files={
+                "profile_picture": ("picture.png", b"picture"),
+                "resume_file": ("resume.pdf", b"resume"),
+            },
+        )
+    assert response.status_code == 200
+
+    assert_within_budget(
+        "PATCH /consultants/{consultant_id}/files",
+        {"consultant": log},
+        budget=2 * (GRIDFS_PUT + 1) + 4,
+    )
+
+
+def test_delete_consultant(client, commands, make_consultants):
+    (consultant_id,) = make_consultants(1)
+
+    with commands.capture() as log:
+        response = client.delete(f"{API}/consultants/{consultant_id}")
+    assert response.status_code == 200
+
+    # both files are looked up and deleted with their GridFS data
+    assert_within_budget(
+        "DELETE /consultants/{consultant_id}",
+        {"consultant": log},
+        budget=2 + 2 * (2 + GRIDFS_DELETE),
+    )
+
+
+def test_review_consultant(client, commands, make_consultants):
+    (consultant_id,) = make_consultants(1)
+
+    runs = {}
+    for i in range(2):
+        with commands.capture() as log:
+            response = client.post(
+                f"{API}/consultants/{consultant_id}/review",
+                json={"reaction": "love"},
+            )
+        assert response.status_code == 200
+        runs[f"review {i + 1}"] = log
+
+    assert_within_budget(
+        "POST /consultants/{consultant_id}/review", runs, budget=5
+    )
@@ -0,0 +1,48 @@
+import pytest
+from conftest import assert_within_budget
+from core.storage import storage
+from schemas.file import FileMetadata
+
+API = "/api/v1"
+CHUNK_SIZE = 255 * 1024
+
+
+def make_file(size: int) -> str:
+    return storage.file_create_record(
+        data=b"x" * size, file_data=FileMetadata(filename="package.zip")
+    )
+
+
+@pytest.mark.parametrize("path", ["download", "unrestricted/download"])
+def test_download_file(client, commands, path):
+    runs = {}
+    for chunks in (1, 4):
+        file_id = make_file(chunks * CHUNK_SIZE)
+        with commands.capture() as log:
+            response = client.get(f"{API}/files/{file_id}/{path}")
+        assert response.status_code == 200
+        assert len(response.content) == chunks * CHUNK_SIZE
+        runs[f"chunks={chunks}"] = log
+
+    # the file record, the GridFS file and one cursor over the chunks
+    assert_within_budget(f"GET /files/{{file_id}}/{path}", runs, budget=3)
+
+
+@pytest.mark.parametrize("path", ["download", "unrestricted/download"])
+def test_download_file_range(client, commands, path):
+    file_id = make_file(4 * CHUNK_SIZE)
+
+    runs = {}
+    for start, end in [(0, 99), (CHUNK_SIZE - 50, 3 * CHUNK_SIZE + 50)]:
+        with commands.capture() as log:
+            response = client.get(
+                f"{API}/files/{file_id}/{path}",
+                headers={"Range": f"bytes={start}-{end}"},
+            )
+        assert response.status_code == 206
+        assert len(response.content) == end - start + 1
+        runs[f"bytes={start}-{end}"] = log
+
+    assert_within_budget(
+        f"GET /files/{{file_id}}/{path} ranged", runs, budget=3
+    )
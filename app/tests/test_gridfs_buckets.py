@@ -0,0 +1,37 @@
+import os
+
+import gridfs
+from bson.objectid import ObjectId
+from core.config import settings
+from core.storage import storage
+from migrations.gridfs_buckets import migrate
+from schemas.file import FileCategory, FileMetadata
+
+API = "/api/v1"
+
+
+def test_migrate_moves_files_into_their_bucket(client, monkeypatch):
+    data = os.urandom(300 * 1024)
+    with monkeypatch.context() as patch:
+        patch.setattr(settings, "GRIDFS_BUCKETS", {})
+        file_id = storage.file_create_record(
+            data,
+            FileMetadata(
+                filename="package.zip", category=FileCategory.UIPATH_AP
+            ),
+        )
+    assert storage.file_get_record({"_id": file_id}).bucket == "fs"
+
+    assert migrate(storage, dry_run=True) == {"fs -> packages": 1}
+    assert migrate(storage) == {"fs -> packages": 1}
+    assert migrate(storage) == {}
+
+    file = storage.file_get_record({"_id": file_id})
+    assert file.bucket == "packages"
+    file_data = storage.file_open_data(file.gridfs_id, file.bucket)
+    assert file_data.chunk_size == settings.GRIDFS_CHUNK_SIZES["packages"]
+    assert not gridfs.GridFS(storage.db).exists(ObjectId(file.gridfs_id))
+
+    response = client.get(f"{API}/files/{file_id}/unrestricted/download")
+    assert response.status_code == 200
+    assert response.content == data
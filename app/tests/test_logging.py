@@ -0,0 +1,31 @@
+import json
+import logging
+import queue
+
+from core.config import DroppingQueueHandler, JsonFormatter
+
+
+def test_queued_records_keep_the_exception():
+    handler = DroppingQueueHandler(queue.Queue())
+    logger = logging.getLogger("test_logging")
+    logger.addHandler(handler)
+    try:
+        try:
+            raise ValueError("broken")
+        except ValueError:
+            logger.exception("failed %s", "request")
+    finally:
+        logger.removeHandler(handler)
+
+    entry = json.loads(JsonFormatter().format(handler.queue.get_nowait()))
+    assert entry["message"] == "failed request"
+    assert "ValueError: broken" in entry["exception"]
+
+
+def test_full_queue_drops_records():
+    handler = DroppingQueueHandler(queue.Queue(maxsize=1))
+    for _ in range(3):
+        handler.handle(logging.makeLogRecord({"levelname": "INFO"}))
+
+    assert handler.queue.qsize() == 1
+    assert handler.dropped == {"INFO": 2}
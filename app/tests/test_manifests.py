@@ -0,0 +1,149 @@
+import io
+import os
+from zipfile import ZIP_BZIP2, ZIP_DEFLATED, ZIP_STORED, ZipFile
+
+import pytest
+from core.config import settings
+from core.manifests import manifest_indexer, read_manifest, stream_member
+from schemas.file import FileCategory, FileMetadata
+
+API = "/api/v1"
+
+
+def make_package(members) -> bytes:
+    buffer = io.BytesIO()
+    with ZipFile(buffer, "w") as package:
+        for path, data, compress_type in members:
+            package.writestr(path, data, compress_type=compress_type)
+    return buffer.getvalue()
+
+
+def test_packages_are_indexed(client, commands, make_agents):
+    (agent_id,) = make_agents(1)
+    package = make_package(
+        [
+            ("project.json", b'{"name": "agent"}', ZIP_DEFLATED),
+            ("lib/agent.dll", os.urandom(64 * 1024), ZIP_STORED),
+        ]
+    )
+    response = client.patch(
+        f"{API}/agents/{agent_id}",
+        files={"uipath_agent_package": ("agent.nupkg", package)},
+    )
+    assert response.status_code == 200
+    file_id = response.json()["uipath_agent_package"]["id"]
+    manifest_indexer.wait()
+
+    with commands.capture() as log:
+        response = client.get(f"{API}/files/{file_id}/manifest")
+    assert response.status_code == 200
+    assert log == ["find files"]
+
+    members = response.json()["members"]
+    with ZipFile(io.BytesIO(package)) as zip:
+        assert members == [
+            {
+                "path": info.filename,
+                "size": info.file_size,
+                "compressed_size": info.compress_size,
+                "crc": info.CRC,
+                "offset": info.header_offset,
+                "compress_type": info.compress_type,
+            }
+            for info in zip.infolist()
+        ]
+
+    # a replaced package is indexed again
+    response = client.patch(
+        f"{API}/agents/{agent_id}",
+        files={
+            "uipath_agent_package": (
+                "agent.nupkg",
+                make_package([("main.xaml", b"<Activity/>", ZIP_DEFLATED)]),
+            )
+        },
+    )
+    assert response.json()["uipath_agent_package"]["id"] == file_id
+    response = client.get(f"{API}/files/{file_id}/manifest")
+    assert [m["path"] for m in response.json()["members"]] == ["main.xaml"]
+
+
+def test_manifest_of_unindexed_files(client, backend):
+    def make_file(data: bytes, category: FileCategory) -> str:
+        return backend.file_create_record(
+            data, FileMetadata(filename="file", category=category)
+        )
+
+    file_id = make_file(
+        make_package([("a.txt", b"a", ZIP_STORED)]), FileCategory.PA_DESK_AP
+    )
+    assert backend.file_get_manifest(file_id) is None
+    response = client.get(f"{API}/files/{file_id}/manifest")
+    assert response.status_code == 200
+    assert response.json()["members"][0]["path"] == "a.txt"
+    assert backend.file_get_manifest(file_id) is not None
+
+    file_id = make_file(b"not a zip", FileCategory.UIPATH_AP)
+    response = client.get(f"{API}/files/{file_id}/manifest")
+    assert response.status_code == 200
+    assert response.json()["members"] == []
+    assert response.json()["error"]
+
+    file_id = make_file(b"logo", FileCategory.LOGO)
+    response = client.get(f"{API}/files/{file_id}/manifest")
+    assert response.status_code == 404
+
+
+def test_member_download(client, commands, make_agents, monkeypatch):
+    monkeypatch.setitem(settings.GRIDFS_CHUNK_SIZES, "packages", 4096)
+    (agent_id,) = make_agents(1)
+    project = b'{"name": "agent", "dependencies": {}}' * 100
+    package = make_package(
+        [
+            ("lib/agent.dll", os.urandom(200 * 1024), ZIP_STORED),
+            ("content/project.json", project, ZIP_DEFLATED),
+            ("lib/", b"", ZIP_STORED),
+        ]
+    )
+    response = client.patch(
+        f"{API}/agents/{agent_id}",
+        files={"uipath_agent_package": ("agent.nupkg", package)},
+    )
+    file_id = response.json()["uipath_agent_package"]["id"]
+    manifest_indexer.wait()
+
+    with commands.capture() as log:
+        response = client.get(
+            f"{API}/files/{file_id}/members/content/project.json"
+        )
+    assert response.status_code == 200
+    assert response.content == project
+    assert response.headers["Content-Type"] == "application/json"
+    # the member is near the end of a 51 chunk package
+    assert log.count("find packages.chunks") <= 2
+
+    response = client.get(f"{API}/files/{file_id}/members/lib/agent.dll")
+    assert response.status_code == 200
+    with ZipFile(io.BytesIO(package)) as zip:
+        assert response.content == zip.read("lib/agent.dll")
+
+    for path in ["missing.txt", "lib/"]:
+        response = client.get(f"{API}/files/{file_id}/members/{path}")
+        assert response.status_code == 404
+
+
+@pytest.mark.parametrize("compress_type", [ZIP_DEFLATED, ZIP_BZIP2])
+def test_member_stream_is_bounded(compress_type):
+    data = bytes(8 * 1024 * 1024) + os.urandom(1024)
+    package = make_package([("zeros.bin", data, compress_type)])
+    (member,) = read_manifest(io.BytesIO(package)).members
+
+    chunks = list(stream_member(io.BytesIO(package), member, 4096))
+    assert max(len(chunk) for chunk in chunks) <= 4096
+    assert b"".join(chunks) == data
+
+    # the listed size is the Content-Length, so it must match
+    for size in (member.size - 1, member.size + 1):
+        listed = member.model_copy(update={"size": size})
+        with pytest.raises(ValueError):
+            list(stream_member(io.BytesIO(package), listed, 4096))
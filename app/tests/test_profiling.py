@@ -0,0 +1,34 @@
+from core.config import settings
+from core.memory_storage import MemoryStorage
+from core.profiling import ProfilingMiddleware
+from core.storage import get_storage
+from fastapi.testclient import TestClient
+
+API = "/api/v1"
+
+
+def test_profiles_follow_storage_overrides(client, monkeypatch):
+    monkeypatch.setattr(settings, "ADMIN_TOKEN", "secret")
+    headers = {"X-Admin-Token": "secret"}
+    # mongomock has no capped collections, so profiles are only stored
+    # in memory here
+    memory = MemoryStorage()
+    monkeypatch.setitem(
+        client.app.dependency_overrides, get_storage, lambda: memory
+    )
+    profiled = TestClient(ProfilingMiddleware(client.app))
+
+    response = profiled.get(
+        f"{API}/agents", headers={**headers, "X-Profile": "1"}
+    )
+    assert response.status_code == 200
+    request_id = response.headers["X-Profile-Id"]
+
+    # the admin routes read from the backend the request was served by
+    response = client.get(f"{API}/admin/profiles", headers=headers)
+    assert response.status_code == 200
+    assert [p["request_id"] for p in response.json()] == [request_id]
+    response = client.get(
+        f"{API}/admin/profiles/{request_id}", headers=headers
+    )
+    assert response.status_code == 200
@@ -0,0 +1,49 @@
+from typing import List
+
+import pytest
+from core.config import settings
+from core.storage import MongoStorage, secondary_reads
+
+API = "/api/v1"
+
+
+@pytest.fixture
+def reads(monkeypatch) -> List[str]:
+    """Records where each database access of the storage reads from"""
+    routes = []
+    db = MongoStorage.db
+
+    def spy(self):
+        routes.append("secondary" if secondary_reads.get() else "primary")
+        return db.fget(self)
+
+    monkeypatch.setattr(MongoStorage, "db", property(spy))
+    return routes
+
+
+@pytest.mark.parametrize("enabled", [True, False])
+def test_listing_reads(client, make_agents, reads, monkeypatch, enabled):
+    monkeypatch.setattr(settings, "MONGO_SECONDARY_READS", enabled)
+    make_agents(3)
+    reads.clear()
+
+    assert client.get(f"{API}/agents").status_code == 200
+    assert reads
+    assert set(reads) == {"secondary" if enabled else "primary"}
+
+
+def test_read_after_write_stays_on_primary(
+    client, make_agents, reads, monkeypatch
+):
+    monkeypatch.setattr(settings, "MONGO_SECONDARY_READS", True)
+    (agent_id,) = make_agents(1)
+    reads.clear()
+
+    assert client.get(f"{API}/agents").status_code == 200
+    assert set(reads) == {"secondary"}
+
+    # the flag does not leak into the next request
+    reads.clear()
+    assert client.get(f"{API}/agents/{agent_id}").status_code == 200
+    assert reads
+    assert set(reads) == {"primary"}
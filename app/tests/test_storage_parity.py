@@ -0,0 +1,232 @@
+"""
+Walks the routes whose other tests hold them to a mongo command budget,
+once on each backend, so MemoryStorage answers them the way mongo does.
+"""
+
+import io
+import json
+from zipfile import ZIP_DEFLATED, ZipFile
+
+from schemas.file import FileCategory, FileMetadata
+
+API = "/api/v1"
+ALL_FILES = FileCategory.list()
+
+
+def test_agent_routes(client, backend, make_agents):
+    agent_ids = make_agents(3, ALL_FILES)
+
+    response = client.get(f"{API}/agents", params={"limit": 2})
+    assert response.status_code == 200
+    page = response.json()
+    assert page["item_count"] == 2
+    response = client.get(
+        f"{API}/agents", params={"limit": 2, "cursor": page["next_cursor"]}
+    )
+    assert response.json()["item_count"] == 1
+
+    response = client.get(
+        f"{API}/agents", params={"fields": "name", "expand": "logo"}
+    )
+    assert response.status_code == 200
+    agent = response.json()["items"][0]
+    assert agent["name"].startswith("agent")
+    assert agent["logo"]["filename"] == "logo.zip"
+
+    response = client.get(
+        f"{API}/agents:batch", params={"ids": ",".join(agent_ids[:2])}
+    )
+    assert response.status_code == 200
+    assert [a["id"] for a in response.json()["items"]] == agent_ids[:2]
+
+    response = client.get(f"{API}/agents/export")
+    assert response.status_code == 200
+    exported = [json.loads(line) for line in response.text.splitlines()]
+    assert sorted(agent["id"] for agent in exported) == sorted(agent_ids)
+
+    agent_id = agent_ids[0]
+    response = client.get(f"{API}/agents/{agent_id}")
+    assert response.status_code == 200
+    logo_id = response.json()["logo"]["id"]
+
+    response = client.patch(
+        f"{API}/agents/{agent_id}/details_update", json={"name": "renamed"}
+    )
+    assert response.status_code == 200
+    assert response.json()["name"] == "renamed"
+
+    response = client.patch(
+        f"{API}/agents/{agent_id}", files={"logo": ("logo.png", b"new")}
+    )
+    assert response.status_code == 200
+    assert response.json()["logo"]["id"] == logo_id
+    assert backend.file_get_data(logo_id) == b"new"
+
+    for reaction in ("like", "like"):
+        response = client.post(
+            f"{API}/agents/{agent_id}/review", json={"reaction": reaction}
+        )
+        assert response.status_code == 200
+
+    response = client.delete(f"{API}/agents/{agent_id}")
+    assert response.status_code == 200
+    assert client.get(f"{API}/agents/{agent_id}").status_code == 404
+    assert backend.file_get_record({"_id": logo_id}) is None
+
+
+def test_new_and_imported_agents(client, backend):
+    response = client.post(
+        f"{API}/agents",
+        data={
+            "name": "agent",
+            "description": "An automation agent",
+            "platforms": ["UiPath"],
+            "api_keys_required": ["KEY"],
+        },
+        files={
+            category: (f"{category}.zip", b"data") for category in ALL_FILES
+        },
+    )
+    assert response.status_code == 200
+    agent = response.json()
+    for category in ALL_FILES:
+        assert backend.file_get_data(agent[category]["id"]) == b"data"
+
+    manifest = "\n".join(
+        json.dumps(
+            {
+                "name": f"agent {i}",
+                "description": "An automation agent",
+                "platforms": ["UiPath"],
+                "api_keys_required": [],
+                "files": {"logo": "logo.png"},
+            }
+        )
+        for i in range(3)
+    )
+    response = client.post(
+        f"{API}/agents/import",
+        files=[
+            ("manifest", ("manifest.ndjson", manifest.encode())),
+            ("artifacts", ("logo.png", b"logo")),
+        ],
+    )
+    assert response.status_code == 200
+    assert response.json()["created_count"] == 3
+    response = client.get(f"{API}/agents", params={"limit": 10})
+    assert response.json()["item_count"] == 4
+
+
+def test_consultant_routes(client, backend, make_consultants):
+    consultant_ids = make_consultants(2)
+
+    response = client.get(f"{API}/consultants")
+    assert response.status_code == 200
+    assert response.json()["item_count"] == 2
+    response = client.get(
+        f"{API}/consultants:batch", params={"ids": ",".join(consultant_ids)}
+    )
+    assert len(response.json()["items"]) == 2
+    response = client.get(f"{API}/consultants/export")
+    assert len(response.text.splitlines()) == 2
+
+    consultant_id = consultant_ids[0]
+    response = client.patch(
+        f"{API}/consultants/{consultant_id}/details",
+        json={"name": "renamed"},
+    )
+    assert response.status_code == 200
+    response = client.get(f"{API}/consultants/{consultant_id}")
+    assert response.json()["name"] == "renamed"
+
+    response = client.patch(
+        f"{API}/consultants/{consultant_id}/files",
+        files={"resume_file": ("resume.pdf", b"new resume")},
+    )
+    assert response.status_code == 200
+
+    response = client.post(
+        f"{API}/consultants/{consultant_id}/review",
+        json={"reaction": "love"},
+    )
+    assert response.status_code == 200
+
+    response = client.delete(f"{API}/consultants/{consultant_id}")
+    assert response.status_code == 200
+    assert client.get(f"{API}/consultants/{consultant_id}").status_code == 404
+
+
+def test_file_routes(client, backend):
+    data = bytes(range(256)) * 1000
+    file_id = backend.file_create_record(
+        data, FileMetadata(filename="package.zip")
+    )
+
+    for path in ("download", "unrestricted/download"):
+        response = client.get(f"{API}/files/{file_id}/{path}")
+        assert response.status_code == 200
+        assert response.content == data
+
+    response = client.get(
+        f"{API}/files/{file_id}/download", headers={"Range": "bytes=10-99"}
+    )
+    assert response.status_code == 206
+    assert response.content == data[10:100]
+    response = client.get(
+        f"{API}/files/{file_id}/download",
+        headers={"Range": f"bytes={len(data)}-"},
+    )
+    assert response.status_code == 416
+
+
+def test_package_routes(client, backend, make_agents):
+    (agent_id,) = make_agents(1)
+    buffer = io.BytesIO()
+    with ZipFile(buffer, "w") as package:
+        package.writestr(
+            "content/project.json", b'{"name": "agent"}', ZIP_DEFLATED
+        )
+    response = client.patch(
+        f"{API}/agents/{agent_id}",
+        files={"uipath_agent_package": ("agent.nupkg", buffer.getvalue())},
+    )
+    file_id = response.json()["uipath_agent_package"]["id"]
+
+    response = client.get(f"{API}/files/{file_id}/manifest")
+    assert response.status_code == 200
+    assert [m["path"] for m in response.json()["members"]] == [
+        "content/project.json"
+    ]
+    response = client.get(
+        f"{API}/files/{file_id}/members/content/project.json"
+    )
+    assert response.status_code == 200
+    assert response.content == b'{"name": "agent"}'
+
+
+def test_upload_routes(client, backend, make_agents):
+    (agent_id,) = make_agents(1)
+    response = client.post(
+        f"{API}/uploads",
+        json={
+            "agent_id": agent_id,
+            "category": FileCategory.LOGO.value,
+            "filename": "logo.png",
+            "length": 10,
+        },
+    )
+    assert response.status_code == 201
+    upload_id = response.json()["id"]
+
+    response = client.patch(
+        f"{API}/uploads/{upload_id}",
+        content=b"01234",
+        headers={"Upload-Offset": "0"},
+    )
+    assert response.status_code == 204
+    response = client.head(f"{API}/uploads/{upload_id}")
+    assert response.headers["Upload-Offset"] == "5"
+
+    response = client.delete(f"{API}/uploads/{upload_id}")
+    assert response.status_code == 200
+    assert client.head(f"{API}/uploads/{upload_id}").status_code == 404
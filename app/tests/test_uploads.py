@@ -0,0 +1,209 @@
+import os
+import threading
+import time
+from datetime import datetime, timezone
+
+import pytest
+from bson.objectid import ObjectId
+from core.config import settings
+from core.storage import storage
+from fastapi import HTTPException
+from schemas.file import FileCategory
+
+API = "/api/v1"
+
+
+@pytest.fixture
+def upload_settings(monkeypatch):
+    """Small chunks and writes so uploads span several of each"""
+    monkeypatch.setitem(settings.GRIDFS_CHUNK_SIZES, "packages", 1000)
+    monkeypatch.setattr(settings, "UPLOAD_WRITE_SIZE", 700)
+    return settings
+
+
+def start_upload(client, agent_id: str, length: int) -> str:
+    response = client.post(
+        f"{API}/uploads",
+        json={
+            "agent_id": agent_id,
+            "category": FileCategory.UIPATH_AP.value,
+            "filename": "package.zip",
+            "length": length,
+        },
+    )
+    assert response.status_code == 201
+    return response.json()["id"]
+
+
+def send(client, upload_id: str, offset: int, data: bytes):
+    return client.patch(
+        f"{API}/uploads/{upload_id}",
+        content=data,
+        headers={"Upload-Offset": str(offset)},
+    )
+
+
+def get_offset(client, upload_id: str) -> int:
+    response = client.head(f"{API}/uploads/{upload_id}")
+    assert response.status_code == 200
+    return int(response.headers["Upload-Offset"])
+
+
+def test_resumable_upload(client, backend, make_agents, upload_settings):
+    (agent_id,) = make_agents(1, [FileCategory.UIPATH_AP])
+    data = os.urandom(4321)
+    upload_id = start_upload(client, agent_id, len(data))
+
+    response = send(client, upload_id, 0, data[:1234])
+    assert response.status_code == 204
+    assert response.headers["Upload-Offset"] == "1234"
+    assert send(client, upload_id, 1000, data[1000:]).status_code == 409
+
+    # the interrupted client asks where to resume from
+    offset = get_offset(client, upload_id)
+    assert offset == 1234
+    response = client.post(f"{API}/uploads/{upload_id}/complete")
+    assert response.status_code == 409
+
+    response = send(client, upload_id, offset, data[offset:3001])
+    assert response.status_code == 204
+    assert send(client, upload_id, 3001, data[3001:]).status_code == 204
+    assert get_offset(client, upload_id) == len(data)
+
+    response = client.post(f"{API}/uploads/{upload_id}/complete")
+    assert response.status_code == 200
+    file = response.json()["uipath_agent_package"]
+    assert file["filename"] == "package.zip"
+    assert client.head(f"{API}/uploads/{upload_id}").status_code == 404
+
+    # the upload replaced the agent's previous package
+    files = backend.file_get_all_records(
+        {"agent_id": agent_id, "category": FileCategory.UIPATH_AP}
+    )
+    assert [f.id for f in files] == [file["id"]]
+    response = client.get(f"{API}/files/{file['id']}/unrestricted/download")
+    assert response.content == data
+
+
+def test_interleaved_appends(client, make_agents, upload_settings):
+    (agent_id,) = make_agents(1)
+    data = os.urandom(2500)
+    upload_id = start_upload(client, agent_id, len(data))
+    # both requests passed the offset check before either appended
+    upload = storage.upload_verify_record({"_id": upload_id})
+    store = storage._get_upload_store(upload.store)
+    append = store.append
+
+    def append_while_held(bucket, key, offset, piece):
+        # the other append arrives while this one writes its chunks
+        with pytest.raises(HTTPException) as ex:
+            storage.upload_append_data(upload, 0, os.urandom(1500))
+        assert ex.value.status_code == 409
+        append(bucket, key, offset, piece)
+
+    with pytest.MonkeyPatch.context() as patch:
+        patch.setattr(store, "append", append_while_held)
+        assert storage.upload_append_data(upload, 0, data[:1500]) == 1500
+
+    # a stale retry of the first append leaves the committed chunks
+    with pytest.raises(HTTPException) as ex:
+        storage.upload_append_data(upload, 0, os.urandom(1500))
+    assert ex.value.status_code == 409
+    assert send(client, upload_id, 1500, data[1500:]).status_code == 204
+
+    file_id, _ = storage.upload_complete_record(
+        storage.upload_verify_record({"_id": upload_id})
+    )
+    assert storage.file_get_data(file_id) == data
+
+
+def test_concurrent_completes(client, make_agents, upload_settings):
+    (agent_id,) = make_agents(1)
+    data = os.urandom(2500)
+    upload_id = start_upload(client, agent_id, len(data))
+    assert send(client, upload_id, 0, data).status_code == 204
+
+    # both requests verified the upload before either completed it
+    upload = storage.upload_verify_record({"_id": upload_id})
+    file_id, replaced = storage.upload_complete_record(upload)
+    assert replaced is None
+    with pytest.raises(HTTPException) as ex:
+        storage.upload_complete_record(upload)
+    assert ex.value.status_code == 409
+
+    assert storage.file_get_data(file_id) == data
+    assert storage.db["packages.files"].count_documents({}) == 1
+
+
+def test_filesystem_upload(
+    client, make_agents, upload_settings, monkeypatch, tmp_path
+):
+    monkeypatch.setattr(settings, "BLOB_FILESYSTEM_ROOT", str(tmp_path))
+    monkeypatch.setattr(
+        settings, "BLOB_STORES", {FileCategory.UIPATH_AP.value: "filesystem"}
+    )
+    monkeypatch.setattr(storage, "_blob_stores", {})
+    (agent_id,) = make_agents(1)
+    data = os.urandom(2500)
+    upload_id = start_upload(client, agent_id, len(data))
+
+    assert send(client, upload_id, 0, data[:999]).status_code == 204
+    assert send(client, upload_id, 999, data[999:]).status_code == 204
+    response = client.post(f"{API}/uploads/{upload_id}/complete")
+    assert response.status_code == 200
+
+    file = storage.file_get_record(
+        {"_id": response.json()["uipath_agent_package"]["id"]}
+    )
+    assert file.gridfs_id.startswith("filesystem:")
+    assert storage.file_get_data(file.id) == data
+
+
+def test_expired_uploads_are_deleted(client, make_agents, upload_settings):
+    (agent_id,) = make_agents(1)
+    upload_id = start_upload(client, agent_id, 2000)
+    assert send(client, upload_id, 0, os.urandom(1500)).status_code == 204
+    assert storage.upload_delete_expired_records() == 0
+
+    other_id = start_upload(client, agent_id, 2000)
+    assert send(client, other_id, 0, os.urandom(1500)).status_code == 204
+    storage.db["uploads"].update_one(
+        {"_id": ObjectId(other_id)},
+        {"$set": {"expires_at": datetime.now(timezone.utc)}},
+    )
+    assert client.head(f"{API}/uploads/{other_id}").status_code == 404
+    assert storage.upload_delete_expired_records() == 1
+
+    response = client.delete(f"{API}/uploads/{upload_id}")
+    assert response.status_code == 200
+    assert storage.db["packages.chunks"].count_documents({}) == 0
+
+
+def test_cleanup_ends_before_storage_closes(client, monkeypatch):
+    from core.memory_storage import MemoryStorage
+    from core.storage import get_storage
+    from fastapi.testclient import TestClient
+
+    events = []
+    sweeping = threading.Event()
+    backend = MemoryStorage()
+
+    def delete_expired_records():
+        sweeping.set()
+        time.sleep(0.2)
+        events.append("swept")
+        return 0
+
+    monkeypatch.setattr(
+        backend, "upload_delete_expired_records", delete_expired_records
+    )
+    monkeypatch.setattr(backend, "close", lambda: events.append("closed"))
+    monkeypatch.setitem(
+        client.app.dependency_overrides, get_storage, lambda: backend
+    )
+    monkeypatch.setattr(settings, "UPLOAD_CLEANUP_INTERVAL_SECONDS", 3600)
+
+    # a sweep still running at shutdown is waited for
+    with TestClient(client.app):
+        assert sweeping.wait(5)
+    assert events == ["swept", "closed"]
@@ -0,0 +1,208 @@
+import os
+
+import pytest
+from api.v1.routers.agent import prune_file_versions
+from core.blobs import place_upload
+from core.config import settings
+from core.dedup import split_chunks
+from core.manifests import manifest_indexer
+from core.storage import get_bucket, storage
+from schemas.file import FileCategory, FileMetadata
+
+API = "/api/v1"
+
+
+@pytest.fixture
+def dedup_settings(monkeypatch):
+    """Places agent packages in the dedup store"""
+    monkeypatch.setattr(
+        settings, "BLOB_STORES", {FileCategory.UIPATH_AP.value: "dedup"}
+    )
+    monkeypatch.setattr(storage, "_blob_stores", {})
+    return settings
+
+
+@pytest.fixture(autouse=True)
+def version_settings(monkeypatch):
+    """Keeps versions of agent packages"""
+    monkeypatch.setattr(
+        settings, "FILE_VERSION_CATEGORIES", [FileCategory.UIPATH_AP.value]
+    )
+    return settings
+
+
+def upload_package(client, agent_id: str, data: bytes) -> str:
+    response = client.patch(
+        f"{API}/agents/{agent_id}",
+        files={"uipath_agent_package": ("agent.nupkg", data)},
+    )
+    assert response.status_code == 200
+    manifest_indexer.wait()
+    return response.json()["uipath_agent_package"]["id"]
+
+
+def test_split_chunks_is_local():
+    data = os.urandom(2 * 1024 * 1024)
+    edited = data[:1000000] + b"inserted" + data[1000000:]
+
+    chunks = list(split_chunks(data, 4096, 65536, 12))
+    assert b"".join(chunks) == data
+    assert all(len(chunk) <= 65536 for chunk in chunks)
+    assert all(len(chunk) >= 4096 for chunk in chunks[:-1])
+
+    # only the chunks around the insertion change
+    changed = set(split_chunks(edited, 4096, 65536, 12)) - set(chunks)
+    assert len(changed) <= 2
+
+
+def test_dedup_versions(client, make_agents, dedup_settings):
+    (agent_id,) = make_agents(1)
+    bucket = get_bucket(FileCategory.UIPATH_AP)
+    chunks = storage.db[f"{bucket}.dedup_chunks"]
+    v1 = os.urandom(1024 * 1024)
+    v2 = v1[:500000] + b"a small change" + v1[500000:]
+
+    file_id = upload_package(client, agent_id, v1)
+    stored = chunks.count_documents({})
+    assert upload_package(client, agent_id, v2) == file_id
+    # the new version only adds the chunks around the change
+    assert chunks.count_documents({}) - stored <= 2
+
+    response = client.get(f"{API}/files/{file_id}/unrestricted/download")
+    assert response.content == v2
+    file = storage.file_get_record({"_id": file_id})
+    assert storage.file_get_data_sizes([file]) == {file.gridfs_id: len(v2)}
+
+    response = client.get(f"{API}/files/{file_id}/versions")
+    assert response.status_code == 200
+    (version,) = response.json()
+    response = client.get(
+        f"{API}/files/{file_id}/versions/{version['id']}/download"
+    )
+    assert response.status_code == 200
+    assert response.content == v1
+
+    # a restore swaps the data of the file and the version
+    response = client.post(
+        f"{API}/files/{file_id}/versions/{version['id']}/restore"
+    )
+    assert response.status_code == 200
+    assert storage.file_get_data(file_id) == v1
+    response = client.get(
+        f"{API}/files/{file_id}/versions/{version['id']}/download"
+    )
+    assert response.content == v2
+
+    client.delete(f"{API}/agents/{agent_id}")
+    assert storage.file_version_get_all_records(file_id) == []
+    assert chunks.count_documents({}) == 0
+    assert storage.db[f"{bucket}.dedup_blobs"].count_documents({}) == 0
+
+
+def test_dedup_chunks_are_bulk_written(commands, dedup_settings, monkeypatch):
+    monkeypatch.setattr(settings, "DEDUP_BATCH_SIZE", 1000)
+    bucket = get_bucket(FileCategory.UIPATH_AP)
+    metadata = FileMetadata(
+        filename="agent.nupkg", category=FileCategory.UIPATH_AP
+    )
+    data = os.urandom(1024 * 1024)
+
+    # one lookup and one write for every batch of chunks
+    with commands.capture() as log:
+        file_id = storage.file_create_record(data, metadata)
+    assert log.count(f"find {bucket}.dedup_chunks") == 1
+    assert log.count(f"bulkWrite {bucket}.dedup_chunks") == 1
+    assert storage.file_get_data(file_id) == data
+
+    with commands.capture() as log:
+        storage.file_delete_record({"_id": file_id})
+    assert log.count(f"bulkWrite {bucket}.dedup_chunks") == 1
+    assert storage.db[f"{bucket}.dedup_chunks"].count_documents({}) == 0
+
+
+def test_dedup_rewrites_chunks_deleted_since_lookup(
+    dedup_settings, monkeypatch
+):
+    store = storage._get_blob_store("dedup")
+    bucket = get_bucket(FileCategory.UIPATH_AP)
+    chunks = store._get_chunks(bucket)
+    batch = {b"a": b"data a", b"b": b"data b"}
+    chunks.insert_one({"_id": b"a", "refs": 1, "data": b"data a", "size": 6})
+
+    # b was looked up as stored, then deleted with its last reference
+    with monkeypatch.context() as patch:
+        patch.setattr(
+            type(chunks),
+            "find",
+            lambda *args: iter([{"_id": b"a"}, {"_id": b"b"}]),
+        )
+        store._store_chunks(bucket, batch)
+
+    assert {
+        c["_id"]: (c["refs"], bytes(c["data"])) for c in chunks.find()
+    } == {
+        b"a": (2, b"data a"),
+        b"b": (1, b"data b"),
+    }
+
+
+def test_versions_are_pruned(client, backend, make_agents, monkeypatch):
+    monkeypatch.setattr(settings, "FILE_VERSIONS_KEPT", 2)
+    (agent_id,) = make_agents(1)
+    packages = [os.urandom(1024) for _ in range(5)]
+    for package in packages:
+        file_id = upload_package(client, agent_id, package)
+
+    versions = backend.file_version_get_all_records(file_id)
+    assert [backend.file_get_data(file_id)] + [
+        backend.file_open_data(v.gridfs_id, v.bucket).read() for v in versions
+    ] == packages[::-1][:3]
+
+    response = client.get(
+        f"{API}/files/{file_id}/versions/{'0' * 24}/download"
+    )
+    assert response.status_code == 404
+
+    # other categories are not versioned
+    (agent_id,) = make_agents(1, ["logo"])
+    response = client.patch(
+        f"{API}/agents/{agent_id}", files={"logo": ("logo.png", b"new")}
+    )
+    logo_id = response.json()["logo"]["id"]
+    assert backend.file_version_get_all_records(logo_id) == []
+
+
+def test_prune_skips_restored_versions(
+    client, backend, make_agents, monkeypatch
+):
+    (agent_id,) = make_agents(1)
+    packages = [os.urandom(1024) for _ in range(3)]
+    for package in packages:
+        file_id = upload_package(client, agent_id, package)
+    stale = backend.file_version_get_all_records(file_id)
+
+    # a restore lands between the prune reading and deleting versions
+    response = client.post(
+        f"{API}/files/{file_id}/versions/{stale[-1].id}/restore"
+    )
+    assert response.status_code == 200
+    with monkeypatch.context() as patch:
+        patch.setattr(settings, "FILE_VERSIONS_KEPT", 0)
+        patch.setattr(
+            backend, "file_version_get_all_records", lambda file_id: stale
+        )
+        prune_file_versions(backend, file_id)
+
+    assert backend.file_get_data(file_id) == packages[0]
+    (kept,) = backend.file_version_get_all_records(file_id)
+    assert kept.id == stale[-1].id
+    assert backend.file_open_data(kept.gridfs_id, kept.bucket).read() == (
+        packages[2]
+    )
+
+
+def test_uploads_skip_the_dedup_store(dedup_settings):
+    # chunked blobs cannot be appended to, so uploads go to GridFS
+    assert place_upload(FileCategory.UIPATH_AP.value, 1024) == "gridfs"
+    with pytest.raises(ValueError):
+        storage._get_upload_store("dedup")